@@ -34,12 +34,27 @@ if "bpy" in locals():
 	importlib.reload(looking_glass_render_setup)
 	importlib.reload(looking_glass_settings)
 	importlib.reload(holoplay_service_api_commands)
+	importlib.reload(holoplay_service_framing)
+	importlib.reload(holoplay_service_sender)
+	importlib.reload(looking_glass_quilt)
+	importlib.reload(looking_glass_color)
+	importlib.reload(looking_glass_interlace)
+	importlib.reload(looking_glass_view_synthesis)
+	importlib.reload(looking_glass_sequence)
+	importlib.reload(looking_glass_cache)
+	importlib.reload(looking_glass_quilt_file)
+	importlib.reload(looking_glass_recorder)
+	importlib.reload(looking_glass_quilt_bus)
+	importlib.reload(looking_glass_memory)
+	importlib.reload(looking_glass_quilt_writer)
+	importlib.reload(looking_glass_api)
 else:
 	from . import *
 	from . looking_glass_render_setup import *
 	from . looking_glass_live_view import *
 	from . looking_glass_settings import *
 	from . holoplay_service_api_commands import *
+	from . import looking_glass_api
 
 if "looking_glass_live_view" not in globals():
 	message = ("\n\n"
@@ -66,6 +81,51 @@ from bpy.props import FloatProperty, PointerProperty
 # global var to store the holoplay core instance
 hp = None
 
+def update_cache_size(self, context):
+	looking_glass_cache.decoded_cache.resize(self.cache_size * 2**20)
+
+def update_memory_budget(self, context):
+	looking_glass_memory.governor.set_budgets(self.memory_budget * 2**20, self.gpu_memory_budget * 2**20)
+
+# ------------- The Add-on Preferences ----------------
+class looking_glass_preferences(AddonPreferences):
+
+	bl_idname = __name__
+
+	cache_size: bpy.props.IntProperty(
+		name = "Image Cache Size (MB)",
+		default = 2048,
+		min = 0,
+		max = 262144,
+		description = "Memory used to keep decoded views and assembled quilts of multiview renders around for scrubbing",
+		update = update_cache_size,
+		)
+
+	memory_budget: bpy.props.IntProperty(
+		name = "Memory Budget (MB)",
+		default = 8192,
+		min = 0,
+		max = 1048576,
+		description = "Host memory the add-on may use for quilts, caches and buffers. Caches are emptied and new jobs refused beyond it, 0 for no limit",
+		update = update_memory_budget,
+		)
+
+	gpu_memory_budget: bpy.props.IntProperty(
+		name = "GPU Memory Budget (MB)",
+		default = 2048,
+		min = 0,
+		max = 1048576,
+		description = "GPU memory the add-on may use for offscreens and quilt textures, 0 for no limit",
+		update = update_memory_budget,
+		)
+
+	def draw(self, context):
+		layout = self.layout
+		layout.prop(self, "cache_size")
+		row = layout.row(align = True)
+		row.prop(self, "memory_budget")
+		row.prop(self, "gpu_memory_budget")
+
 # ------------- The Tools Panel ----------------
 class looking_glass_render_viewer(bpy.types.Panel):
 
@@ -82,16 +142,71 @@ class looking_glass_render_viewer(bpy.types.Panel):
 		description = "Multiview Image for LKG"
 		)
 
+	bpy.types.Scene.LKG_quilt_file = bpy.props.StringProperty(
+		name="Quilt File",
+		subtype='FILE_PATH',
+		description = "Quilt animation file (.lkgq) written by the batch converter, its frames follow the timeline"
+		)
+
+	bpy.types.Scene.LKG_render_quilt = bpy.props.BoolProperty(
+		name="Write Quilt",
+		default=False,
+		description = "Assemble the views of every rendered frame into a single quilt image"
+		)
+
+	bpy.types.Scene.LKG_keep_views = bpy.props.BoolProperty(
+		name="Keep Views",
+		default=True,
+		description = "Keep the separate view images next to the quilt image"
+		)
+
+	bpy.types.Scene.LKG_dither = bpy.props.BoolProperty(
+		name="Dither Float Images",
+		default=False,
+		description = "Add a little noise when converting float images like EXR renders to 8 bit quilts, hides banding in smooth gradients"
+		)
+
 	def draw(self, context):
 		layout = self.layout
 		layout.operator("lookingglass.render_setup", text="Create Render Setup", icon='PLUGIN')
+		layout.operator("lookingglass.render_missing_views", text="Resume Render", icon='RENDER_ANIMATION')
 		layout.operator("lookingglass.send_quilt_to_holoplay_service", text="Send Quilt", icon='CAMERA_STEREO')
+		layout.operator("lookingglass.save_interlaced_image", text="Save Interlaced Image", icon='IMAGE_DATA')
+		row = layout.row(align = True)
+		recording = looking_glass_settings.recorder is not None
+		row.operator("lookingglass.record_session", text="Stop Recording" if recording else "Record Session", icon='REC', depress=recording)
+		replay = looking_glass_live_view.hp_replay
+		replaying = replay is not None and replay[0].is_alive()
+		row.operator("lookingglass.replay_recording", text="Stop Replay" if replaying else "Replay", icon='PLAY', depress=replaying)
 		# layout.operator("view3d.offscreen_draw", text="Start/Stop Live View", icon='CAMERA_STEREO')
 
 		row = layout.row(align = True)
 		row.label(text = "LKG image to view:")
 		row = layout.row(align = True)
 		row.template_ID(context.scene, "LKG_image", open="image.open")
+		row = layout.row(align = True)
+		row.prop(context.scene, "LKG_quilt_file", text="")
+		bake = looking_glass_live_view.hp_bake
+		if bake is None:
+			layout.operator("lookingglass.bake_quilts", text="Bake Quilts", icon='RENDER_ANIMATION')
+		else:
+			row = layout.row(align = True)
+			row.label(text="Baking %d / %d" % (bake.done, len(bake.frames)))
+			row.operator("lookingglass.cancel_bake", text="", icon='CANCEL')
+		quilt_render = looking_glass_live_view.hp_quiltRender
+		if quilt_render is None:
+			layout.operator("lookingglass.render_quilts", text="Render Quilts (Viewport)", icon='RENDER_ANIMATION')
+		else:
+			row = layout.row(align = True)
+			row.label(text="Rendering %d / %d" % (quilt_render.done, len(quilt_render.frames)))
+			row.operator("lookingglass.cancel_quilt_render", text="", icon='CANCEL')
+
+		row = layout.row(align = True)
+		row.prop(context.scene, "LKG_render_quilt")
+		row = row.row(align = True)
+		row.active = context.scene.LKG_render_quilt
+		row.prop(context.scene, "LKG_keep_views")
+		layout.prop(context.scene, "LKG_dither")
 
 
 # ------------- The Config Panel ----------------
@@ -156,6 +271,46 @@ class looking_glass_panel(bpy.types.Panel):
 			max = 100,
 			description = "How many views to store horizontally",
 			)
+	bpy.types.WindowManager.viewSynthesisAnchors = bpy.props.IntProperty(
+			name = "Anchor Views",
+			default = 0,
+			min = 0,
+			max = 100,
+			description = "Only draw this many views with depth and synthesize the views in between for faster previews. 0 draws every view",
+			)
+	bpy.types.WindowManager.progressivePreview = bpy.props.EnumProperty(
+			name = "Preview",
+			items = [('OFF', "Off", "Always send the full resolution quilt"),
+					('1024', "1024", "Send a 1024 pixel wide preview first"),
+					('2048', "2048", "Send a 2048 pixel wide preview first")],
+			default = 'OFF',
+			description = "Send a downsampled quilt first and the full resolution quilt once the scene did not change for a moment",
+			)
+	bpy.types.WindowManager.progressiveSettleTime = bpy.props.FloatProperty(
+			name = "Settle Time",
+			default = 0.5,
+			min = 0.0,
+			max = 10.0,
+			description = "Seconds without scene changes before the full resolution quilt follows the preview",
+			)
+	bpy.types.WindowManager.streamPlayback = bpy.props.BoolProperty(
+			name = "Stream Playback",
+			default = False,
+			description = "Render and send a quilt for every frame while the timeline plays. Frames are dropped when the Looking Glass cannot keep up",
+			update = update_stream_playback,
+			)
+	bpy.types.WindowManager.mirrorLiveView = bpy.props.BoolProperty(
+			name = "Mirror Live View",
+			default = False,
+			description = "Send the quilts the live view window renders to the Looking Glass as well, without rendering them a second time",
+			update = update_mirror_live_view,
+			)
+	bpy.types.WindowManager.useSenderProcess = bpy.props.BoolProperty(
+			name = "Sender Process",
+			default = False,
+			description = "Encode and send quilts in a separate process that reads them from a shared ring buffer, keeps Blender responsive while sending",
+			update = update_sender_process,
+			)
 	bpy.types.WindowManager.numDevicesConnected = bpy.props.IntProperty(
 			name = "Connected Devices",
 			default = 0,
@@ -174,13 +329,53 @@ class looking_glass_panel(bpy.types.Panel):
 		else:
 			text = "Found " + str(wm.numDevicesConnected) + " connected LKG devices."
 			layout.label(text=text, icon='CAMERA_STEREO')
+		layout.prop(wm, "viewSynthesisAnchors")
+		row = layout.row(align = True)
+		row.prop(wm, "progressivePreview")
+		row.prop(wm, "progressiveSettleTime", text="")
+		layout.prop(wm, "streamPlayback")
+		streamer = looking_glass_live_view.hp_streamer
+		if wm.streamPlayback and streamer is not None:
+			layout.label(text="Device: %.1f fps, %d dropped" % (streamer.fps, streamer.frames_dropped))
+		layout.prop(wm, "mirrorLiveView")
+		mirror = looking_glass_live_view.hp_subscriptions.get('device')
+		if wm.mirrorLiveView and mirror is not None:
+			layout.label(text="Mirrored %d quilts, skipped %d" % (mirror.delivered, mirror.skipped))
+		layout.prop(wm, "useSenderProcess")
+		sender = looking_glass_settings.sender
+		if wm.useSenderProcess and sender is not None:
+			if not sender.is_running():
+				layout.label(text="Sender process stopped", icon='ERROR')
+			else:
+				layout.label(text="Sender: %.1f fps, %.0f ms latency, %d dropped" % (sender.fps, sender.latency * 1000.0, sender.frames_dropped))
+
+		governor = looking_glass_memory.governor
+		usage = governor.usage()
+		host = sum(host for host, gpu in usage.values())
+		gpu = sum(gpu for host, gpu in usage.values())
+		box = layout.box()
+		box.label(text="Memory: %d / %d MB, GPU: %d / %d MB" % (host // 2**20, governor.host_budget // 2**20,
+			gpu // 2**20, governor.gpu_budget // 2**20), icon='MEMORY')
+		col = box.column(align = True)
+		for name, (host, gpu) in usage.items():
+			if host + gpu >= 2**20:
+				col.label(text="%s: %d MB%s" % (name, host // 2**20, ", GPU %d MB" % (gpu // 2**20) if gpu else ""))
 
 classes = (
+	looking_glass_preferences,
 	OffScreenDraw,
 	lkgRenderSetup,
+	lkgRenderMissingViews,
 	looking_glass_panel,
 	looking_glass_render_viewer,
 	looking_glass_send_quilt_to_holoplay_service,
+	looking_glass_save_interlaced_image,
+	looking_glass_bake_quilts,
+	looking_glass_cancel_bake,
+	looking_glass_render_quilts,
+	looking_glass_cancel_quilt_render,
+	looking_glass_record_session,
+	looking_glass_replay_recording,
 )
 
 def register():
@@ -189,6 +384,17 @@ def register():
 	for cls in classes:
 		register_class(cls)
 
+	preferences = bpy.context.preferences.addons[__name__].preferences
+	looking_glass_cache.decoded_cache.resize(preferences.cache_size * 2**20)
+	looking_glass_memory.governor.set_budgets(preferences.memory_budget * 2**20, preferences.gpu_memory_budget * 2**20)
+
+	if looking_glass_render_setup.write_quilt_handler not in bpy.app.handlers.render_write:
+		bpy.app.handlers.render_write.append(looking_glass_render_setup.write_quilt_handler)
+	if looking_glass_settings.scene_changed_handler not in bpy.app.handlers.depsgraph_update_post:
+		bpy.app.handlers.depsgraph_update_post.append(looking_glass_settings.scene_changed_handler)
+	if looking_glass_live_view.stream_frame_handler not in bpy.app.handlers.frame_change_post:
+		bpy.app.handlers.frame_change_post.append(looking_glass_live_view.stream_frame_handler)
+
 	looking_glass_settings.init()
 
 	wm = bpy.context.window_manager
@@ -196,6 +402,26 @@ def register():
 
 def unregister():
 	from bpy.utils import unregister_class
+	if looking_glass_render_setup.write_quilt_handler in bpy.app.handlers.render_write:
+		bpy.app.handlers.render_write.remove(looking_glass_render_setup.write_quilt_handler)
+	if looking_glass_settings.scene_changed_handler in bpy.app.handlers.depsgraph_update_post:
+		bpy.app.handlers.depsgraph_update_post.remove(looking_glass_settings.scene_changed_handler)
+	looking_glass_settings.cancel_progressive_send()
+	if looking_glass_live_view.stream_frame_handler in bpy.app.handlers.frame_change_post:
+		bpy.app.handlers.frame_change_post.remove(looking_glass_live_view.stream_frame_handler)
+	looking_glass_live_view.stop_streaming()
+	looking_glass_settings.stop_sender()
+	looking_glass_live_view.hp_subscriptions.clear()
+	looking_glass_live_view.hp_quiltBus.clear()
+	looking_glass_live_view.free_shared_offscreens(force=True)
+	looking_glass_live_view.free_quilt_target()
+	if looking_glass_settings.recorder is not None:
+		looking_glass_settings.recorder.close()
+		looking_glass_settings.recorder = None
+	if looking_glass_live_view.hp_bake is not None:
+		looking_glass_live_view.hp_bake.cancelled = True
+	if looking_glass_live_view.hp_quiltRender is not None:
+		looking_glass_live_view.hp_quiltRender.cancelled = True
 	for cls in reversed(classes):
 		unregister_class(cls)
 	bpy.types.IMAGE_MT_view.remove(looking_glass_live_view.menu_func)
@@ -0,0 +1,145 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Builds HoloPlay Service messages with large binary payloads without going through
+# cbor.dumps. A message is the CBOR map {'cmd': ..., 'bin': <byte string>}, so it can be
+# written as a pre-encoded prefix up to the 'bin' key, the byte string length and the
+# payload. Quilts are written as BMP straight into a preallocated buffer that is handed
+# to pynng as is. Does not import bpy.
+
+import json
+import logging
+import os
+import struct
+import numpy as np
+
+log = logging.getLogger('holoplay_service')
+
+# the prefix of a message only depends on its command, it is encoded once per command
+_prefixes = {}
+# message buffers are reused as long as the payload size does not change
+_frame_buffers = {}
+
+bmp_header = struct.Struct('<2sIHHIIiiHHIIiiII')
+bmp_header_size = bmp_header.size
+
+def cbor_bytestring_head(length):
+    ''' CBOR head of a byte string (major type 2) of the given length '''
+    if length < 24:
+        return bytes((0x40 | length,))
+    if length < 0x100:
+        return struct.pack('>BB', 0x58, length)
+    if length < 0x10000:
+        return struct.pack('>BH', 0x59, length)
+    if length < 0x100000000:
+        return struct.pack('>BI', 0x5a, length)
+    return struct.pack('>BQ', 0x5b, length)
+
+def message_prefix(cmd):
+    ''' CBOR encoding of {'cmd': cmd, 'bin': ...} up to the length of the binary data '''
+    key = json.dumps(cmd, sort_keys=True)
+    prefix = _prefixes.get(key)
+    if prefix is None:
+        import cbor
+        # a map with two entries, then the text keys 'cmd' and 'bin'
+        prefix = b'\xa2' + cbor.dumps('cmd') + cbor.dumps(cmd) + cbor.dumps('bin')
+        if len(_prefixes) > 64:
+            _prefixes.clear()
+        _prefixes[key] = prefix
+    return prefix
+
+def frame_buffer(size):
+    ''' Returns a reused bytearray of exactly size bytes '''
+    buffer = _frame_buffers.get(size)
+    if buffer is None:
+        if len(_frame_buffers) > 4:
+            _frame_buffers.clear()
+        buffer = _frame_buffers[size] = bytearray(size)
+    return buffer
+
+def write_bmp(buffer, offset, pixels):
+    ''' Writes height x width x 4 uint8 RGBA or x 3 RGB pixels (rows bottom to top) as 32 bit BMP into buffer at offset
+
+    BMP stores rows bottom to top as well, so the rows are copied in order and only the channels are swizzled.
+    RGB pixels, e.g. from quilt files, get an opaque alpha channel.
+    '''
+    height, width = pixels.shape[:2]
+    image_size = width * height * 4
+    bmp_header.pack_into(buffer, offset, b'BM', bmp_header_size + image_size, 0, 0, bmp_header_size,
+        40, width, height, 1, 32, 0, image_size, 0, 0, 0, 0)
+    start = offset + bmp_header_size
+    bgra = np.frombuffer(buffer, dtype=np.uint8, count=image_size, offset=start).reshape(height, width, 4)
+    bgra[:, :, 0] = pixels[:, :, 2]
+    bgra[:, :, 1] = pixels[:, :, 1]
+    bgra[:, :, 2] = pixels[:, :, 0]
+    if pixels.shape[2] > 3:
+        bgra[:, :, 3] = pixels[:, :, 3]
+    else:
+        bgra[:, :, 3] = 255
+    return bmp_header_size + image_size
+
+def encode_message(cmd, payload=b''):
+    ''' Builds a message around an already encoded payload, e.g. a PNG file '''
+    prefix = message_prefix(cmd)
+    head = cbor_bytestring_head(len(payload))
+    if len(payload) < 0x100000:
+        # small commands are cheaper to concatenate than to keep buffers around for
+        return prefix + head + bytes(payload)
+    buffer = frame_buffer(len(prefix) + len(head) + len(payload))
+    view = memoryview(buffer)
+    view[:len(prefix)] = prefix
+    view[len(prefix):len(prefix) + len(head)] = head
+    view[len(prefix) + len(head):] = payload
+    return buffer
+
+def encode_quilt_message(cmd, pixels):
+    ''' Builds a message with the quilt (height x width x 4 or 3 uint8, rows bottom to top) as BMP payload '''
+    height, width = pixels.shape[:2]
+    bmp_size = bmp_header_size + width * height * 4
+    prefix = message_prefix(cmd)
+    head = cbor_bytestring_head(bmp_size)
+    buffer = frame_buffer(len(prefix) + len(head) + bmp_size)
+    view = memoryview(buffer)
+    view[:len(prefix)] = prefix
+    view[len(prefix):len(prefix) + len(head)] = head
+    write_bmp(buffer, len(prefix) + len(head), pixels)
+    return buffer
+
+def encode_file_message(cmd, filepath):
+    ''' Builds a message with the contents of a file as payload, reading the file straight into the message '''
+    size = os.path.getsize(filepath)
+    prefix = message_prefix(cmd)
+    head = cbor_bytestring_head(size)
+    offset = len(prefix) + len(head)
+    buffer = frame_buffer(offset + size)
+    view = memoryview(buffer)
+    view[:len(prefix)] = prefix
+    view[len(prefix):offset] = head
+    with open(filepath, 'rb') as f:
+        if f.readinto(view[offset:]) != size:
+            raise IOError("Could not read all of " + filepath)
+    return buffer
+
+def send_frame(sock, frame):
+    ''' Sends an encoded message and returns the decoded response of HoloPlay Service '''
+    import cbor
+    # pynng hands bytes and bytearrays to nng_send directly, there is no copy on the Python side
+    sock.send(frame)
+    response = cbor.loads(sock.recv())
+    log.debug("Sent %d bytes, response: %s", len(frame), response)
+    return response
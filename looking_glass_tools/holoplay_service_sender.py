@@ -0,0 +1,222 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Sends quilts to HoloPlay Service from a separate process, so encoding and sending
+# do not compete with Blender for the GIL. Blender copies a quilt into a slot of a
+# ring buffer in a memory mapped file and names the slot in a line of JSON on the
+# stdin of the sender. The sender encodes the quilt straight out of the mapped file
+# and answers every quilt with a line of JSON on its stdout, carrying the latency.
+# Python 3.7 has no multiprocessing.shared_memory, the ring buffer file is placed in
+# /dev/shm where it exists. Does not import bpy.
+#
+# Sender process:
+#     python holoplay_service_sender.py --ring /dev/shm/lkg_sender.ring --slots 3 --slot-size 67108864
+
+import argparse
+import json
+import mmap
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+import numpy as np
+
+driver_url = "ipc:///tmp/holoplay-driver.ipc"
+
+def ring_directory():
+    ''' Shared memory where the system offers it as a file system, else the temporary directory '''
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+def map_ring(filepath, size, create=False):
+    ''' Maps the ring buffer file, the Blender side creates it with the full size '''
+    if create:
+        # the quilts in the ring are only for this user to read
+        fd = os.open(filepath, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            if hasattr(os, 'fchmod'):
+                # O_CREAT only applies the mode to new files
+                os.fchmod(fd, 0o600)
+            os.ftruncate(fd, size)
+        finally:
+            os.close(fd)
+    with open(filepath, 'r+b') as f:
+        return mmap.mmap(f.fileno(), size)
+
+class SenderProcess:
+    ''' Blender side of the sender process: owns the ring buffer and keeps track of free slots '''
+
+    def __init__(self, python_binary, slots=3, slot_size=4096 * 4096 * 4):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ring_path = os.path.join(ring_directory(), "lkg_sender_%d.ring" % os.getpid())
+        self.ring = map_ring(self.ring_path, slots * slot_size, create=True)
+        self._free = deque(range(slots))
+        self._submitted = {}
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self.latencies = deque(maxlen=30)
+        self._ack_times = deque(maxlen=30)
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.last_error = None
+        script = os.path.abspath(__file__)
+        self.process = subprocess.Popen([python_binary, script, "--ring", self.ring_path,
+            "--slots", str(slots), "--slot-size", str(slot_size)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        self._reader = threading.Thread(target=self._read_acks, daemon=True)
+        self._reader.start()
+
+    def is_running(self):
+        return self.process.poll() is None
+
+    def is_behind(self):
+        ''' True when every slot is waiting to be sent '''
+        return not self._free
+
+    def submit(self, quilt, settings):
+        ''' Copies a height x width x 4 uint8 quilt into a free slot and hands it to the sender, False when dropped '''
+        if quilt.nbytes > self.slot_size or not self.is_running():
+            return False
+        with self._lock:
+            if not self._free:
+                self.frames_dropped += 1
+                return False
+            slot = self._free.popleft()
+            message_id = self._next_id
+            self._next_id += 1
+        target = np.frombuffer(self.ring, dtype=np.uint8, count=quilt.nbytes, offset=slot * self.slot_size)
+        np.copyto(target.reshape(quilt.shape), quilt)
+        del target
+        sent_at = time.time()
+        message = {'id': message_id, 'slot': slot, 'shape': quilt.shape, 'settings': settings, 'time': sent_at}
+        with self._lock:
+            self._submitted[message_id] = slot
+        try:
+            self.process.stdin.write((json.dumps(message) + "\n").encode('utf-8'))
+        except OSError as error:
+            self.last_error = error
+            with self._lock:
+                self._submitted.pop(message_id, None)
+                self._free.append(slot)
+            return False
+        return True
+
+    def _read_acks(self):
+        for line in self.process.stdout:
+            try:
+                ack = json.loads(line.decode('utf-8'))
+            except ValueError:
+                continue
+            with self._lock:
+                slot = self._submitted.pop(ack.get('id'), None)
+                if slot is not None:
+                    self._free.append(slot)
+            if ack.get('error'):
+                self.last_error = ack['error']
+                continue
+            self.frames_sent += 1
+            self.latencies.append(ack['latency'])
+            self._ack_times.append(time.monotonic())
+
+    @property
+    def fps(self):
+        times = self._ack_times
+        if len(times) < 2 or times[-1] == times[0]:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    @property
+    def latency(self):
+        ''' Average seconds from submitting a quilt until HoloPlay Service answered it '''
+        if not self.latencies:
+            return 0.0
+        return sum(self.latencies) / len(self.latencies)
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=5.0)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        try:
+            self.ring.close()
+        except BufferError:
+            # a numpy view of a slot is still alive, the mapping goes away with it
+            pass
+        try:
+            os.remove(self.ring_path)
+        except OSError:
+            pass
+
+# ------------- Sender process ----------------
+
+def sender_main(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ring", required=True)
+    parser.add_argument("--slots", type=int, required=True)
+    parser.add_argument("--slot-size", type=int, required=True)
+    parser.add_argument("--url", default=driver_url)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from holoplay_service_framing import encode_quilt_message, send_frame
+    from holoplay_service_api_commands import show_quilt
+    import pynng
+
+    ring = map_ring(args.ring, args.slots * args.slot_size)
+    out = sys.stdout.buffer
+    sock = pynng.Req0(recv_timeout=2000)
+    try:
+        sock.dial(args.url, block=True)
+    except Exception as error:
+        sock.close()
+        sock = None
+        connect_error = "Could not connect to HoloPlay Service: " + str(error)
+
+    # stdin is closed by Blender to stop the sender
+    for line in sys.stdin.buffer:
+        message = json.loads(line.decode('utf-8'))
+        ack = {'id': message['id']}
+        try:
+            if sock is None:
+                raise RuntimeError(connect_error)
+            shape = tuple(message['shape'])
+            size = int(np.prod(shape))
+            quilt = np.frombuffer(ring, dtype=np.uint8, count=size, offset=message['slot'] * args.slot_size).reshape(shape)
+            frame = encode_quilt_message(show_quilt(None, message['settings'])['cmd'], quilt)
+            del quilt
+            ack['response'] = send_frame(sock, frame)
+            ack['latency'] = time.time() - message['time']
+        except Exception as error:
+            ack['error'] = str(error)
+        out.write((json.dumps(ack, default=str) + "\n").encode('utf-8'))
+        out.flush()
+    if sock is not None:
+        sock.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(sender_main(sys.argv[1:]))
@@ -0,0 +1,110 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Functions for scripts that drive the add-on. Unlike the operators they do not push undo
+# steps and return their results instead of leaving them in globals, e.g.
+#
+#   from looking_glass_tools import looking_glass_api as lkg
+#   layout = lkg.quilt_settings(5, 9, 0.75)
+#   lkg.build_rig(layout)
+#   for frame in range(1, 251):
+#       lkg.send(lkg.render_quilt(bpy.context.scene, frame, layout), layout)
+#
+# With an open 3D view quilts are drawn by the viewport renderer. In blender -b there are no
+# windows, then the views of the render setup are rendered with the render engine of the scene.
+
+import os
+import shutil
+import tempfile
+import bpy
+from . import looking_glass_settings
+from . looking_glass_settings import send_quilt_pixels
+from . looking_glass_quilt import QuiltAssembler, quilt_settings
+from . looking_glass_render_setup import build_rig, get_rig_views, load_view_uint8
+from . looking_glass_live_view import find_view3d_context, draw_quilt
+
+def render_quilt(scene, frame, layout):
+	''' Draws the views of a frame with the viewport renderer at the render resolution of the scene
+
+	Returns a height x width x 4 uint8 quilt, rows bottom to top. The shading of the first open 3D view is used,
+	without one (blender -b) the frame is rendered with render_quilt_views. The scene is left at the frame.
+	'''
+	layout = quilt_settings(layout['vx'], layout['vy'], layout['aspect'], layout.get('vtotal'))
+	view_context = find_view3d_context(bpy.context)
+	if view_context is None:
+		return render_quilt_views(scene, frame, layout)
+	if view_context.scene != scene:
+		view_context.scene = scene
+		view_context.view_layer = scene.view_layers[0]
+	quilt = draw_quilt(view_context, frame, layout)
+	if quilt is None:
+		raise MemoryError("Rendering a quilt does not fit the memory budget of the add-on preferences")
+	# the quilt is read back into the same buffer for every frame
+	return quilt.copy()
+
+def render_quilt_views(scene, frame, layout):
+	''' Renders the views of the render setup with the render engine of the scene and assembles them into a quilt
+
+	Works without windows, e.g. in blender -b. The views are written to a temporary directory,
+	the output settings of the scene are restored afterwards. The scene is left at the frame.
+	'''
+	layout = quilt_settings(layout['vx'], layout['vy'], layout['aspect'], layout.get('vtotal'))
+	render = scene.render
+	rig_views = get_rig_views(scene)[:layout['vtotal']]
+	if not render.use_multiview or not rig_views:
+		raise RuntimeError("Rendering a quilt without a 3D view needs the render setup, see build_rig")
+	wanted = set(view for view, name in rig_views)
+	image_settings = render.image_settings
+	directory = tempfile.mkdtemp(prefix='lkg_quilt_')
+	overrides = [(render, 'filepath', os.path.join(directory, 'view_')), (image_settings, 'file_format', 'PNG'),
+		(image_settings, 'color_mode', 'RGBA'), (image_settings, 'color_depth', '8'), (image_settings, 'compression', 0)]
+	# the quilt is assembled here, the render handler does not have to write one
+	if hasattr(scene, 'LKG_render_quilt'):
+		overrides.append((scene, 'LKG_render_quilt', False))
+	overrides += [(view, 'use', int(view.name.rsplit('.', 1)[1]) in wanted) for view in render.views if view.name.startswith('view.')]
+
+	restore = []
+	try:
+		for owner, key, value in overrides:
+			restore.append((owner, key, getattr(owner, key)))
+			setattr(owner, key, value)
+		scene.frame_set(frame)
+		bpy.ops.render.render(write_still=True, scene=scene.name)
+		assembler = None
+		for view, name in rig_views:
+			pixels = load_view_uint8(render.frame_path(frame=frame, view=name), scene)
+			if assembler is None:
+				height, width = pixels.shape[:2]
+				assembler = QuiltAssembler(layout['vx'], layout['vy'], width, height, 4, len(rig_views))
+			assembler.add_view(view, pixels)
+	finally:
+		for owner, key, value in reversed(restore):
+			setattr(owner, key, value)
+		shutil.rmtree(directory, ignore_errors=True)
+	return assembler.quilt
+
+def send(quilt, layout):
+	''' Shows a height x width x 4 uint8 quilt, rows bottom to top, in the Looking Glass
+
+	Goes through the sender process when it runs, otherwise straight to HoloPlay Service.
+	'''
+	sender = looking_glass_settings.sender
+	if looking_glass_settings.sock is None and (sender is None or not sender.is_running()):
+		raise RuntimeError("Not connected to HoloPlay Service")
+	settings = quilt_settings(layout['vx'], layout['vy'], layout['aspect'], layout.get('vtotal'))
+	return send_quilt_pixels(looking_glass_settings.sock, quilt, settings)
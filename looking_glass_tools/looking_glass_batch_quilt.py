@@ -0,0 +1,182 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+''' Converts rendered multiview sequences into quilt images without the user interface.
+
+Usage:
+	blender -b -P looking_glass_batch_quilt.py -- <render directory> --frames 1-250
+	python looking_glass_batch_quilt.py <render directory> --frames 1-250 --jobs 16
+	python looking_glass_batch_quilt.py <render directory> --container animation.lkgq
+
+The frames are spread across a process pool, every worker assembles whole quilts on the CPU.
+'''
+
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import timeit
+import numpy as np
+
+try:
+	from . looking_glass_quilt import QuiltAssembler, quilt_settings, quilt_filepath
+	from . looking_glass_sequence import parse_frame_range, parse_multiview_filename, scan_multiview_sequence
+	from . looking_glass_quilt_file import create_quilt_file, write_quilt_frame
+except ImportError:
+	# executed as a script by blender -P or python
+	from looking_glass_quilt import QuiltAssembler, quilt_settings, quilt_filepath
+	from looking_glass_sequence import parse_frame_range, parse_multiview_filename, scan_multiview_sequence
+	from looking_glass_quilt_file import create_quilt_file, write_quilt_frame
+
+log = logging.getLogger('looking_glass_batch_quilt')
+
+def load_view(filepath):
+	''' Decodes an image file into a bottom to top height x width x 4 uint8 array '''
+	from PIL import Image
+	with Image.open(filepath) as img:
+		pixels = np.asarray(img.convert('RGBA'))
+	# PIL stores rows top to bottom, quilts are assembled bottom to top like in OpenGL
+	return pixels[::-1]
+
+def save_quilt(filepath, quilt, settings):
+	''' Writes a quilt with its layout stored in the file name and, for PNG, in text chunks '''
+	from PIL import Image, PngImagePlugin
+	img = Image.fromarray(quilt[::-1])
+	if filepath.lower().endswith('.png'):
+		info = PngImagePlugin.PngInfo()
+		for key in ('vx', 'vy', 'vtotal', 'aspect'):
+			info.add_text(key, str(settings[key]))
+		img.save(filepath, pnginfo=info, compress_level=1)
+	else:
+		img.convert('RGB').save(filepath)
+
+def convert_frame(task):
+	''' Process pool worker: assembles the quilt of one frame and writes it to an image or a quilt file '''
+	frame, view_paths, output_path, settings = task[:4]
+	container = task[4] if len(task) > 4 else None
+	start_time = timeit.default_timer()
+	assembler = None
+	for view, filepath in sorted(view_paths.items()):
+		pixels = load_view(filepath)
+		if assembler is None:
+			height, width = pixels.shape[:2]
+			assembler = QuiltAssembler(settings['vx'], settings['vy'], width, height, 4, settings['vtotal'])
+		assembler.add_view(view, pixels)
+	if container is not None:
+		write_quilt_frame(container, frame, assembler.quilt)
+		output_path = container
+	else:
+		save_quilt(output_path, assembler.quilt, settings)
+	return frame, output_path, timeit.default_timer() - start_time
+
+def build_tasks(frames_on_disk, frames, output_directory, prefix, extension, settings):
+	''' Returns one task per frame that has all of its views on disk '''
+	tasks = []
+	for frame in frames:
+		view_paths = frames_on_disk.get(frame)
+		if not view_paths:
+			log.warning("Frame %d not found, skipping it", frame)
+			continue
+		missing = [view for view in range(settings['vtotal']) if view not in view_paths]
+		if missing:
+			log.warning("Frame %d is missing %d views, skipping it", frame, len(missing))
+			continue
+		name = prefix + (str(frame).zfill(4) if frame is not None else '') + '.' + extension
+		output_path = quilt_filepath(os.path.join(output_directory, name), settings)
+		tasks.append((frame, view_paths, output_path, settings))
+	return tasks
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description="Convert multiview render sequences into Looking Glass quilts.")
+	parser.add_argument("directory", help="directory containing the rendered views")
+	parser.add_argument("--frames", default=None, help="frame range, e.g. 1-250 or 1-10,20 (default: all frames found)")
+	parser.add_argument("--output", default=None, help="output directory (default: the render directory)")
+	parser.add_argument("--prefix", default=None, help="file name prefix of the sequence (default: autodetect)")
+	parser.add_argument("--columns", type=int, default=5, help="views per row of the quilt")
+	parser.add_argument("--rows", type=int, default=9, help="views per column of the quilt")
+	# renders of the render setup use non-square pixels, so the aspect cannot be told from the images
+	parser.add_argument("--aspect", type=float, required=True, help="aspect ratio of the Looking Glass, e.g. 0.75 for Portrait or 1.6 for 8.9\"")
+	parser.add_argument("--format", default="png", choices=("png", "jpg", "bmp"), help="quilt image format")
+	parser.add_argument("--container", default=None, help="write all frames into one memory mappable quilt animation file instead of images")
+	parser.add_argument("--jobs", type=int, default=multiprocessing.cpu_count(), help="number of worker processes")
+	return parser.parse_args(argv)
+
+def main(argv=None):
+	if argv is None:
+		# arguments after -- belong to this script when running inside Blender
+		argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+	args = parse_args(argv)
+	logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+	try:
+		import PIL
+	except ImportError:
+		log.error("Pillow is required. Enable the Looking Glass add-on once to install it.")
+		return 1
+
+	settings = quilt_settings(args.columns, args.rows, args.aspect)
+	output_directory = args.output or args.directory
+	os.makedirs(output_directory, exist_ok=True)
+
+	frames_on_disk = scan_multiview_sequence(args.directory, args.prefix)
+	if not frames_on_disk:
+		log.error("No multiview images found in %s", args.directory)
+		return 1
+	some_path = next(iter(next(iter(frames_on_disk.values())).values()))
+	prefix = parse_multiview_filename(os.path.basename(some_path))[0]
+	frames = parse_frame_range(args.frames) if args.frames else sorted(frames_on_disk, key=lambda f: f or 0)
+	tasks = build_tasks(frames_on_disk, frames, output_directory, prefix, args.format, settings)
+	if not tasks:
+		log.error("Nothing to do")
+		return 1
+
+	if args.container:
+		if tasks[0][0] is None:
+			log.error("Quilt files need a sequence with frame numbers")
+			return 1
+		from PIL import Image
+		# all frames of a quilt file have the same size, take it from the first view without decoding it
+		with Image.open(next(iter(tasks[0][1].values()))) as img:
+			view_width, view_height = img.size
+		frame_start = tasks[0][0]
+		frame_count = tasks[-1][0] - frame_start + 1
+		create_quilt_file(args.container, settings['vx'] * view_width, settings['vy'] * view_height, 3,
+			settings, frame_start, frame_count)
+		tasks = [task + (args.container,) for task in tasks]
+
+	jobs = max(1, min(args.jobs, len(tasks)))
+	log.info("Quilting %d frames with %d processes", len(tasks), jobs)
+	start_time = timeit.default_timer()
+	# spawn instead of fork, forking Blender is not safe
+	with multiprocessing.get_context('spawn').Pool(jobs) as pool:
+		for done, (frame, output_path, seconds) in enumerate(pool.imap_unordered(convert_frame, tasks), 1):
+			elapsed = timeit.default_timer() - start_time
+			fps = done / elapsed
+			log.info("[%d/%d] frame %s -> %s (%.2fs), %.2f frames/s, %.0fs left",
+				done, len(tasks), frame, os.path.basename(output_path), seconds, fps, (len(tasks) - done) / fps)
+
+	elapsed = timeit.default_timer() - start_time
+	log.info("Quilted %d frames in %.2fs (%.2f frames/s)", len(tasks), elapsed, len(tasks) / elapsed)
+	return 0
+
+if __name__ == "__main__":
+	# import ourselves as a regular module so the process pool can find the worker function
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+	import looking_glass_batch_quilt
+	sys.exit(looking_glass_batch_quilt.main())
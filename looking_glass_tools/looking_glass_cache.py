@@ -0,0 +1,93 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Memory bounded caches for decoded views and assembled quilts. Does not import bpy.
+
+import threading
+from collections import OrderedDict
+
+class ByteLRUCache:
+	''' Least recently used cache that evicts entries once their total size exceeds max_bytes
+
+	Values are expected to be numpy arrays, they are made read-only since every reader shares them.
+	'''
+
+	def __init__(self, max_bytes, name="cache"):
+		self.name = name
+		self.max_bytes = max_bytes
+		self.current_bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, key):
+		''' Returns the cached value or None, marking it as recently used '''
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return None
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return entry[0]
+
+	def put(self, key, value, nbytes=None):
+		''' Stores a value, values bigger than the whole budget are not cached '''
+		if nbytes is None:
+			nbytes = value.nbytes
+		if nbytes > self.max_bytes:
+			return value
+		if hasattr(value, 'flags'):
+			value.flags.writeable = False
+		with self._lock:
+			old = self._entries.pop(key, None)
+			if old is not None:
+				self.current_bytes -= old[1]
+			self._entries[key] = (value, nbytes)
+			self.current_bytes += nbytes
+			self._evict()
+		return value
+
+	def _evict(self):
+		while self.current_bytes > self.max_bytes and self._entries:
+			key, (value, nbytes) = self._entries.popitem(last=False)
+			self.current_bytes -= nbytes
+
+	def resize(self, max_bytes):
+		with self._lock:
+			self.max_bytes = max_bytes
+			self._evict()
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self.current_bytes = 0
+
+	def __len__(self):
+		return len(self._entries)
+
+	def __contains__(self, key):
+		return key in self._entries
+
+	def __repr__(self):
+		return "%s: %d entries, %.1f of %.1f MB, %d hits, %d misses" % (self.name, len(self._entries),
+			self.current_bytes / 2**20, self.max_bytes / 2**20, self.hits, self.misses)
+
+# decoded views are keyed by ('view', path, mtime, size), quilts by ('quilt', layout, view keys)
+decoded_cache = ByteLRUCache(2048 * 2**20, "Decoded views and quilts")
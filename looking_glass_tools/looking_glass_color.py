@@ -0,0 +1,137 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Converts scene linear float views, e.g. from EXR renders, into 8 bit display values.
+# Exposure, view transform, display gamma and the sRGB encoding are baked into one
+# lookup table. The table is indexed by the square root of the scaled value, which
+# spends more entries on the dark values where the sRGB curve is steep. Does not
+# import bpy.
+
+import numpy as np
+from . looking_glass_quilt import staging_array, float_to_uint8
+
+lut_size = 16384
+# values converted per chunk of rows
+chunk_size = 1 << 18
+# the dither noise repeats after this many chunks
+noise_chunks = 4
+# scene linear value Filmic maps to white, the approximation below reaches white there too
+filmic_white = 16.291
+
+def srgb_encode(linear):
+	''' sRGB transfer function for 0-1 linear values '''
+	linear = np.clip(linear, 0.0, 1.0)
+	return np.where(linear <= 0.0031308, linear * 12.92, 1.055 * np.power(linear, 1.0 / 2.4) - 0.055)
+
+def view_transform_curve(linear, view_transform):
+	''' Display values of scene linear values, before the display gamma '''
+	if view_transform == 'Raw':
+		return np.clip(linear, 0.0, 1.0)
+	if view_transform == 'Filmic':
+		# extended Reinhard tone curve as an approximation, Filmic itself needs OpenColorIO
+		tone = linear * (1.0 + linear / (filmic_white * filmic_white)) / (1.0 + linear)
+		return srgb_encode(tone)
+	# Standard, and the fallback for view transforms without an equivalent here
+	return srgb_encode(linear)
+
+class ColorTransform:
+	''' Exposure, view transform, gamma and sRGB encoding of float pixels into uint8 in one lookup '''
+
+	def __init__(self, exposure=0.0, gamma=1.0, view_transform='Standard', dither=False):
+		self.key = (exposure, gamma, view_transform, dither)
+		self.dither = dither
+		scale = 2.0 ** exposure
+		# scene linear value that maps to the last entry, everything above ends up white
+		white = filmic_white if view_transform == 'Filmic' else 1.0
+		self.domain = white / scale
+		self.index_scale = lut_size * lut_size / self.domain
+		# stays below lut_size after the square root in float32
+		self.index_limit = (lut_size - 0.5) ** 2
+		# every entry holds the value in the middle of its bucket, so truncating the index rounds
+		centers = ((np.arange(lut_size, dtype=np.float64) + 0.5) / lut_size) ** 2 * self.domain
+		display = view_transform_curve(centers * scale, view_transform)
+		if gamma != 1.0:
+			display = np.power(display, 1.0 / gamma)
+		if dither:
+			# +0.5 so truncating after adding the noise rounds
+			self.lut = (display * 255.0 + 0.5).astype(np.float32)
+		else:
+			self.lut = np.rint(display * 255.0).astype(np.uint8)
+
+	def apply(self, src, out=None):
+		''' Converts height x width x channels floats into out (uint8 of the same shape, e.g. a quilt tile)
+
+		Alpha is quantized linearly, only the color channels go through the lookup table.
+		'''
+		height, width, channels = src.shape
+		if out is None:
+			out = np.empty(src.shape, dtype=np.uint8)
+		# a few rows at a time stay in the cache, np.take wants native integer indices anyway
+		rows = max(1, chunk_size // (width * channels))
+		scratch = staging_array("color_scratch", (rows, width, channels), np.float32)
+		index = staging_array("color_index", (rows, width, channels), np.intp)
+		if self.dither:
+			noise = dither_noise((rows * noise_chunks, width, channels))
+		for y in range(0, height, rows):
+			n = min(rows, height - y)
+			chunk, chunk_scratch, chunk_index, chunk_out = src[y:y + n], scratch[:n], index[:n], out[y:y + n]
+			np.multiply(chunk, self.index_scale, out=chunk_scratch)
+			np.clip(chunk_scratch, 0.0, self.index_limit, out=chunk_scratch)
+			np.sqrt(chunk_scratch, out=chunk_scratch)
+			np.copyto(chunk_index, chunk_scratch, casting='unsafe')
+			if self.dither:
+				np.take(self.lut, chunk_index, out=chunk_scratch, mode='clip')
+				offset = y % (rows * noise_chunks)
+				np.add(chunk_scratch, noise[offset:offset + n], out=chunk_scratch)
+				np.clip(chunk_scratch, 0.0, 255.0, out=chunk_scratch)
+				np.copyto(chunk_out, chunk_scratch, casting='unsafe')
+			else:
+				np.take(self.lut, chunk_index, out=chunk_out, mode='clip')
+			if channels > 3:
+				# alpha went through the table as well, it is overwritten with the linear value
+				float_to_uint8(chunk[:, :, 3:], out=chunk_out[:, :, 3:], scratch=chunk_scratch[:, :, 3:])
+		return out
+
+def dither_noise(shape):
+	''' Triangular noise of +-1 step, generated once per shape so repeated frames do not flicker '''
+	noise = staging_array("dither_noise", shape, np.float32)
+	if noise.flags.writeable:
+		random = np.random.RandomState(4096)
+		noise[...] = random.random_sample(shape) - random.random_sample(shape)
+		noise.flags.writeable = False
+	return noise
+
+# the lookup tables are built once per combination of color settings
+_transforms = {}
+
+def color_transform(exposure=0.0, gamma=1.0, view_transform='Standard', dither=False):
+	''' Shared ColorTransform for the given color settings '''
+	key = (exposure, gamma, view_transform, dither)
+	transform = _transforms.get(key)
+	if transform is None:
+		if len(_transforms) > 8:
+			_transforms.clear()
+		transform = _transforms[key] = ColorTransform(exposure, gamma, view_transform, dither)
+	return transform
+
+def scene_color_transform(scene):
+	''' Shared ColorTransform with the exposure, gamma and view transform of the color management of the scene '''
+	view_settings = scene.view_settings
+	return color_transform(view_settings.exposure, view_settings.gamma, view_settings.view_transform,
+		getattr(scene, 'LKG_dither', False))
+
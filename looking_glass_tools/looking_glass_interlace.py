@@ -0,0 +1,140 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# CPU version of the HoloPlay lightfield shader which turns a quilt into the
+# native interlaced image of a Looking Glass. Does not import bpy.
+
+import timeit
+import numpy as np
+from math import atan, cos
+
+# the calibration values the interlacing depends on, see the 'calibration' entry of an 'info' response
+calibration_keys = ('pitch', 'slope', 'center', 'DPI', 'screenW', 'screenH', 'invView', 'flipImageX', 'flipSubp')
+# the flags are off when a calibration does not contain them, without the other values nothing can be interlaced
+required_calibration_keys = ('pitch', 'slope', 'center', 'DPI', 'screenW', 'screenH')
+
+def calibration_values(calibration):
+	''' Flattens a calibration from HoloPlay Service, e.g. {'pitch': {'value': 47.6}}, into plain floats
+
+	Raises ValueError when a required value is missing or not a number.
+	'''
+	values = {}
+	for key in calibration_keys:
+		value = calibration.get(key)
+		if isinstance(value, dict):
+			value = value.get('value')
+		if value is None:
+			if key in required_calibration_keys:
+				raise ValueError("The calibration does not contain %s" % key)
+			value = 0.0
+		try:
+			values[key] = float(value)
+		except (TypeError, ValueError):
+			raise ValueError("The calibration value %s is not a number: %r" % (key, value))
+	return values
+
+def shader_uniforms(calibration):
+	''' Derives the uniforms of the lightfield shader from the calibration, same math as HoloPlay Core '''
+	cal = calibration_values(calibration)
+	# the slope can be negative, the sizes cannot
+	for key in ('DPI', 'screenW', 'screenH'):
+		if not cal[key] > 0.0:
+			raise ValueError("The calibration value %s must be positive, not %r" % (key, cal[key]))
+	if not abs(cal['slope']) > 0.0:
+		raise ValueError("The calibration value slope cannot be %r" % cal['slope'])
+	screen_inches = cal['screenW'] / cal['DPI']
+	pitch = cal['pitch'] * screen_inches * cos(atan(1.0 / cal['slope']))
+	tilt = cal['screenH'] / (cal['screenW'] * cal['slope'])
+	if cal['flipImageX'] > 0.5:
+		tilt = -tilt
+	return {
+		'pitch': pitch,
+		'tilt': tilt,
+		'center': cal['center'],
+		'subp': 1.0 / (3.0 * cal['screenW']),
+		'invView': int(cal['invView'] > 0.5),
+		# index of the subpixel sample used for the red and blue channel
+		'ri': 2 if cal['flipSubp'] > 0.5 else 0,
+		'bi': 0 if cal['flipSubp'] > 0.5 else 2,
+		'screenW': int(cal['screenW']),
+		'screenH': int(cal['screenH']),
+	}
+
+class Interlacer:
+	''' Interlaces quilts for one calibration and quilt layout
+
+	For every subpixel of the display the flat index of the quilt value it shows is computed once,
+	after that interlacing a quilt is a single gather. Quilts and results are stored bottom to top.
+	'''
+
+	def __init__(self, calibration, quilt_width, quilt_height, settings, channels=4):
+		start_time = timeit.default_timer()
+		uniforms = shader_uniforms(calibration)
+		self.width = uniforms['screenW']
+		self.height = uniforms['screenH']
+		self.quilt_shape = (quilt_height, quilt_width, channels)
+
+		columns = settings['vx']
+		rows = settings['vy']
+		total_views = settings['vtotal']
+		view_width = int(quilt_width / columns)
+		view_height = int(quilt_height / rows)
+
+		# texture coordinates of the pixel centers
+		u = (np.arange(self.width, dtype=np.float64) + 0.5) / self.width
+		v = (np.arange(self.height, dtype=np.float64) + 0.5) / self.height
+
+		# the view coordinates do not depend on the subpixel, quilt texel inside the view
+		tex_x = np.minimum((u * view_width).astype(np.int64), view_width - 1)
+		tex_y = np.minimum((v * view_height).astype(np.int64), view_height - 1)
+
+		self.table = np.empty((self.height, self.width, 3), dtype=np.int32)
+		samples = (uniforms['ri'], 1, uniforms['bi'])
+		for channel, i in enumerate(samples):
+			z = (u[None, :] + i * uniforms['subp'] + v[:, None] * uniforms['tilt']) * uniforms['pitch'] - uniforms['center']
+			z -= np.floor(z)
+			if uniforms['invView']:
+				z = 1.0 - z
+			view = np.minimum((z * total_views).astype(np.int64), total_views - 1)
+			x = (view % columns) * view_width + tex_x[None, :]
+			y = (view // columns) * view_height + tex_y[:, None]
+			self.table[:, :, channel] = (y * quilt_width + x) * channels + channel
+		print("Building the interlacing table took: %.6f" % (timeit.default_timer() - start_time))
+
+	def interlace(self, quilt, out=None):
+		''' Returns the native image of the display (height x width x 3) for a quilt '''
+		if out is None:
+			out = np.empty((self.height, self.width, 3), dtype=quilt.dtype)
+		np.take(quilt.reshape(-1), self.table, out=out)
+		return out
+
+# interlacers are expensive to build, keep the ones for recently used calibrations around
+_interlacers = {}
+
+def get_interlacer(calibration, quilt_width, quilt_height, settings, channels=4):
+	''' Returns a cached interlacer for the calibration and quilt layout '''
+	cal = calibration_values(calibration)
+	key = (tuple(cal[k] for k in calibration_keys), quilt_width, quilt_height,
+		settings['vx'], settings['vy'], settings['vtotal'], channels)
+	interlacer = _interlacers.get(key)
+	if interlacer is None:
+		if len(_interlacers) >= 4:
+			_interlacers.clear()
+		interlacer = Interlacer(calibration, quilt_width, quilt_height, settings, channels)
+		_interlacers[key] = interlacer
+	return interlacer
@@ -23,6 +23,7 @@ import time
 import timeit # only for benchmarking
 import os
 import ctypes
+import threading
 import sys
 import numpy as np
 from bgl import *
@@ -30,11 +31,25 @@ from math import *
 from mathutils import *
 from bpy.types import AddonPreferences, PropertyGroup
 from bpy.props import FloatProperty, PointerProperty
+from bpy.app.handlers import persistent
 from gpu_extras.presets import draw_texture_2d
 from gpu_extras.batch import batch_for_shader
 from . import looking_glass_settings
 from . looking_glass_settings import *
 from . holoplay_service_api_commands import *
+from . looking_glass_interlace import get_interlacer
+from . looking_glass_quilt import QuiltAssembler, staging_array, float_to_uint8, uint8_to_float, view_origin, quilt_image_settings, quilt_filepath
+from . looking_glass_cache import decoded_cache
+from . looking_glass_render_setup import load_view_uint8, get_rig_layout
+from . looking_glass_quilt_writer import QuiltImageWriter
+from . looking_glass_color import scene_color_transform
+from . looking_glass_view_synthesis import ViewSynthesizer, anchor_views
+from . looking_glass_sequence import find_sequence, sniff_image_format
+from . looking_glass_quilt_file import open_quilt_file, create_quilt_file, write_quilt_frame
+from . looking_glass_recorder import QuiltRecorder, replay_recording
+from . looking_glass_quilt_bus import QuiltBus
+from . looking_glass_memory import governor, offscreen_bytes
+from . looking_glass_quilt import staging_bytes, clear_staging_arrays
 
 # HoloPlayCore will be loaded into this
 #hp = None
@@ -52,6 +67,31 @@ hp_myQuilt = None
 hp_liveQuilt = None
 hp_imgQuilt = None
 hp_imgDataBlockQuilt = None
+hp_quiltReadBuffer = None
+# texture of the image editor viewer, (width, height) it was allocated with and what it shows
+hp_viewerTexture = None
+hp_viewerTextureSize = None
+hp_viewerQuiltKey = None
+hp_viewSynthesizer = None
+hp_streamer = None
+hp_streamOffscreens = None
+# offscreens of all views shared by Send Quilt, streaming and baking, set up once instead of on every call
+hp_sharedOffscreens = None
+hp_bake = None
+# QuiltRender of a running offline render of quilt images with the viewport offscreens
+hp_quiltRender = None
+# the quilt target of draw_quilt, kept for the next quilt of the same size
+hp_quiltTarget = None
+# (thread, stop event) of a running replay
+hp_replay = None
+# every quilt that is rendered or assembled is published once on the bus for all of its consumers
+hp_quiltBus = QuiltBus()
+# subscriptions to the bus by consumer: 'recorder', 'device'
+hp_subscriptions = {}
+# frames of quilt files cached in HoloPlay Service by a bake: {(quilt file, frame): cache name}
+hp_deviceCache = {}
+# seconds of rendering per timer call while baking, the interface handles events in between
+bake_time_slice = 0.1
 hp_FBO = None
 hp_FBO_tmp = None
 hp_FBO_img = None
@@ -203,67 +243,142 @@ class OffScreenDraw(bpy.types.Operator):
 		return modelview_matrices, projection_matrices
 
 	@staticmethod
-	def draw_3dview_into_texture(self, context, offscreens):
+	def compute_view_matrices(self, context, total_views=None):
+		''' Returns the modelview and projection matrices of all views, from the render setup if there is one '''
 		scene = context.scene
 		render = scene.render
 		wm = context.window_manager
-		global hp_myQuilt
-		if hp_myQuilt == None:
-			hp_myQuilt = self.setupMyQuilt(hp_myQuilt)
-		global hp_imgDataBlockQuilt
 
 		# should be the same aspect ratio as the looking glass display
 		aspect_ratio = render.resolution_x / render.resolution_y
 
-		total_views = wm.tilesHorizontal * wm.tilesVertical
+		if total_views is None:
+			total_views = wm.tilesHorizontal * wm.tilesVertical
 
 		# check whether multiview render setup has been created
 		cam_parent = bpy.data.objects.get("Multiview")
 		if cam_parent is not None:
-			modelview_matrices, projection_matrices = self._setup_matrices_from_existing_cameras(self,
-				context, cam_parent)
-		else:
-			camera_active = scene.camera
-			modelview_matrix, projection_matrix = self._setup_matrices_from_camera(
-				context, camera_active)
+			return OffScreenDraw._setup_matrices_from_existing_cameras(self, context, cam_parent)
+
+		camera_active = scene.camera
+		modelview_matrix, projection_matrix = self._setup_matrices_from_camera(
+			context, camera_active)
+
+		# compute the field of view from projection matrix directly
+		# because focal length fov in Cycles is relative to the longer side of the view rectangle
+		view_cone = 2.0*atan(1.0/projection_matrix[1][1])
+		view_angles = self.compute_view_angles(view_cone, total_views)
+
+		try:
+			convergence_vector = camera_active.location - camera_active.data.dof_object.location
+		except:
+			print("Active camera does not have a DoF object, using distance to World Origin instead")
+			convergence_vector = camera_active.location
+		
+		convergence_distance = convergence_vector.magnitude
 
-			# compute the field of view from projection matrix directly
-			# because focal length fov in Cycles is relative to the longer side of the view rectangle
-			view_cone = 2.0*atan(1.0/projection_matrix[1][1])
-			view_angles = self.compute_view_angles(view_cone, total_views)
+		size = convergence_distance * tan(view_cone * 0.5)
 
-			try:
-				convergence_vector = camera_active.location - camera_active.data.dof_object.location
-			except:
-				print("Active camera does not have a DoF object, using distance to World Origin instead")
-				convergence_vector = camera_active.location
-			
-			convergence_distance = convergence_vector.magnitude
+		x_offsets = self.compute_x_offsets(convergence_distance, view_angles)
+		projection_offsets = self.compute_projection_offsets(
+			x_offsets, aspect_ratio, size)
 
-			size = convergence_distance * tan(view_cone * 0.5)
+		# create lists of matrices for modelview and projection
+		modelview_matrices = self.setup_modelview_matrices(
+			modelview_matrix, x_offsets)
+		projection_matrices = self.setup_projection_matrices(
+			projection_matrix, projection_offsets)
+		return modelview_matrices, projection_matrices
 
-			x_offsets = self.compute_x_offsets(convergence_distance, view_angles)
-			projection_offsets = self.compute_projection_offsets(
-				x_offsets, aspect_ratio, size)
+	@staticmethod
+	def read_offscreen_color_and_depth(offscreen, width, height):
+		''' Reads color and depth of the bound offscreen into numpy arrays, rows bottom to top '''
+		color_buffer = Buffer(GL_BYTE, width * height * 4)
+		depth_buffer = Buffer(GL_FLOAT, width * height)
+		glReadBuffer(GL_BACK)
+		glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE, color_buffer)
+		glReadPixels(0, 0, width, height, GL_DEPTH_COMPONENT, GL_FLOAT, depth_buffer)
+		color = np.frombuffer(color_buffer, dtype=np.uint8).reshape(height, width, 4).copy()
+		depth = np.frombuffer(depth_buffer, dtype=np.float32).reshape(height, width).copy()
+		return color, depth
+
+	@staticmethod
+	def synthesize_quilt(self, context, offscreens, modelview_matrices, projection_matrices, num_anchors):
+		''' Draws only num_anchors views with depth and synthesizes the others, returns a flat uint8 quilt '''
+		global hp_viewSynthesizer
 
-			# create lists of matrices for modelview and projection
-			modelview_matrices = self.setup_modelview_matrices(
-				modelview_matrix, x_offsets)
-			projection_matrices = self.setup_projection_matrices(
-				projection_matrix, projection_offsets)
+		start_time = timeit.default_timer()
+		scene = context.scene
+		num_views = len(offscreens)
+		if hp_viewSynthesizer == None or hp_viewSynthesizer.width != qs_viewWidth or hp_viewSynthesizer.height != qs_viewHeight:
+			hp_viewSynthesizer = ViewSynthesizer(qs_viewWidth, qs_viewHeight)
+		hp_viewSynthesizer.anchors = {}
+
+		depth_found = False
+		for view in anchor_views(num_views, num_anchors):
+			offscreen = offscreens[view]
+			with offscreen.bind():
+				offscreen.draw_view3d(
+					scene,
+					context.view_layer,
+					context.space_data,
+					context.region,
+					modelview_matrices[view],
+					projection_matrices[view],
+					)
+				color, depth = self.read_offscreen_color_and_depth(offscreen, qs_viewWidth, qs_viewHeight)
+			depth_found = depth_found or bool((depth < 1.0).any())
+			hp_viewSynthesizer.set_anchor(view, color, depth, modelview_matrices[view], projection_matrices[view])
+		if not depth_found:
+			print("No depth found in the anchor views, the synthesized views will not show parallax")
+		print("Drawing anchor views took: %.6f" % (timeit.default_timer() - start_time))
+
+		start_time = timeit.default_timer()
+		flat_quilt = staging_array("quilt_uint8", (qs_width * qs_height * 4,), np.uint8)
+		flat_quilt.fill(0)
+		quilt = flat_quilt.reshape(qs_height, qs_width, 4)
+		for view in range(num_views):
+			x, y = view_origin(view, qs_columns, qs_viewWidth, qs_viewHeight)
+			tile = quilt[y:y + qs_viewHeight, x:x + qs_viewWidth]
+			hp_viewSynthesizer.synthesize(view, modelview_matrices[view], projection_matrices[view], tile)
+		print("Synthesizing views took: %.6f" % (timeit.default_timer() - start_time))
+		return flat_quilt
+
+	@staticmethod
+	def upload_quilt_to_texture(quilt, texture):
+		''' Copies a flat uint8 quilt into a quilt texture '''
+		# Buffer only knows signed bytes, the bits are the same
+		buffer = Buffer(GL_BYTE, quilt.size, quilt.view(np.int8))
+		glActiveTexture(GL_TEXTURE0)
+		glBindTexture(GL_TEXTURE_2D, texture)
+		glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, qs_width, qs_height, GL_RGBA, GL_UNSIGNED_BYTE, buffer)
+		glBindTexture(GL_TEXTURE_2D, 0)
+
+	@staticmethod
+	def draw_3dview_into_texture(self, context, offscreens):
+		''' Renders all views into the quilt texture, returns the quilt as numpy array when it was built on the CPU '''
+		wm = context.window_manager
+		global hp_myQuilt
+		if hp_myQuilt == None:
+			hp_myQuilt = self.setupMyQuilt(hp_myQuilt)
+
+		modelview_matrices, projection_matrices = self.compute_view_matrices(self, context)
 		# print("Computing matrices: %.6f" % (timeit.default_timer() - start_time))
 
+		num_anchors = wm.viewSynthesisAnchors
+		if 1 < num_anchors < len(offscreens):
+			return self.synthesize_quilt(self, context, offscreens, modelview_matrices, projection_matrices, num_anchors)
+
 		# start_time = timeit.default_timer()
 		# render the scene total_views times from different angles and store the results in a quilt
 		self.update_offscreens(self, context, offscreens,
 							modelview_matrices, projection_matrices, hp_myQuilt[0])
-		print("Rendered into texture id " + str(hp_myQuilt[0]))		
+		print("Rendered into texture id " + str(hp_myQuilt[0]))
+		return None
 
 	@staticmethod
 	def draw_callback_px(self, context, offscreens, quilt, batch, shader):
 		''' Manages the draw handler for the live view '''
-		scene = context.scene
-		render = scene.render
 		wm = context.window_manager
 		global hp_myQuilt
 
@@ -274,58 +389,98 @@ class OffScreenDraw(bpy.types.Operator):
 				self.draw_new(context, quilt, batch, shader)
 			else:
 				# start_time = timeit.default_timer()
-				# should be the same aspect ratio as the looking glass display
-				aspect_ratio = render.resolution_x / render.resolution_y
-
-				total_views = wm.tilesHorizontal * wm.tilesVertical
-
-				# check whether multiview render setup has been created
-				cam_parent = bpy.data.objects.get("Multiview")
-				if cam_parent is not None:
-					modelview_matrices, projection_matrices = self._setup_matrices_from_existing_cameras(
-						context, cam_parent)
-				else:
-					camera_active = scene.camera
-					modelview_matrix, projection_matrix = self._setup_matrices_from_camera(
-						context, camera_active)
-
-					# compute the field of view from projection matrix directly
-					# because focal length fov in Cycles is relative to the longer side of the view rectangle
-					view_cone = 2.0*atan(1.0/projection_matrix[1][1])
-					view_angles = self.compute_view_angles(view_cone, total_views)
-
-					try:
-						convergence_vector = camera_active.location - camera_active.data.dof_object.location
-					except:
-						print("Active camera does not have a DoF object, using distance to World Origin instead")
-						convergence_vector = camera_active.location
-					
-					convergence_distance = convergence_vector.magnitude
-
-					size = convergence_distance * tan(view_cone * 0.5)
-
-					x_offsets = self.compute_x_offsets(convergence_distance, view_angles)
-					projection_offsets = self.compute_projection_offsets(
-						x_offsets, aspect_ratio, size)
-
-					# create lists of matrices for modelview and projection
-					modelview_matrices = self.setup_modelview_matrices(
-						modelview_matrix, x_offsets)
-					projection_matrices = self.setup_projection_matrices(
-						projection_matrix, projection_offsets)
+				modelview_matrices, projection_matrices = self.compute_view_matrices(self, context)
 				# print("Computing matrices: %.6f" % (timeit.default_timer() - start_time))
 
-				# start_time = timeit.default_timer()
-				# render the scene total_views times from different angles and store the results in a quilt
-				self.update_offscreens(self, context, offscreens,
-									modelview_matrices, projection_matrices, quilt)
-				print("Rendered into texture id " + str(hp_myQuilt[0]))
-				# print("Offscreen rendering and quilt building total: %.6f" % (timeit.default_timer() - start_time))
+				num_anchors = wm.viewSynthesisAnchors
+				synthesized = None
+				if 1 < num_anchors < len(offscreens):
+					synthesized = self.synthesize_quilt(self, context, offscreens,
+									modelview_matrices, projection_matrices, num_anchors)
+					self.upload_quilt_to_texture(synthesized, quilt)
+				else:
+					# start_time = timeit.default_timer()
+					# render the scene total_views times from different angles and store the results in a quilt
+					self.update_offscreens(self, context, offscreens,
+										modelview_matrices, projection_matrices, quilt)
+					print("Rendered into texture id " + str(hp_myQuilt[0]))
+					# print("Offscreen rendering and quilt building total: %.6f" % (timeit.default_timer() - start_time))
+
+				# only read the quilt back when someone besides this window wants it
+				if hp_quiltBus.has_subscribers():
+					pixels = synthesized if synthesized is not None else self.read_quilt_texture(quilt)
+					settings = {'vx': qs_columns, 'vy': qs_rows, 'vtotal': qs_numViews, 'aspect': wm.aspect}
+					hp_quiltBus.publish(pixels.reshape(qs_height, qs_width, 4), settings, ('live_view', context.scene.name, context.scene.frame_current))
 
 				# start_time = timeit.default_timer()
 				self.draw_new(context, quilt, batch, shader)
 				# print("Draw_new total: %.6f" % (timeit.default_timer() - start_time))
 
+	@staticmethod
+	def upload_quilt_to_viewer_texture(quilt):
+		''' Copies a height x width x 4 or 3 uint8 quilt into the viewer texture, reallocating it only when the size changed '''
+		global hp_viewerTexture, hp_viewerTextureSize
+
+		height, width, channels = quilt.shape
+		# RGB frames of quilt files are uploaded as they are, the texture is RGBA either way
+		pixel_format = GL_RGBA if channels == 4 else GL_RGB
+		# Buffer only knows signed bytes, the bits are the same
+		buffer = Buffer(GL_BYTE, width * height * channels, np.ascontiguousarray(quilt).view(np.int8).reshape(-1))
+		glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+		glActiveTexture(GL_TEXTURE0)
+		if hp_viewerTexture is None:
+			hp_viewerTexture = Buffer(GL_INT, 1)
+			glGenTextures(1, hp_viewerTexture)
+			glBindTexture(GL_TEXTURE_2D, hp_viewerTexture[0])
+			glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+			glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+		else:
+			glBindTexture(GL_TEXTURE_2D, hp_viewerTexture[0])
+		if hp_viewerTextureSize != (width, height):
+			glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, width, height, 0, pixel_format, GL_UNSIGNED_BYTE, buffer)
+			hp_viewerTextureSize = (width, height)
+		else:
+			glTexSubImage2D(GL_TEXTURE_2D, 0, 0, 0, width, height, pixel_format, GL_UNSIGNED_BYTE, buffer)
+		glPixelStorei(GL_UNPACK_ALIGNMENT, 4)
+		glBindTexture(GL_TEXTURE_2D, 0)
+
+	@staticmethod
+	def free_viewer_texture():
+		global hp_viewerTexture, hp_viewerTextureSize, hp_viewerQuiltKey
+
+		if hp_viewerTexture is not None:
+			glDeleteTextures(1, hp_viewerTexture)
+		hp_viewerTexture = None
+		hp_viewerTextureSize = None
+		hp_viewerQuiltKey = None
+
+	@staticmethod
+	def draw_callback_viewer(self, context, quilt, batch, shader):
+		''' Draws the quilt of the LKG image or quilt file in the image editor
+
+		The quilt is assembled on the CPU and uploaded once whenever the frame or the image changes,
+		redraws in between only draw the texture.
+		'''
+		global hp_viewerQuiltKey
+
+		scene = context.scene
+		LKG_image = scene.LKG_image
+		if LKG_image is None and not scene.LKG_quilt_file:
+			# without an image get_current_quilt would render the viewport, there is nothing to view
+			return
+		key = (scene.name, scene.frame_current, LKG_image.filepath if LKG_image is not None else None,
+			scene.LKG_quilt_file, scene_color_transform(scene).key)
+		if key != hp_viewerQuiltKey or hp_viewerTexture is None:
+			start_time = timeit.default_timer()
+			pixels, settings = get_current_quilt(context)
+			if pixels is None:
+				return
+			width, height = quilt_size(pixels)
+			self.upload_quilt_to_viewer_texture(pixels.reshape(height, width, -1))
+			hp_viewerQuiltKey = key
+			print("Uploading quilt to the viewer took: %.6f" % (timeit.default_timer() - start_time))
+		self.draw_new(context, hp_viewerTexture[0], batch, shader)
+
 	@staticmethod
 	def draw_callback_3dview(self, context):
 		''' Redraw the area stored in self.area whenever the 3D view updates '''
@@ -371,6 +526,7 @@ class OffScreenDraw(bpy.types.Operator):
 			bpy.types.SpaceImageEditor.draw_handler_remove(
 				OffScreenDraw._handle_draw_image_editor, 'WINDOW')
 			OffScreenDraw._handle_draw_image_editor = None
+			OffScreenDraw.free_viewer_texture()
 
 		if OffScreenDraw._handle_draw_3dview is not None:
 			print("Removing Draw Handler from 3D View")
@@ -518,6 +674,8 @@ class OffScreenDraw(bpy.types.Operator):
 		if hp_FBO_img == None:
 			hp_FBO_img = self.setupBuffers(hp_FBO_img, hp_imgQuilt)		
 		for i, filepath in enumerate(filepaths):
+			if filepath is None:
+				continue
 			LKG_image.filepath = filepath
 			LKG_image.gl_load()
 			bc = LKG_image.bindcode
@@ -535,84 +693,116 @@ class OffScreenDraw(bpy.types.Operator):
 
 
 	@staticmethod
-	def create_quilt_from_holoplay_multiview_image(self, context):
-		''' Loads all multiview images from a render for the Looking Glass and returns an image datablock with the resulting quilt '''
+	def load_view(view_file):
+		''' Decodes one view into a uint8 array, served from the cache when the file did not change '''
+		scene = bpy.context.scene
+		# float views depend on the color management of the scene
+		key = ('view', view_file.path, view_file.mtime, view_file.size, scene_color_transform(scene).key)
+		pixels = decoded_cache.get(key)
+		if pixels is None:
+			pixels = decoded_cache.put(key, load_view_uint8(view_file.path, scene))
+		return pixels
+
+	@staticmethod
+	def load_quilt_from_views(self, context, view_files, settings):
+		''' Assembles a quilt from the view files of a frame on the CPU, returns it as flat uint8 array
+
+		The views are placed in the layout they were rendered with, views beyond vx * vy have no tile and are skipped.
+		'''
+		start_time = timeit.default_timer()
+		columns, rows = settings['vx'], settings['vy']
+		view_files = view_files[:columns * rows]
+		views_key = tuple((f.path, f.mtime, f.size) if f is not None else None for f in view_files)
+		key = ('quilt', qs_width, qs_height, columns, rows, views_key, scene_color_transform(context.scene).key)
+		quilt = decoded_cache.get(key)
+		if quilt is not None:
+			print("Quilt served from cache: %.6f" % (timeit.default_timer() - start_time))
+			return quilt
+
+		assembler = QuiltAssembler(columns, rows, qs_width // columns, qs_height // rows, 4,
+			len(view_files), qs_width, qs_height)
+		for view, view_file in enumerate(view_files):
+			if view_file is not None:
+				assembler.add_view(view, self.load_view(view_file))
+		quilt = decoded_cache.put(key, assembler.quilt.reshape(-1))
+		print("Assembling quilt from views took: %.6f (%r)" % (timeit.default_timer() - start_time, decoded_cache))
+		return quilt
+
+	@staticmethod
+	def create_quilt_from_holoplay_multiview_image(self, context, settings):
+		''' Loads all multiview images from a render for the Looking Glass and returns the resulting quilt in the layout of settings '''
 		global hp_imgQuilt
 		LKG_image = context.scene.LKG_image
-		wm = context.window_manager
 
 		# when the user has loaded an image in the LKG tools panel, assume it is meant for viewing in the LKG as multiview
 		if LKG_image != None:
-			num_multiview_images = int(wm.tilesHorizontal * wm.tilesVertical)
-			multiview_first_image_path = LKG_image.filepath
-			# split into file, view number and extension
-			multiview_image_path_split = multiview_first_image_path.rsplit('.',2)
-			self._LKGtexArray = []
+			num_multiview_images = int(settings['vtotal'])
+			found = find_sequence(bpy.path.abspath(LKG_image.filepath))
+			if found is None:
+				print("LKG image is not part of a multiview sequence: " + LKG_image.filepath)
+				return None
+			sequence, frame, view = found
+			# image sequences follow the timeline, single images show the frame they were rendered for
+			if LKG_image.source == 'SEQUENCE' and frame is not None:
+				frame = context.scene.frame_current
+			view_files = []
 
 			for i in range(num_multiview_images):
-				img_str = multiview_image_path_split[0] + '.' + str(i).zfill(2) + '.' + multiview_image_path_split[2]
-				# tex = bpy.data.images.load(img_str)
-				# LKG_image.filepath = img_str
-				# bpy.ops.image.reload()
-				# LKG_image.gl_load()
-				# self._LKGtexArray.append(LKG_image.bindcode)
-				self._LKGtexArray.append(img_str)
-
-			if hp_imgQuilt == None:
-				hp_imgQuilt = self.setupMyQuilt(hp_imgQuilt)
-			return self._send_images_to_holoplay(self, context, self._LKGtexArray, LKG_image)
+				view_file = sequence.files.get((frame, i))
+				if view_file is None:
+					print("View " + str(i) + " of frame " + str(frame) + " not found, skipping it")
+				view_files.append(view_file)
+
+			return self.load_quilt_from_views(self, context, view_files, settings)
 		else:
 			print("No looking glass image loaded")
 			return None
 
 	@staticmethod
-	def copy_quilt_from_texture_to_image_datablock(quiltTexture):
-		"""copy the current texture to a Blender image datablock"""
-		global hp_myQuilt
-		global hp_imgQuilt
-		global hp_imgDataBlockQuilt
+	def read_quilt_texture(quiltTexture):
+		""" reads a quilt texture into a reused bgl Buffer and returns it as flat uint8 numpy array without copying """
+		global hp_quiltReadBuffer
+
+		if hp_quiltReadBuffer == None or len(hp_quiltReadBuffer) != qs_width * qs_height * 4:
+			print("Creating Buffer for Quilt")
+			hp_quiltReadBuffer = Buffer(GL_BYTE, qs_width * qs_height * 4)
 
-		print("Creating Buffer for Quilt")
 		glActiveTexture(GL_TEXTURE0)
 		glBindTexture(GL_TEXTURE_2D, quiltTexture)
-		#batch.draw(shader)
-		
-		bufferForQuilt = Buffer(GL_BYTE, qs_width * qs_height * 4)
-		glGetTexImage(GL_TEXTURE_2D, 0, GL_RGBA, GL_UNSIGNED_BYTE, bufferForQuilt)
+		glGetTexImage(GL_TEXTURE_2D, 0, GL_RGBA, GL_UNSIGNED_BYTE, hp_quiltReadBuffer)
 		glBindTexture(GL_TEXTURE_2D, 0)
 
-		if hp_imgDataBlockQuilt == None:
+		# the buffer is declared as signed bytes, reinterpret it as the unsigned bytes OpenGL wrote
+		return np.frombuffer(hp_quiltReadBuffer, dtype=np.uint8)
+
+	@staticmethod
+	def copy_quilt_from_texture_to_image_datablock(quiltTexture):
+		"""copy the current texture to a Blender image datablock"""
+		global hp_imgDataBlockQuilt
+
+		pixels = OffScreenDraw.read_quilt_texture(quiltTexture)
+
+		if hp_imgDataBlockQuilt == None or tuple(hp_imgDataBlockQuilt.size) != (qs_width, qs_height):
 			print("Creating new image for Quilt")
-			hp_imgDataBlockQuilt = bpy.data.images.new("hp_imgDataBlockQuilt", qs_width, qs_height, float_buffer=True)
+			# a byte image needs a quarter of the memory of a float image, the quilt only has 8 bit per channel anyway
+			hp_imgDataBlockQuilt = bpy.data.images.new("hp_imgDataBlockQuilt", qs_width, qs_height, alpha=True, float_buffer=False)
 
 		start_time = timeit.default_timer()
-		hp_imgDataBlockQuilt.pixels.foreach_set(bufferForQuilt)
+		# Image.pixels only accepts floats, even for byte images, and only the whole image at once. The float
+		# copy is four times the size of the quilt, so it is not kept around like the other staging arrays
+		px = uint8_to_float(pixels)
+		hp_imgDataBlockQuilt.pixels.foreach_set(px)
+		del px
 		print("Copying from buffer into image datablock took: %.6f" % (timeit.default_timer() - start_time))
 		return hp_imgDataBlockQuilt
 
 	@staticmethod
 	def copy_quilt_from_texture_to_numpy_array(quiltTexture):
-		"""copy the current texture to a numpy array"""
-		global hp_myQuilt
-		global hp_imgQuilt
-		global hp_imgDataBlockQuilt
-
-		print("Creating Buffer for Quilt")
-		glActiveTexture(GL_TEXTURE0)
-		glBindTexture(GL_TEXTURE_2D, quiltTexture)
-		
-		bufferForQuilt = Buffer(GL_BYTE, qs_width * qs_height * 4)
-		glGetTexImage(GL_TEXTURE_2D, 0, GL_RGBA, GL_UNSIGNED_BYTE, bufferForQuilt)
-		glBindTexture(GL_TEXTURE_2D, 0)
-
-		if hp_imgDataBlockQuilt == None:
-			hp_imgDataBlockQuilt = bpy.data.images.new("hp_imgDataBlockQuilt", qs_width, qs_height, float_buffer=True)
-		
-		# bottleneck
+		"""copy the current texture to a numpy array, the array is reused by the next call"""
 		start_time = timeit.default_timer()
-		imageDataNp = np.empty(qs_width * qs_height * 4, dtype=np.uint8)
-		buffer_list = bytes(bufferForQuilt.to_list())
-		imageDataNp = np.frombuffer(buffer_list, dtype=np.uint8)
+		pixels = OffScreenDraw.read_quilt_texture(quiltTexture)
+		imageDataNp = staging_array("quilt_uint8", pixels.shape, np.uint8)
+		np.copyto(imageDataNp, pixels)
 		print("Copying from buffer into np array took: %.6f" % (timeit.default_timer() - start_time))
 
 		return imageDataNp
@@ -716,46 +906,854 @@ class OffScreenDraw(bpy.types.Operator):
 
 		print("Cancel finished")
 
+# formats HoloPlay Service decodes itself, quilt images in these formats are sent without decoding them
+passthrough_formats = ('png', 'jpg', 'bmp')
+
+def get_quilt_image(context):
+	''' Returns (filepath, settings) when the LKG image is a single file quilt, e.g. name_qs5x9a0.75.png, else None '''
+	LKG_image = context.scene.LKG_image
+	if LKG_image is None or LKG_image.source != 'FILE':
+		return None
+	filepath = bpy.path.abspath(LKG_image.filepath)
+	if not os.path.isfile(filepath):
+		return None
+	settings = quilt_image_settings(filepath)
+	if settings is None:
+		return None
+	return filepath, settings
+
+def load_quilt_image(filepath):
+	''' Decodes a quilt image into a height x width x 4 uint8 array once, later calls are served from the cache '''
+	stat = os.stat(filepath)
+	scene = bpy.context.scene
+	key = ('quilt_image', filepath, stat.st_mtime_ns, stat.st_size, scene_color_transform(scene).key)
+	quilt = decoded_cache.get(key)
+	if quilt is None:
+		quilt = decoded_cache.put(key, load_view_uint8(filepath, scene))
+	return quilt
+
+def get_current_quilt(context, offscreens=None, use_quilt_file=True):
+	''' Returns (quilt, settings) for the quilt file, the LKG image or the current viewport
+
+	The quilt is a uint8 RGBA array, either height x width x 4 or flat for the qs_width x qs_height quilt texture.
+	Frames of quilt files are height x width x 3 RGB, sending and the viewer take them as they are.
+	Pass offscreens to reuse them instead of setting up new ones.
+	'''
+	global hp_myQuilt
+
+	start_time = timeit.default_timer()
+	qs_totalViews = 45
+	settings = {'vx': qs_columns, 'vy': qs_rows, 'vtotal': qs_totalViews, 'aspect': context.window_manager.aspect}
+	quilt_filepath = bpy.path.abspath(context.scene.LKG_quilt_file)
+	if use_quilt_file and context.scene.LKG_quilt_file and os.path.isfile(quilt_filepath):
+		# frames of quilt files are sliced straight out of the mapped file
+		quilt_file = open_quilt_file(quilt_filepath)
+		print("Reading frame from quilt file took: %.6f" % (timeit.default_timer() - start_time))
+		quilt = quilt_file.frame(context.scene.frame_current)
+		publish_quilt(quilt, quilt_file.settings, ('quilt_file', quilt_filepath, context.scene.frame_current))
+		return quilt, quilt_file.settings
+
+	quilt_image = get_quilt_image(context)
+	if quilt_image is not None:
+		image_filepath, image_settings = quilt_image
+		quilt = load_quilt_image(image_filepath)
+		print("Reading quilt image took: %.6f" % (timeit.default_timer() - start_time))
+		publish_quilt(quilt, image_settings, ('quilt_image', image_filepath))
+		return quilt, image_settings
+
+	wm = context.window_manager
+	tag = ('viewport', context.scene.name, context.scene.frame_current, wm.viewSynthesisAnchors, wm.aspect)
+	published = hp_quiltBus.latest(tag)
+	if (context.scene.LKG_image is None and published is not None
+		and published.published_at > looking_glass_settings.last_scene_change):
+		# nothing changed since the last render of this frame, e.g. streaming after Send Quilt
+		print("Quilt of the viewport taken from the quilt bus, generation %d" % published.generation)
+		return published.quilt, published.settings
+
+	od = OffScreenDraw
+	if hp_myQuilt == None:
+		hp_myQuilt = od.setupMyQuilt(hp_myQuilt)
+	LKG_image = context.scene.LKG_image
+	if LKG_image != None:
+		# the views are tiled like the render setup that rendered them, not like the live view
+		settings = get_rig_layout(context.scene)
+		quilt = od.create_quilt_from_holoplay_multiview_image(od, context, settings)
+	else:
+		if offscreens is None:
+			offscreens = shared_offscreens(context)
+		start_time_offscreendraw = timeit.default_timer()
+		quilt = od.draw_3dview_into_texture(od, context, offscreens)
+		print("Drawing into offscreens took: %.6f" % (timeit.default_timer() - start_time_offscreendraw))
+		# synthesized quilts are built on the CPU and do not need to be read back
+		if quilt is None:
+			start_time_quiltcopy = timeit.default_timer()
+			# quilt = od.copy_quilt_from_texture_to_image_datablock(hp_myQuilt[0])
+			quilt = od.copy_quilt_from_texture_to_numpy_array(hp_myQuilt[0])
+			print("Copying quilt into np array took: %.6f" % (timeit.default_timer() - start_time_quiltcopy))
+		if quilt is not None:
+			width, height = quilt_size(quilt)
+			publish_quilt(quilt.reshape(height, width, 4), settings, tag, always=True)
+			return hp_quiltBus.latest().quilt, settings
+	if quilt is not None and LKG_image is not None:
+		width, height = quilt_size(quilt)
+		publish_quilt(quilt.reshape(height, width, 4), settings, ('multiview', LKG_image.filepath, context.scene.frame_current))
+	governor.enforce()
+	return quilt, settings
+
+def shared_offscreens(context):
+	''' The offscreens of all views, set up on first use and kept until the memory governor or unregister frees them '''
+	global hp_sharedOffscreens
+
+	if hp_sharedOffscreens is None:
+		start_time = timeit.default_timer()
+		hp_sharedOffscreens = OffScreenDraw._setup_offscreens(context, qs_numViews)
+		print("Setting up offscreens took: %.6f" % (timeit.default_timer() - start_time))
+	return hp_sharedOffscreens
+
+def free_shared_offscreens(force=False):
+	''' Frees the shared offscreens unless streaming or a bake still draws into them '''
+	global hp_sharedOffscreens
+
+	if hp_sharedOffscreens is None or (not force and (hp_streamer is not None or hp_bake is not None)):
+		return
+	for offscreen in hp_sharedOffscreens:
+		if offscreen is not None:
+			offscreen.free()
+	hp_sharedOffscreens = None
+
+def quilt_gpu_bytes():
+	''' GPU memory of the quilt textures '''
+	textures = sum(1 for texture in (hp_myQuilt, hp_imgQuilt) if texture is not None)
+	gpu_bytes = textures * qs_width * qs_height * 4
+	if hp_viewerTextureSize is not None:
+		gpu_bytes += hp_viewerTextureSize[0] * hp_viewerTextureSize[1] * 4
+	return gpu_bytes
+
+def quilt_host_bytes():
+	''' Host memory of the quilt read back buffer and the quilt image datablock '''
+	host_bytes = len(hp_quiltReadBuffer) if hp_quiltReadBuffer is not None else 0
+	if hp_imgDataBlockQuilt is not None:
+		try:
+			width, height = hp_imgDataBlockQuilt.size
+			host_bytes += width * height * 4
+		except ReferenceError:
+			pass
+	return host_bytes
+
+def register_memory_probes():
+	''' Reports the buffers and caches of the add-on to the memory governor, evictable ones first '''
+	governor.register("Image cache", lambda: (decoded_cache.current_bytes, 0), decoded_cache.clear)
+	governor.register("Staging arrays", lambda: (staging_bytes(), 0), clear_staging_arrays)
+	governor.register("Quilt bus", lambda: (hp_quiltBus.buffer_bytes(), 0), hp_quiltBus.trim)
+	governor.register("Offscreens", lambda: (0, sum(offscreen_bytes(qs_viewWidth, qs_viewHeight)
+		for offscreen in (hp_sharedOffscreens or ()) if offscreen is not None)), free_shared_offscreens)
+	governor.register("Quilt textures", lambda: (quilt_host_bytes(), quilt_gpu_bytes()))
+	governor.register("Quilt render", lambda: hp_quiltRender.memory() if hp_quiltRender is not None else (0, 0))
+	governor.register("Quilt target", lambda: hp_quiltTarget.memory() if hp_quiltTarget is not None else (0, 0), free_quilt_target)
+	governor.register("Streaming", lambda: (hp_streamer.buffer_bytes() if hp_streamer is not None else 0, 0))
+	governor.register("Recorder", lambda: (looking_glass_settings.recorder.buffer_bytes if looking_glass_settings.recorder is not None else 0, 0))
+	sender_bytes = lambda sender: sender.slots * sender.slot_size if sender is not None else 0
+	governor.register("Sender ring", lambda: (sender_bytes(looking_glass_settings.sender), 0))
+
+register_memory_probes()
+
+def reserve_memory(host=0, gpu=0):
+	''' Asks the governor for memory of a new job, prints why the job cannot start when it does not fit '''
+	if governor.reserve(host, gpu):
+		return True
+	host_used, gpu_used = governor.totals()
+	print("Not enough memory within the budget: %d MB host and %d MB GPU in use, %d MB and %d MB more needed"
+		% (host_used // 2**20, gpu_used // 2**20, host // 2**20, gpu // 2**20))
+	return False
+
+def offscreens_gpu_bytes():
+	''' GPU memory the shared offscreens still need to be set up '''
+	if hp_sharedOffscreens is not None:
+		return 0
+	return qs_numViews * offscreen_bytes(qs_viewWidth, qs_viewHeight)
+
+def publish_quilt(quilt, settings, tag, always=False):
+	''' Publishes a quilt on the bus when anybody subscribed to it, viewport renders are kept for reuse regardless '''
+	if always or hp_quiltBus.has_subscribers():
+		hp_quiltBus.publish(quilt, settings, tag)
+
+def subscribe(name, callback, accept=None):
+	''' Subscribes a consumer to the quilt bus under a name, replacing an earlier subscription of that name '''
+	unsubscribe(name)
+	hp_subscriptions[name] = hp_quiltBus.subscribe(callback, name, accept)
+
+def unsubscribe(name):
+	subscription = hp_subscriptions.pop(name, None)
+	if subscription is not None:
+		hp_quiltBus.unsubscribe(subscription)
+
+def update_mirror_live_view(self, context):
+	if self.mirrorLiveView:
+		send = lambda quilt, settings: send_quilt_pixels(looking_glass_settings.sock, quilt, settings)
+		# only the quilts of the live view window, Send Quilt and streaming send their own
+		subscribe('device', send, lambda tag: tag is not None and tag[0] == 'live_view')
+	else:
+		unsubscribe('device')
+
+def quilt_size(quilt):
+	''' Returns (width, height) of a quilt returned by get_current_quilt '''
+	if quilt.ndim == 3:
+		return quilt.shape[1], quilt.shape[0]
+	return qs_width, qs_height
+
+class ViewContext:
+	''' Stands in for the context of a 3D view when drawing outside of operators and draw callbacks '''
+
+	def __init__(self, context, window, area, region):
+		self.scene = window.scene
+		self.view_layer = window.view_layer
+		self.window_manager = context.window_manager
+		self.space_data = area.spaces.active
+		self.region = region
+		self._context = context
+
+	def evaluated_depsgraph_get(self):
+		return self._context.evaluated_depsgraph_get()
+
+def find_view3d_context(context):
+	''' Returns a ViewContext for the first 3D view of any window or None '''
+	for window in context.window_manager.windows:
+		for area in window.screen.areas:
+			if area.type != 'VIEW_3D':
+				continue
+			for region in area.regions:
+				if region.type == 'WINDOW':
+					return ViewContext(context, window, area, region)
+	return None
+
+def tag_redraw_sidebars(context):
+	for window in context.window_manager.windows:
+		for area in window.screen.areas:
+			if area.type == 'VIEW_3D':
+				for region in area.regions:
+					if region.type == 'UI':
+						region.tag_redraw()
+
+def start_streaming(context):
+	''' Starts sending a quilt for every frame change, the offscreens are set up once for all frames '''
+	global hp_streamer, hp_streamOffscreens
+
+	if hp_streamer is None:
+		hp_streamer = QuiltStreamer()
+	hp_streamer.reset_stats()
+	if hp_streamOffscreens is None:
+		hp_streamOffscreens = shared_offscreens(context)
+	cancel_progressive_send()
+
+def stop_streaming():
+	global hp_streamer, hp_streamOffscreens
+
+	if hp_streamer is not None:
+		hp_streamer.stop()
+		hp_streamer = None
+	# the offscreens are shared, the memory governor frees them when memory runs short
+	hp_streamOffscreens = None
+
+def update_stream_playback(self, context):
+	if self.streamPlayback:
+		# three quilt buffers for the sender thread and the offscreens of all views
+		if hp_streamer is None and not reserve_memory(3 * qs_width * qs_height * 4, offscreens_gpu_bytes()):
+			self.streamPlayback = False
+			return
+		start_streaming(context)
+	else:
+		stop_streaming()
+
+def update_sender_process(self, context):
+	if self.useSenderProcess:
+		# the ring buffer of the sender process holds three full size quilts
+		if looking_glass_settings.sender is None and not reserve_memory(3 * 4096 * 4096 * 4):
+			self.useSenderProcess = False
+			return
+		start_sender()
+	else:
+		stop_sender()
+
+@persistent
+def stream_frame_handler(scene, *args):
+	''' frame_change_post handler rendering and streaming the quilt of every frame while Stream Playback is on '''
+	if hp_streamer is None or hp_bake is not None or hp_quiltRender is not None:
+		return
+	context = bpy.context
+	if hp_streamer.is_behind():
+		# the device has not received the last quilt yet, skip this frame instead of stalling playback
+		hp_streamer.drop()
+		return
+	view_context = find_view3d_context(context)
+	if view_context is None:
+		return
+
+	prefetch = None
+	quilt_filepath = bpy.path.abspath(scene.LKG_quilt_file)
+	if scene.LKG_quilt_file and os.path.isfile(quilt_filepath):
+		# pages of the next frame are read in while the sender thread waits for the next quilt
+		quilt_file = open_quilt_file(quilt_filepath)
+		next_frame = scene.frame_current + scene.frame_step
+		prefetch = lambda: quilt_file.prefetch(next_frame)
+		cache_name = hp_deviceCache.get((quilt_filepath, scene.frame_current))
+		if cache_name is not None:
+			# the quilt is in HoloPlay Service already, only its name has to be sent
+			hp_streamer.submit_message(load_quilt(cache_name, quilt_file.settings))
+			tag_redraw_sidebars(context)
+			return
+
+	sender = looking_glass_settings.sender
+	if sender is not None and sender.is_behind():
+		sender.frames_dropped += 1
+		return
+	quilt, settings = get_current_quilt(view_context, hp_streamOffscreens)
+	if quilt is None:
+		return
+	width, height = quilt_size(quilt)
+	if sender is not None and sender.is_running():
+		# the readback array is copied straight into the ring buffer of the sender process
+		sender.submit(quilt.reshape(height, width, -1), settings)
+		if prefetch is not None:
+			prefetch()
+	else:
+		hp_streamer.submit(quilt.reshape(height, width, -1), settings, prefetch)
+	tag_redraw_sidebars(context)
+
+class QuiltBake:
+	''' A running bake of the quilts of a frame range into a quilt file, advanced by bake_timer '''
+
+	def __init__(self, context, filepath, frame_start, frame_end, upload):
+		self.scene_name = context.scene.name
+		self.filepath = filepath
+		self.frames = list(range(frame_start, frame_end + 1))
+		self.upload = upload
+		self.done = 0
+		self.cancelled = False
+		self.file_created = False
+		self.frame_before = context.scene.frame_current
+		self.offscreens = shared_offscreens(context)
+		self.start_time = timeit.default_timer()
+
+	@property
+	def progress(self):
+		return self.done / max(1, len(self.frames))
+
+	def bake_frame(self, view_context, frame):
+		scene = view_context.scene
+		scene.frame_set(frame)
+		quilt, settings = get_current_quilt(view_context, self.offscreens, use_quilt_file=False)
+		width, height = quilt_size(quilt)
+		quilt = quilt.reshape(height, width, -1)
+		if not self.file_created:
+			# compressed, playback decodes the next frame while the current one is sent
+			create_quilt_file(self.filepath, width, height, 3, settings, self.frames[0], len(self.frames), compress=True)
+			self.file_created = True
+		write_quilt_frame(self.filepath, frame, quilt)
+		if self.upload and looking_glass_settings.sock is not None:
+			cache_name = "blender_lkg_bake_%d" % frame
+			send_quilt_pixels(looking_glass_settings.sock, quilt, settings, cache_name)
+			hp_deviceCache[(self.filepath, frame)] = cache_name
+
+	def finish(self, context):
+		scene = bpy.data.scenes.get(self.scene_name)
+		if scene is not None:
+			scene.frame_set(self.frame_before)
+			if not self.cancelled and self.file_created:
+				# play the baked quilts back from the file from now on
+				scene.LKG_quilt_file = bpy.path.relpath(self.filepath) if bpy.data.filepath else self.filepath
+		context.window_manager.progress_end()
+		print("Baked %d of %d quilts in %.1fs" % (self.done, len(self.frames), timeit.default_timer() - self.start_time))
+
+def bake_timer():
+	''' Renders quilts for bake_time_slice seconds, then returns to the interface until the next call '''
+	global hp_bake
+
+	bake = hp_bake
+	if bake is None:
+		return None
+	context = bpy.context
+	view_context = find_view3d_context(context)
+	if view_context is None:
+		print("Baking quilts needs an open 3D view, cancelling")
+		bake.cancelled = True
+	slice_start = timeit.default_timer()
+	try:
+		while not bake.cancelled and bake.done < len(bake.frames):
+			bake.bake_frame(view_context, bake.frames[bake.done])
+			bake.done += 1
+			if timeit.default_timer() - slice_start > bake_time_slice:
+				break
+	except Exception as error:
+		# an exception would end the timer with the bake still registered, finish it instead
+		print("Baking frame %d failed, cancelling: %s" % (bake.frames[bake.done], error))
+		bake.cancelled = True
+	context.window_manager.progress_update(bake.done)
+	tag_redraw_sidebars(context)
+	if bake.cancelled or bake.done >= len(bake.frames):
+		hp_bake = None
+		bake.finish(context)
+		return None
+	return 0.001
+
+class looking_glass_bake_quilts(bpy.types.Operator):
+	""" Renders the quilts of the frame range into a quilt file in the background """
+	bl_idname = "lookingglass.bake_quilts"
+	bl_label = "Bake Quilts"
+	bl_description = "Renders the quilts of the frame range into a quilt file for smooth playback in the Looking Glass, the interface stays usable while baking."
+
+	filepath: bpy.props.StringProperty(name="Quilt File", subtype='FILE_PATH', default="//quilts.lkgq")
+	upload: bpy.props.BoolProperty(name="Cache in HoloPlay Service", default=False,
+		description="Also store every quilt in HoloPlay Service so playback only sends the name of each frame. Needs a lot of memory")
+
+	def invoke(self, context, event):
+		if context.scene.LKG_quilt_file:
+			self.filepath = context.scene.LKG_quilt_file
+		return context.window_manager.invoke_props_dialog(self)
+
+	def execute(self, context):
+		global hp_bake
+
+		if hp_bake is not None or hp_quiltRender is not None:
+			self.report({'ERROR'}, "Quilts are being baked or rendered already.")
+			return {'CANCELLED'}
+		if find_view3d_context(context) is None:
+			self.report({'ERROR'}, "Baking quilts needs an open 3D view.")
+			return {'CANCELLED'}
+		scene = context.scene
+		filepath = bpy.path.abspath(self.filepath)
+		directory = os.path.dirname(filepath)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		if not reserve_memory(qs_width * qs_height * 4, offscreens_gpu_bytes()):
+			self.report({'ERROR'}, "Not enough memory within the budget of the add-on preferences to bake quilts.")
+			return {'CANCELLED'}
+		for key in [key for key in hp_deviceCache if key[0] == filepath]:
+			del hp_deviceCache[key]
+		hp_bake = QuiltBake(context, filepath, scene.frame_start, scene.frame_end, self.upload)
+		context.window_manager.progress_begin(0, len(hp_bake.frames))
+		bpy.app.timers.register(bake_timer)
+		return {'FINISHED'}
+
+class looking_glass_cancel_bake(bpy.types.Operator):
+	""" Stops baking quilts, the quilts baked so far stay in the file """
+	bl_idname = "lookingglass.cancel_bake"
+	bl_label = "Cancel Bake"
+	bl_description = "Stops baking quilts."
+
+	def execute(self, context):
+		if hp_bake is not None:
+			hp_bake.cancelled = True
+		return {'FINISHED'}
+
+class QuiltTarget:
+	''' One offscreen the views are drawn into and a quilt texture on the GPU they are copied into, read back once per quilt '''
+
+	def __init__(self, settings, view_width, view_height):
+		self.settings = dict(settings)
+		self.view_width = view_width
+		self.view_height = view_height
+		self.width = settings['vx'] * view_width
+		self.height = settings['vy'] * view_height
+		self.offscreen = gpu.types.GPUOffScreen(view_width, view_height)
+		self.texture = Buffer(GL_INT, 1)
+		glGenTextures(1, self.texture)
+		glBindTexture(GL_TEXTURE_2D, self.texture[0])
+		glTexImage2D(GL_TEXTURE_2D, 0, GL_RGBA8, self.width, self.height, 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+		glBindTexture(GL_TEXTURE_2D, 0)
+		self.framebuffer = Buffer(GL_INT, 1)
+		glGenFramebuffers(1, self.framebuffer)
+		glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer[0])
+		glFramebufferTexture(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, self.texture[0], 0)
+		glBindFramebuffer(GL_FRAMEBUFFER, 0)
+		self.read_buffer = Buffer(GL_BYTE, self.width * self.height * 4)
+
+	@staticmethod
+	def memory_needed(settings, view_width, view_height):
+		''' (host bytes, GPU bytes): the read back buffer, the quilt texture and the offscreen '''
+		quilt_bytes = settings['vx'] * view_width * settings['vy'] * view_height * 4
+		return quilt_bytes, quilt_bytes + offscreen_bytes(view_width, view_height)
+
+	def memory(self):
+		return self.memory_needed(self.settings, self.view_width, self.view_height)
+
+	def matches(self, settings, view_width, view_height):
+		return (self.settings['vx'] == settings['vx'] and self.settings['vy'] == settings['vy']
+			and self.view_width == view_width and self.view_height == view_height)
+
+	def draw(self, view_context):
+		''' Draws the views of the current frame, returns the quilt as height x width x 4 uint8 view of the read back buffer '''
+		scene = view_context.scene
+		modelview_matrices, projection_matrices = OffScreenDraw.compute_view_matrices(OffScreenDraw, view_context, self.settings['vtotal'])
+		num_views = min(self.settings['vtotal'], len(modelview_matrices))
+		for view in range(num_views):
+			with self.offscreen.bind():
+				self.offscreen.draw_view3d(scene, view_context.view_layer, view_context.space_data, view_context.region,
+					modelview_matrices[view], projection_matrices[view])
+			# the copy needs a bind of its own, see https://developer.blender.org/T84402
+			with self.offscreen.bind():
+				x, y = view_origin(view, self.settings['vx'], self.view_width, self.view_height)
+				old_draw_framebuffer = Buffer(GL_INT, 1)
+				glGetIntegerv(GL_DRAW_FRAMEBUFFER_BINDING, old_draw_framebuffer)
+				glBindFramebuffer(GL_DRAW_FRAMEBUFFER, self.framebuffer[0])
+				glBlitFramebuffer(0, 0, self.view_width, self.view_height,
+					x, y, x + self.view_width, y + self.view_height, GL_COLOR_BUFFER_BIT, GL_NEAREST)
+				glBindFramebuffer(GL_DRAW_FRAMEBUFFER, old_draw_framebuffer[0])
+
+		glActiveTexture(GL_TEXTURE0)
+		glBindTexture(GL_TEXTURE_2D, self.texture[0])
+		glGetTexImage(GL_TEXTURE_2D, 0, GL_RGBA, GL_UNSIGNED_BYTE, self.read_buffer)
+		glBindTexture(GL_TEXTURE_2D, 0)
+		return np.frombuffer(self.read_buffer, dtype=np.uint8).reshape(self.height, self.width, 4)
+
+	def free(self):
+		self.offscreen.free()
+		glDeleteFramebuffers(1, self.framebuffer)
+		glDeleteTextures(1, self.texture)
+
+def render_view_size(scene):
+	''' (width, height) of a view at the render resolution of the scene '''
+	render = scene.render
+	return (int(render.resolution_x * render.resolution_percentage / 100),
+		int(render.resolution_y * render.resolution_percentage / 100))
+
+def quilt_target(settings, view_width, view_height):
+	''' The QuiltTarget of draw_quilt, set up again when the layout or view size changes, None when it does not fit the memory budget '''
+	global hp_quiltTarget
+
+	if hp_quiltTarget is not None and hp_quiltTarget.matches(settings, view_width, view_height):
+		# the number of views can change without setting up the target again
+		hp_quiltTarget.settings = dict(settings)
+		return hp_quiltTarget
+	free_quilt_target()
+	if not reserve_memory(*QuiltTarget.memory_needed(settings, view_width, view_height)):
+		return None
+	hp_quiltTarget = QuiltTarget(settings, view_width, view_height)
+	return hp_quiltTarget
+
+def free_quilt_target():
+	global hp_quiltTarget
+
+	if hp_quiltTarget is not None:
+		hp_quiltTarget.free()
+		hp_quiltTarget = None
+
+def draw_quilt(view_context, frame, settings):
+	''' Draws a quilt of the frame at render resolution with the shading of the 3D view, None when it does not fit the memory budget
+
+	The quilt is a height x width x 4 uint8 array (rows bottom to top) that stays valid until the next call.
+	The scene is left at the frame.
+	'''
+	scene = view_context.scene
+	view_width, view_height = render_view_size(scene)
+	target = quilt_target(settings, view_width, view_height)
+	if target is None:
+		return None
+	if scene.frame_current != frame:
+		scene.frame_set(frame)
+	return target.draw(view_context)
+
+class QuiltRender:
+	''' A running offline render of quilt images at render resolution, advanced by render_quilts_timer
+
+	Every view is drawn into one offscreen and copied into a quilt texture on the GPU, each frame is read back once
+	and handed to a QuiltImageWriter.
+	'''
+
+	def __init__(self, context, view_context, shading):
+		scene = context.scene
+		render = scene.render
+		self.scene_name = scene.name
+		self.frames = list(range(scene.frame_start, scene.frame_end + 1, scene.frame_step))
+		self.done = 0
+		self.cancelled = False
+		self.frame_before = scene.frame_current
+		self.settings = get_rig_layout(scene)
+		# set up before touching the settings of the user, nothing needs restoring when it fails
+		self.target = QuiltTarget(self.settings, *render_view_size(scene))
+
+		# draw with EEVEE or the chosen shading and without overlays, restored by finish()
+		space = view_context.space_data
+		self.restore = [(render, 'engine', render.engine), (space.shading, 'type', space.shading.type),
+			(space.overlay, 'show_overlays', space.overlay.show_overlays)]
+		if shading == 'RENDERED':
+			render.engine = 'BLENDER_EEVEE'
+		space.shading.type = shading
+		space.overlay.show_overlays = False
+
+		self.writer = QuiltImageWriter()
+		self.start_time = timeit.default_timer()
+
+	@staticmethod
+	def memory_needed(scene):
+		''' (host bytes, GPU bytes) a render of the scene needs: the quilt target and the writer buffers '''
+		host, gpu_bytes = QuiltTarget.memory_needed(get_rig_layout(scene), *render_view_size(scene))
+		return 4 * host, gpu_bytes
+
+	def memory(self):
+		host, gpu_bytes = self.target.memory()
+		return 4 * host, gpu_bytes
+
+	def render_frame(self, view_context, frame):
+		scene = view_context.scene
+		scene.frame_set(frame)
+		quilt = self.target.draw(view_context)
+		# quilt images are always PNG, whatever the output format of the scene
+		filepath = quilt_filepath(os.path.splitext(scene.render.frame_path(frame=frame))[0] + ".png", self.settings)
+		directory = os.path.dirname(filepath)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		self.writer.write(filepath, quilt, self.settings)
+
+	def finish(self, context):
+		for data, attribute, value in self.restore:
+			try:
+				setattr(data, attribute, value)
+			except ReferenceError:
+				pass
+		scene = bpy.data.scenes.get(self.scene_name)
+		if scene is not None:
+			scene.frame_set(self.frame_before)
+		self.target.free()
+		errors = self.writer.close()
+		context.window_manager.progress_end()
+		print("Rendered %d of %d quilt images in %.1fs, writing took %.1fs in the background, %d failed"
+			% (self.done, len(self.frames), timeit.default_timer() - self.start_time, self.writer.write_time, len(errors)))
+
+def render_quilts_timer():
+	''' Renders quilt images for bake_time_slice seconds, then returns to the interface until the next call '''
+	global hp_quiltRender
+
+	job = hp_quiltRender
+	if job is None:
+		return None
+	context = bpy.context
+	view_context = find_view3d_context(context)
+	if view_context is None:
+		print("Rendering quilts needs an open 3D view, cancelling")
+		job.cancelled = True
+	slice_start = timeit.default_timer()
+	try:
+		while not job.cancelled and job.done < len(job.frames):
+			job.render_frame(view_context, job.frames[job.done])
+			job.done += 1
+			if timeit.default_timer() - slice_start > bake_time_slice:
+				break
+	except Exception as error:
+		print("Rendering the quilt of frame %d failed, cancelling: %s" % (job.frames[job.done], error))
+		job.cancelled = True
+	finally:
+		# whatever happened, the render engine, shading and overlays of the user are restored
+		if job.cancelled or job.done >= len(job.frames):
+			hp_quiltRender = None
+			job.finish(context)
+	tag_redraw_sidebars(context)
+	if hp_quiltRender is None:
+		return None
+	context.window_manager.progress_update(job.done)
+	return 0.001
+
+class looking_glass_render_quilts(bpy.types.Operator):
+	""" Renders the frame range into quilt images with the viewport renderer """
+	bl_idname = "lookingglass.render_quilts"
+	bl_label = "Render Quilts (Viewport)"
+	bl_description = "Renders quilt images of the frame range at render resolution with EEVEE in the viewport, much faster than rendering every view. For animatics and reviews."
+
+	shading: bpy.props.EnumProperty(
+		name="Shading",
+		items=[('RENDERED', "EEVEE", "Draw the views with EEVEE"),
+				('MATERIAL', "Material Preview", "Draw the views with the material preview of the viewport"),
+				('SOLID', "Solid", "Draw the views with solid shading")],
+		default='RENDERED',
+		)
+
+	def invoke(self, context, event):
+		return context.window_manager.invoke_props_dialog(self)
+
+	def execute(self, context):
+		global hp_quiltRender
+
+		if hp_quiltRender is not None or hp_bake is not None:
+			self.report({'ERROR'}, "Quilts are being rendered or baked already.")
+			return {'CANCELLED'}
+		view_context = find_view3d_context(context)
+		if view_context is None:
+			self.report({'ERROR'}, "Rendering quilts needs an open 3D view.")
+			return {'CANCELLED'}
+		host, gpu_bytes = QuiltRender.memory_needed(context.scene)
+		if not reserve_memory(host, gpu_bytes):
+			self.report({'ERROR'}, "Not enough memory within the budget of the add-on preferences to render quilts.")
+			return {'CANCELLED'}
+		hp_quiltRender = QuiltRender(context, view_context, self.shading)
+		context.window_manager.progress_begin(0, len(hp_quiltRender.frames))
+		bpy.app.timers.register(render_quilts_timer)
+		return {'FINISHED'}
+
+class looking_glass_cancel_quilt_render(bpy.types.Operator):
+	""" Stops rendering quilt images, the images written so far stay on disk """
+	bl_idname = "lookingglass.cancel_quilt_render"
+	bl_label = "Cancel Quilt Render"
+	bl_description = "Stops rendering quilt images."
+
+	def execute(self, context):
+		if hp_quiltRender is not None:
+			hp_quiltRender.cancelled = True
+		return {'FINISHED'}
+
+class looking_glass_record_session(bpy.types.Operator):
+	""" Starts or stops recording every quilt shown in the Looking Glass """
+	bl_idname = "lookingglass.record_session"
+	bl_label = "Record Session"
+	bl_description = "Records every quilt rendered for the Looking Glass or drawn by the live view with its timestamp. Run again to stop recording."
+
+	filepath: bpy.props.StringProperty(subtype='FILE_PATH', default="session.lkgrec")
+	filter_glob: bpy.props.StringProperty(default="*.lkgrec", options={'HIDDEN'})
+	compress: bpy.props.BoolProperty(name="Compress", default=False,
+		description="Compress the quilts with zlib, smaller files but quilts are dropped sooner when the disk writer falls behind")
+
+	def invoke(self, context, event):
+		if looking_glass_settings.recorder is not None:
+			return self.execute(context)
+		context.window_manager.fileselect_add(self)
+		return {'RUNNING_MODAL'}
+
+	def execute(self, context):
+		recorder = looking_glass_settings.recorder
+		if recorder is not None:
+			unsubscribe('recorder')
+			looking_glass_settings.recorder = None
+			error = recorder.close()
+			if error is not None:
+				self.report({'ERROR'}, "Recording stopped after %d quilts: %s" % (recorder.frames_recorded, error))
+				return {'FINISHED'}
+			self.report({'INFO'}, "Recorded %d quilts, dropped %d, into %s" % (recorder.frames_recorded, recorder.frames_dropped, recorder.filepath))
+			return {'FINISHED'}
+		filepath = bpy.path.ensure_ext(bpy.path.abspath(self.filepath), ".lkgrec")
+		# the recorder keeps up to five quilts in memory while the disk catches up
+		if not reserve_memory(5 * qs_width * qs_height * 4):
+			self.report({'ERROR'}, "Not enough memory within the budget of the add-on preferences to record.")
+			return {'CANCELLED'}
+		looking_glass_settings.recorder = QuiltRecorder(filepath, self.compress)
+		subscribe('recorder', looking_glass_settings.recorder.record)
+		return {'FINISHED'}
+
+class looking_glass_replay_recording(bpy.types.Operator):
+	""" Sends a session recording to HoloPlay Service with its original timing """
+	bl_idname = "lookingglass.replay_recording"
+	bl_label = "Replay Recording"
+	bl_description = "Shows a session recording in the Looking Glass at the pace it was recorded. Run again to stop the replay."
+
+	filepath: bpy.props.StringProperty(subtype='FILE_PATH')
+	filter_glob: bpy.props.StringProperty(default="*.lkgrec", options={'HIDDEN'})
+	speed: bpy.props.FloatProperty(name="Speed", default=1.0, min=0.1, max=10.0)
+
+	def invoke(self, context, event):
+		if hp_replay is not None and hp_replay[0].is_alive():
+			return self.execute(context)
+		context.window_manager.fileselect_add(self)
+		return {'RUNNING_MODAL'}
+
+	def execute(self, context):
+		global hp_replay
+
+		if hp_replay is not None and hp_replay[0].is_alive():
+			hp_replay[1].set()
+			hp_replay = None
+			return {'FINISHED'}
+		if looking_glass_settings.sock is None:
+			self.report({'ERROR'}, "HoloPlay Service is not connected.")
+			return {'CANCELLED'}
+		filepath = bpy.path.abspath(self.filepath)
+		if not os.path.isfile(filepath):
+			self.report({'ERROR'}, "Recording not found: " + filepath)
+			return {'CANCELLED'}
+		stop_event = threading.Event()
+		send = lambda quilt, settings: send_quilt_pixels(looking_glass_settings.sock, quilt, settings)
+		thread = threading.Thread(target=replay_recording, args=(filepath, send, self.speed, stop_event), daemon=True)
+		thread.start()
+		hp_replay = (thread, stop_event)
+		return {'FINISHED'}
+
 class looking_glass_send_quilt_to_holoplay_service(bpy.types.Operator):
 	""" Creates a new window of type image editor """
 	bl_idname = "lookingglass.send_quilt_to_holoplay_service"
 	bl_label = "Send Quilt"
 	bl_description = "Sends the currently loaded image to HoloPlay Service to display it in the Looking Glass."
-	bl_options = {'REGISTER', 'UNDO'}
+	# sending does not change any data, an undo step would only cost time
+	bl_options = {'REGISTER'}
 
 	def execute(self, context):
-		global hp_imgDataBlockQuilt
-		global hp_myQuilt
-		global qs_width
-		global qs_height
 		global sock
 
-		# print("Init Settings")
-		start_time = timeit.default_timer()
-
 		sock = looking_glass_settings.sock
-		qs_totalViews = 45
-		od = OffScreenDraw
-		if hp_myQuilt == None:
-			hp_myQuilt = od.setupMyQuilt(hp_myQuilt)
-		LKG_image = context.scene.LKG_image		
-		if LKG_image != None:
-			quilt = od.create_quilt_from_holoplay_multiview_image(od, context)
+		quilt_image = get_quilt_image(context)
+		if (quilt_image is not None and not hp_quiltBus.has_subscribers()
+			and sniff_image_format(quilt_image[0]) in passthrough_formats):
+			# showing an existing quilt only costs reading the file
+			cancel_progressive_send()
+			start_time = timeit.default_timer()
+			send_quilt_file(sock, quilt_image[0], quilt_image[1])
+			print("Sending quilt image %s took: %.6f" % (quilt_image[0], timeit.default_timer() - start_time))
+			return {'FINISHED'}
+		quilt, settings = get_current_quilt(context)
+		if quilt is None:
+			return {'CANCELLED'}
+		wm = context.window_manager
+		if wm.progressivePreview == 'OFF':
+			cancel_progressive_send()
+			# send_quilt(sock, quilt, duration=int(7))
+			send_quilt_from_np(sock, quilt, duration=int(7), settings=settings)
 		else:
-			offscreens = od._setup_offscreens(context, qs_totalViews)
-			print("Setting up HoloPlay Service took: %.6f" % (timeit.default_timer() - start_time))
-			start_time_offscreendraw = timeit.default_timer()
-			od.draw_3dview_into_texture(od, context, offscreens)
-			print("Drawing into offscreens took: %.6f" % (timeit.default_timer() - start_time_offscreendraw))
-			start_time_quiltcopy = timeit.default_timer()
-			# quilt = od.copy_quilt_from_texture_to_image_datablock(hp_myQuilt[0])
-			quilt = od.copy_quilt_from_texture_to_numpy_array(hp_myQuilt[0])
-			print("Copying quilt into np array took: %.6f" % (timeit.default_timer() - start_time_quiltcopy))
-		# send_quilt(sock, quilt, duration=int(7))
-		send_quilt_from_np(sock, quilt, duration=int(7))
+			width, height = quilt_size(quilt)
+			send_quilt_progressive(sock, quilt.reshape(height, width, -1), settings,
+				int(wm.progressivePreview), wm.progressiveSettleTime)
 		print("Done.")
 		return {'FINISHED'}
 
+class looking_glass_save_interlaced_image(bpy.types.Operator):
+	""" Saves the current quilt as it would be shown on the Looking Glass """
+	bl_idname = "lookingglass.save_interlaced_image"
+	bl_label = "Save Interlaced Image"
+	bl_description = "Interlaces the current quilt on the CPU with the device calibration and saves the native image of the display."
+
+	filepath: bpy.props.StringProperty(subtype="FILE_PATH")
+
+	def invoke(self, context, event):
+		if looking_glass_settings.calibration is None:
+			self.report({'ERROR'}, "No Looking Glass calibration available.")
+			return {'CANCELLED'}
+		if not self.filepath:
+			self.filepath = "//interlaced.png"
+		context.window_manager.fileselect_add(self)
+		return {'RUNNING_MODAL'}
+
+	def execute(self, context):
+		from PIL import Image
+
+		calibration = looking_glass_settings.calibration
+		if calibration is None:
+			self.report({'ERROR'}, "No Looking Glass calibration available.")
+			return {'CANCELLED'}
+		quilt, settings = get_current_quilt(context)
+		if quilt is None:
+			return {'CANCELLED'}
+
+		start_time = timeit.default_timer()
+		width, height = quilt_size(quilt)
+		channels = quilt.shape[2] if quilt.ndim == 3 else 4
+		try:
+			interlacer = get_interlacer(calibration, width, height, settings, channels)
+		except ValueError as error:
+			self.report({'ERROR'}, "Cannot interlace with this calibration: %s" % error)
+			return {'CANCELLED'}
+		native = interlacer.interlace(quilt)
+		print("Interlacing the quilt took: %.6f" % (timeit.default_timer() - start_time))
+
+		# rows are stored bottom to top, image files top to bottom
+		filepath = bpy.path.abspath(self.filepath)
+		Image.fromarray(native[::-1]).save(filepath)
+		self.report({'INFO'}, "Saved interlaced image to " + filepath)
+		return {'FINISHED'}
+
 def menu_func(self, context):
 	''' Helper function to add the operator to menus '''
 	self.layout.operator(OffScreenDraw.bl_idname)
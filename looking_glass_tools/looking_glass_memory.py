@@ -0,0 +1,90 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Keeps track of the memory the add-on holds in host memory and on the GPU. Every
+# subsystem registers a probe that reports its current usage and optionally an
+# evictor that frees what can be rebuilt later. When a budget is exceeded the
+# evictors run in the order they were registered, and new jobs that would not fit
+# are refused. Does not import bpy.
+
+from collections import OrderedDict
+
+class MemoryGovernor:
+	''' Sums up the usage of all subsystems and keeps it below the host and GPU budgets, 0 means no limit '''
+
+	def __init__(self, host_budget=0, gpu_budget=0):
+		self.host_budget = host_budget
+		self.gpu_budget = gpu_budget
+		self.evictions = 0
+		self._subsystems = OrderedDict()
+
+	def register(self, name, probe, evict=None):
+		''' probe() returns (host bytes, GPU bytes), evict() frees whatever the subsystem can do without '''
+		self._subsystems[name] = (probe, evict)
+
+	def unregister(self, name):
+		self._subsystems.pop(name, None)
+
+	def usage(self):
+		''' {subsystem: (host bytes, GPU bytes)} '''
+		usage = OrderedDict()
+		for name, (probe, evict) in self._subsystems.items():
+			try:
+				usage[name] = probe()
+			except Exception as error:
+				print("Memory probe %s failed: %s" % (name, error))
+				usage[name] = (0, 0)
+		return usage
+
+	def totals(self):
+		''' (host bytes, GPU bytes) of all subsystems '''
+		usage = self.usage().values()
+		return sum(host for host, gpu in usage), sum(gpu for host, gpu in usage)
+
+	def fits(self, host=0, gpu=0):
+		host_used, gpu_used = self.totals()
+		return ((not self.host_budget or host_used + host <= self.host_budget)
+			and (not self.gpu_budget or gpu_used + gpu <= self.gpu_budget))
+
+	def reserve(self, host=0, gpu=0):
+		''' Evicts caches until an allocation of host and gpu bytes fits the budgets, False when it still does not '''
+		if self.fits(host, gpu):
+			return True
+		for name, (probe, evict) in list(self._subsystems.items()):
+			if evict is None:
+				continue
+			evict()
+			self.evictions += 1
+			if self.fits(host, gpu):
+				return True
+		return False
+
+	def enforce(self):
+		''' Evicts caches while the current usage exceeds a budget '''
+		return self.reserve(0, 0)
+
+	def set_budgets(self, host_budget, gpu_budget):
+		self.host_budget = host_budget
+		self.gpu_budget = gpu_budget
+		self.enforce()
+
+governor = MemoryGovernor()
+
+def offscreen_bytes(width, height):
+	''' GPU memory of an offscreen: 8 bit RGBA color and a 32 bit depth buffer '''
+	return width * height * 8
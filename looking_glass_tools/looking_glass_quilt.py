@@ -0,0 +1,265 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# CPU side quilt helpers. This module must not import bpy so it can be used
+# by worker processes and command line tools outside of Blender.
+
+import re
+import struct
+import zlib
+import numpy as np
+from math import floor
+
+# quilt layouts are passed around as the settings dictionaries HoloPlay Service
+# expects, e.g. {'vx': 5, 'vy': 9, 'vtotal': 45, 'aspect': 0.75}
+def quilt_settings(vx, vy, aspect, vtotal=None):
+	''' Returns a HoloPlay Service quilt settings dictionary '''
+	if vtotal is None:
+		vtotal = vx * vy
+	return {'vx': int(vx), 'vy': int(vy), 'vtotal': int(vtotal), 'aspect': float(aspect)}
+
+# naming convention used by HoloPlay Studio and the Looking Glass tools: name_qs5x9a0.75.png
+quilt_suffix_pattern = re.compile(r'_qs(\d+)x(\d+)a(\d+(?:\.\d+)?)')
+
+def quilt_suffix(settings):
+	''' Returns the filename suffix which encodes the quilt layout '''
+	return "_qs%dx%da%s" % (settings['vx'], settings['vy'], ("%.4f" % settings['aspect']).rstrip('0').rstrip('.'))
+
+def quilt_filepath(filepath, settings):
+	''' Inserts the quilt layout suffix in front of the file extension '''
+	split = filepath.rsplit('.', 1)
+	if len(split) == 1:
+		return filepath + quilt_suffix(settings)
+	return split[0] + quilt_suffix(settings) + '.' + split[1]
+
+def parse_quilt_suffix(filepath):
+	''' Returns the settings encoded in a file name like name_qs5x9a0.75.png or None '''
+	matches = quilt_suffix_pattern.findall(filepath.replace('\\', '/').rsplit('/', 1)[-1])
+	if not matches:
+		return None
+	vx, vy, aspect = matches[-1]
+	return quilt_settings(int(vx), int(vy), float(aspect))
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+
+def read_png_text(filepath):
+	''' Returns the tEXt chunks in front of the image data of a PNG file as dictionary '''
+	text = {}
+	with open(filepath, 'rb') as f:
+		if f.read(8) != png_signature:
+			return text
+		while True:
+			chunk_header = f.read(8)
+			if len(chunk_header) < 8:
+				break
+			length, chunk_type = struct.unpack('>I4s', chunk_header)
+			if chunk_type in (b'IDAT', b'IEND'):
+				break
+			data = f.read(length)
+			f.seek(4, 1)
+			if chunk_type == b'tEXt' and b'\0' in data:
+				key, value = data.split(b'\0', 1)
+				text[key.decode('latin-1')] = value.decode('latin-1')
+	return text
+
+def png_chunk(chunk_type, data):
+	return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+def write_png(filepath, pixels, text=None, level=1):
+	''' Writes height x width x 4 uint8 RGBA pixels (rows bottom to top) as 8 bit PNG with optional tEXt chunks
+
+	zlib releases the GIL, so writer threads compress while Blender keeps rendering.
+	'''
+	height, width, channels = pixels.shape
+	# every row starts with its filter type, 0 means no filter, PNG rows run top to bottom
+	rows = np.empty((height, 1 + width * channels), dtype=np.uint8)
+	rows[:, 0] = 0
+	rows[:, 1:] = pixels[::-1].reshape(height, width * channels)
+	color_type = {1: 0, 2: 4, 3: 2, 4: 6}[channels]
+	with open(filepath, 'wb') as f:
+		f.write(png_signature)
+		f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)))
+		for key, value in (text or {}).items():
+			f.write(png_chunk(b'tEXt', key.encode('latin-1') + b'\0' + str(value).encode('latin-1')))
+		f.write(png_chunk(b'IDAT', zlib.compress(memoryview(rows).cast('B'), level)))
+		f.write(png_chunk(b'IEND', b''))
+
+def quilt_image_settings(filepath):
+	''' Layout of a quilt image from its file name or, for PNG files, from the vx, vy, vtotal and aspect text chunks '''
+	settings = parse_quilt_suffix(filepath)
+	if settings is not None:
+		return settings
+	try:
+		text = read_png_text(filepath)
+		if 'vx' in text and 'vy' in text:
+			return quilt_settings(int(text['vx']), int(text['vy']), float(text.get('aspect', 0.75)),
+				int(text['vtotal']) if 'vtotal' in text else None)
+	except (OSError, ValueError, struct.error):
+		pass
+	return None
+
+def view_origin(view, columns, view_width, view_height):
+	''' Lower left corner of a view in the quilt, view 0 is in the lower left corner '''
+	x = int((view % columns) * view_width)
+	y = int(floor(view / columns) * view_height)
+	return x, y
+
+# staging arrays are allocated once and reused, quilts are too big to allocate them on every send
+_staging_arrays = {}
+
+def staging_array(name, shape, dtype):
+	''' Returns a preallocated array that is shared by everyone asking for the same name '''
+	array = _staging_arrays.get(name)
+	if array is None or array.shape != tuple(shape) or array.dtype != np.dtype(dtype):
+		array = np.empty(shape, dtype=dtype)
+		_staging_arrays[name] = array
+	return array
+
+def staging_bytes():
+	''' Memory held by all staging arrays '''
+	return sum(array.nbytes for array in _staging_arrays.values())
+
+def clear_staging_arrays():
+	''' Drops the staging arrays, they are allocated again by the next caller '''
+	_staging_arrays.clear()
+
+def float_to_uint8(src, out=None, scratch=None):
+	''' Quantizes 0-1 floats to 0-255, clipping values outside of that range
+
+	`scratch` is a float32 array of the same shape for the intermediate result, pass `src` to work in place.
+	'''
+	if out is None:
+		out = np.empty(src.shape, dtype=np.uint8)
+	if scratch is None:
+		tmp = np.multiply(src, 255.0, dtype=np.float32)
+	else:
+		tmp = np.multiply(src, 255.0, out=scratch)
+	np.clip(tmp, 0.0, 255.0, out=tmp)
+	np.rint(tmp, out=tmp)
+	np.copyto(out, tmp, casting='unsafe')
+	return out
+
+def uint8_to_float(src, out=None):
+	''' Converts 0-255 integers to 0-1 floats as expected by Image.pixels '''
+	if out is None:
+		out = np.empty(src.shape, dtype=np.float32)
+	np.multiply(src, 1.0 / 255.0, out=out, casting='unsafe')
+	return out
+
+def fit_view(pixels, view_width, view_height):
+	''' Nearest neighbour resample of a view when it does not match the size of a quilt tile '''
+	height, width = pixels.shape[:2]
+	if width == view_width and height == view_height:
+		return pixels
+	rows = (np.arange(view_height) * height // view_height)
+	cols = (np.arange(view_width) * width // view_width)
+	return pixels[rows[:, None], cols[None, :]]
+
+class QuiltAssembler:
+	''' Collects the views of one frame and places them in a quilt as soon as they arrive
+
+	Pixel rows are stored bottom to top like in Blender image datablocks and OpenGL textures.
+	'''
+
+	def __init__(self, columns, rows, view_width, view_height, channels=4, num_views=None, quilt_width=None, quilt_height=None):
+		self.columns = columns
+		self.rows = rows
+		self.view_width = view_width
+		self.view_height = view_height
+		self.num_views = num_views if num_views is not None else columns * rows
+		# the quilt can be bigger than the views, e.g. 4096 x 4096 for 5 x 9 views of 819 x 455
+		if quilt_width is None:
+			quilt_width = columns * view_width
+		if quilt_height is None:
+			quilt_height = rows * view_height
+		self.quilt = np.zeros((quilt_height, quilt_width, channels), dtype=np.uint8)
+		self.views_done = set()
+
+	@property
+	def width(self):
+		return self.quilt.shape[1]
+
+	@property
+	def height(self):
+		return self.quilt.shape[0]
+
+	def tile(self, view):
+		''' Returns the writable part of the quilt that holds the view '''
+		x, y = view_origin(view, self.columns, self.view_width, self.view_height)
+		return self.quilt[y:y + self.view_height, x:x + self.view_width]
+
+	def add_view(self, view, pixels, color=None):
+		''' Places one view (uint8 or 0-1 float, height x width x channels) in the quilt
+
+		Scene linear float views pass a ColorTransform as color, it writes the display values straight into the tile.
+		'''
+		pixels = fit_view(pixels, self.view_width, self.view_height)
+		channels = min(pixels.shape[2], self.quilt.shape[2])
+		tile = self.tile(view)
+		if pixels.dtype == np.uint8:
+			tile[:, :, :channels] = pixels[:, :, :channels]
+		elif color is not None:
+			color.apply(pixels[:, :, :channels], out=tile[:, :, :channels])
+		else:
+			float_to_uint8(pixels[:, :, :channels], out=tile[:, :, :channels])
+		if channels < self.quilt.shape[2]:
+			tile[:, :, channels:] = 255
+		self.views_done.add(view)
+
+	def is_complete(self):
+		return len(self.views_done) >= self.num_views
+
+	def reset(self):
+		self.quilt.fill(0)
+		self.views_done = set()
+
+def assemble_quilt(views, columns, rows, view_width=None, view_height=None, channels=4):
+	''' Builds a quilt from a list of views, the first view ends up in the lower left corner '''
+	if view_width is None or view_height is None:
+		view_height, view_width = views[0].shape[:2]
+	assembler = QuiltAssembler(columns, rows, view_width, view_height, channels, len(views))
+	for view, pixels in enumerate(views):
+		assembler.add_view(view, pixels)
+	return assembler.quilt
+
+def downsample_quilt(quilt, out=None):
+	''' Halves width and height of a uint8 quilt by averaging 2x2 blocks, odd last rows and columns are dropped '''
+	height, width, channels = quilt.shape[0] // 2, quilt.shape[1] // 2, quilt.shape[2]
+	# sum pairs of rows first, then neighbouring pixels of the summed rows, four uint8 values fit into uint16
+	rows = np.add(quilt[0:height * 2:2], quilt[1:height * 2:2], dtype=np.uint16)
+	pairs = rows[:, :width * 2].reshape(height, width, 2, channels)
+	total = np.add(pairs[:, :, 0], pairs[:, :, 1])
+	# +2 rounds to nearest
+	total += 2
+	total >>= 2
+	if out is None:
+		out = np.empty((height, width, channels), dtype=np.uint8)
+	np.copyto(out, total, casting='unsafe')
+	return out
+
+def quilt_pyramid(quilt, min_width):
+	''' Returns the quilt followed by halved versions of it down to the first one not wider than min_width
+
+	The levels are staging arrays, they are overwritten by the next call.
+	'''
+	levels = [quilt]
+	while levels[-1].shape[1] > min_width and levels[-1].shape[1] >= 2:
+		source = levels[-1]
+		shape = (source.shape[0] // 2, source.shape[1] // 2, source.shape[2])
+		levels.append(downsample_quilt(source, staging_array("quilt_pyramid_%d" % len(levels), shape, np.uint8)))
+	return levels
@@ -0,0 +1,183 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Hands every quilt that is rendered once to all of its consumers. The producer publishes
+# a quilt under a new generation, each subscriber takes the latest generation whenever it
+# is ready again and skips the ones it was too slow for. Published quilts are copied into
+# a small pool of buffers, a buffer is reused once it is neither the latest quilt nor read
+# by a subscriber. Does not import bpy.
+
+import threading
+import time
+import numpy as np
+
+class PublishedQuilt:
+	''' One generation on the bus: the quilt, its settings, a tag describing what it shows and when it was published '''
+
+	def __init__(self, generation, quilt, settings, tag, published_at):
+		self.generation = generation
+		self.quilt = quilt
+		self.settings = settings
+		self.tag = tag
+		self.published_at = published_at
+
+class QuiltBus:
+	''' Publishes height x width x 4 uint8 quilts to any number of subscriptions
+
+	Quilts are published from Blender's main thread only. Readers on the main thread can use latest() directly,
+	its quilt stays untouched until the next publish. Readers on other threads subscribe, their quilt is not
+	reused while their callback runs.
+	'''
+
+	def __init__(self):
+		self.condition = threading.Condition()
+		self.generation = 0
+		self._latest = None
+		self._buffers = []
+		# id of a buffer -> number of subscriptions reading it
+		self._held = {}
+		self._subscriptions = []
+
+	def has_subscribers(self):
+		return bool(self._subscriptions)
+
+	def publish(self, quilt, settings, tag=None):
+		''' Copies a quilt onto the bus and wakes the subscriptions, returns its generation '''
+		with self.condition:
+			buffer = self._free_buffer(quilt.shape)
+		# the buffer is neither the latest quilt nor held by anyone, nobody can pick it up while it is filled
+		np.copyto(buffer, quilt)
+		with self.condition:
+			self.generation += 1
+			self._latest = PublishedQuilt(self.generation, buffer, dict(settings), tag, time.monotonic())
+			self.condition.notify_all()
+			return self.generation
+
+	def latest(self, tag=None):
+		''' The newest PublishedQuilt, None when nothing was published yet or it was published with another tag '''
+		latest = self._latest
+		if latest is None or (tag is not None and latest.tag != tag):
+			return None
+		return latest
+
+	def subscribe(self, callback, name="", accept=None):
+		''' Calls callback(quilt, settings) from a thread of its own with every generation it can keep up with
+
+		accept(tag) can turn down quilts by their tag, e.g. to only follow the live view.
+		'''
+		subscription = Subscription(self, callback, name, accept)
+		with self.condition:
+			self._subscriptions.append(subscription)
+		subscription.start()
+		return subscription
+
+	def unsubscribe(self, subscription):
+		with self.condition:
+			if subscription in self._subscriptions:
+				self._subscriptions.remove(subscription)
+		subscription.stop()
+
+	def clear(self):
+		''' Stops all subscriptions and frees the buffers '''
+		for subscription in list(self._subscriptions):
+			self.unsubscribe(subscription)
+		with self.condition:
+			self._latest = None
+			self._buffers = []
+			self._held = {}
+
+	def buffer_bytes(self):
+		return sum(buffer.nbytes for buffer in self._buffers)
+
+	def trim(self):
+		''' Drops the buffers that are neither the latest quilt nor read by a subscription '''
+		with self.condition:
+			latest = self._latest.quilt if self._latest is not None else None
+			self._buffers = [buffer for buffer in self._buffers if buffer is latest or self._held.get(id(buffer), 0) > 0]
+
+	def _free_buffer(self, shape):
+		latest = self._latest.quilt if self._latest is not None else None
+		busy = lambda buffer: buffer is latest or self._held.get(id(buffer), 0) > 0
+		for buffer in self._buffers:
+			if not busy(buffer) and buffer.shape == tuple(shape):
+				return buffer
+		# buffers of another quilt size are not going to be used again
+		self._buffers = [buffer for buffer in self._buffers if busy(buffer) or buffer.shape == tuple(shape)]
+		buffer = np.empty(shape, dtype=np.uint8)
+		self._buffers.append(buffer)
+		return buffer
+
+	def _hold(self, buffer):
+		self._held[id(buffer)] = self._held.get(id(buffer), 0) + 1
+
+	def _release(self, buffer):
+		count = self._held.get(id(buffer), 0) - 1
+		if count > 0:
+			self._held[id(buffer)] = count
+		else:
+			self._held.pop(id(buffer), None)
+
+class Subscription:
+	''' Takes the latest generation of a bus whenever its callback is done with the previous one '''
+
+	def __init__(self, bus, callback, name="", accept=None):
+		self.bus = bus
+		self.callback = callback
+		self.name = name
+		self.accept = accept
+		# only quilts published after subscribing are delivered
+		self.seen = bus.generation
+		self.delivered = 0
+		self.skipped = 0
+		self.last_error = None
+		self._running = True
+		self._thread = threading.Thread(target=self._run, daemon=True)
+
+	def start(self):
+		self._thread.start()
+
+	def _run(self):
+		bus = self.bus
+		while True:
+			with bus.condition:
+				while self._running and (bus._latest is None or bus._latest.generation <= self.seen):
+					bus.condition.wait()
+				if not self._running:
+					return
+				published = bus._latest
+				self.skipped += published.generation - self.seen - 1
+				self.seen = published.generation
+				if self.accept is not None and not self.accept(published.tag):
+					continue
+				bus._hold(published.quilt)
+			try:
+				self.callback(published.quilt, published.settings)
+				self.delivered += 1
+			except Exception as error:
+				self.last_error = error
+				print("Quilt subscriber %s failed: %s" % (self.name, error))
+			finally:
+				with bus.condition:
+					bus._release(published.quilt)
+
+	def stop(self):
+		with self.bus.condition:
+			self._running = False
+			self.bus.condition.notify_all()
+		if self._thread is not threading.current_thread():
+			self._thread.join(timeout=5.0)
@@ -0,0 +1,176 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# A simple container for quilt animations: a fixed size header followed by the
+# uint8 quilts of consecutive frames, rows stored bottom to top. Frames are
+# stored as RGB, HoloPlay Service ignores alpha. Raw files are read through
+# numpy.memmap, so showing a frame does not decode anything. Compressed files
+# hold one zlib stream per frame and an index of them, they are a fraction of
+# the size for the usual rendered quilts and are decoded while the previous
+# frame is sent. Does not import bpy.
+
+import os
+import struct
+import threading
+import zlib
+import numpy as np
+
+quilt_file_magic = b'LKGQUILT'
+quilt_file_version = 2
+# magic, version, width, height, channels, vx, vy, vtotal, aspect, frame_start, frame_count, data_offset
+quilt_file_header = struct.Struct('<8sIIIIIIIfiII')
+# version 2 follows the header with the codec of the frames
+quilt_file_codec = struct.Struct('<I')
+codec_raw = 0
+codec_zlib = 1
+# compressed files start with an index of (offset, size) per frame at data_offset, size 0 for frames not written yet
+quilt_file_index_entry = struct.Struct('<QQ')
+# frames start on a page boundary so they can be mapped efficiently
+quilt_file_data_offset = 4096
+# fast compression, rendered quilts with large flat areas still shrink several times
+quilt_file_compression = 1
+
+def read_quilt_file_header(f):
+	''' Returns the header fields followed by the codec '''
+	header = f.read(quilt_file_header.size + quilt_file_codec.size)
+	if len(header) < quilt_file_header.size:
+		raise ValueError("Not a quilt animation file")
+	fields = quilt_file_header.unpack_from(header)
+	if fields[0] != quilt_file_magic or fields[1] > quilt_file_version:
+		raise ValueError("Not a quilt animation file")
+	codec = quilt_file_codec.unpack_from(header, quilt_file_header.size)[0] if fields[1] >= 2 else codec_raw
+	return fields + (codec,)
+
+class QuiltFile:
+	''' Read-only access to the frames of a quilt animation file '''
+
+	def __init__(self, filepath):
+		self.filepath = filepath
+		with open(filepath, 'rb') as f:
+			try:
+				(magic, version, self.width, self.height, self.channels, vx, vy, vtotal, aspect,
+					self.frame_start, self.frame_count, data_offset, self.codec) = read_quilt_file_header(f)
+			except ValueError:
+				raise ValueError("Not a quilt animation file: " + filepath)
+		self.settings = {'vx': vx, 'vy': vy, 'vtotal': vtotal, 'aspect': aspect}
+		self.mtime = os.stat(filepath).st_mtime_ns
+		self.shape = (self.height, self.width, self.channels)
+		if self.codec == codec_raw:
+			self.frames = np.memmap(filepath, dtype=np.uint8, mode='r', offset=data_offset,
+				shape=(self.frame_count,) + self.shape)
+		else:
+			self.index = np.fromfile(filepath, dtype=np.uint64, count=self.frame_count * 2,
+				offset=data_offset).reshape(self.frame_count, 2)
+			# the last two decoded frames: the one shown and the one prefetched
+			self._decoded = {}
+			self._lock = threading.Lock()
+
+	@property
+	def frame_end(self):
+		return self.frame_start + self.frame_count - 1
+
+	def frame(self, frame):
+		''' Returns the quilt of a frame (clamped to the range of the file), raw files without copying it '''
+		index = min(max(frame - self.frame_start, 0), self.frame_count - 1)
+		if self.codec == codec_raw:
+			return self.frames[index]
+		return self._decode(index)
+
+	def _decode(self, index):
+		with self._lock:
+			quilt = self._decoded.get(index)
+		if quilt is not None:
+			return quilt
+		offset, size = (int(value) for value in self.index[index])
+		if size == 0:
+			# not baked, e.g. after a cancelled bake
+			quilt = np.zeros(self.shape, dtype=np.uint8)
+		else:
+			with open(self.filepath, 'rb') as f:
+				f.seek(offset)
+				data = f.read(size)
+			# zlib releases the GIL, prefetching on the sender thread does not block Blender
+			quilt = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(self.shape)
+		with self._lock:
+			if len(self._decoded) >= 2:
+				self._decoded.pop(next(iter(self._decoded)))
+			self._decoded[index] = quilt
+		return quilt
+
+	def prefetch(self, frame):
+		''' Gets a frame ready before it is shown: reads one byte of every page of raw frames into the page cache,
+		decodes compressed ones '''
+		index = min(max(frame - self.frame_start, 0), self.frame_count - 1)
+		if self.codec != codec_raw:
+			return int(self._decode(index)[0, 0, 0])
+		pixels_per_page = max(1, 4096 // self.channels)
+		return int(self.frames[index, :, ::pixels_per_page, 0].sum())
+
+def create_quilt_file(filepath, width, height, channels, settings, frame_start, frame_count, compress=False):
+	''' Creates a quilt animation file with room for frame_count black frames
+
+	Raw files can be written by several processes at once, compressed ones by one writer only.
+	'''
+	header = quilt_file_header.pack(quilt_file_magic, quilt_file_version, width, height, channels,
+		settings['vx'], settings['vy'], settings['vtotal'], settings['aspect'],
+		frame_start, frame_count, quilt_file_data_offset)
+	header += quilt_file_codec.pack(codec_zlib if compress else codec_raw)
+	# a mapping of the old file would point into truncated pages
+	_open_quilt_files.pop(filepath, None)
+	with open(filepath, 'wb') as f:
+		f.write(header)
+		if compress:
+			f.truncate(quilt_file_data_offset + frame_count * quilt_file_index_entry.size)
+		else:
+			f.truncate(quilt_file_data_offset + frame_count * width * height * channels)
+
+def write_quilt_frame(filepath, frame, quilt):
+	''' Writes the quilt of one frame into its slot, for raw files this can be done by several processes at once
+
+	Channels the file does not store, e.g. the alpha of RGBA quilts in an RGB file, are dropped.
+	'''
+	with open(filepath, 'r+b') as f:
+		(magic, version, width, height, channels, vx, vy, vtotal, aspect,
+			frame_start, frame_count, data_offset, codec) = read_quilt_file_header(f)
+		if quilt.ndim == 3 and quilt.shape[2] > channels:
+			quilt = quilt[:, :, :channels]
+		if quilt.shape != (height, width, channels):
+			raise ValueError("Quilt of shape %s does not fit into %dx%dx%d frames" % (quilt.shape, width, height, channels))
+		index = frame - frame_start
+		if index < 0 or index >= frame_count:
+			raise ValueError("Frame %d is not in the range of the quilt file" % frame)
+		if codec == codec_raw:
+			f.seek(data_offset + index * width * height * channels)
+			f.write(np.ascontiguousarray(quilt).data)
+			return
+		data = zlib.compress(np.ascontiguousarray(quilt).data, quilt_file_compression)
+		# frames are appended, a frame written again leaves its old data behind
+		offset = f.seek(0, os.SEEK_END)
+		f.write(data)
+		f.seek(data_offset + index * quilt_file_index_entry.size)
+		f.write(quilt_file_index_entry.pack(offset, len(data)))
+
+# open files are kept mapped, reopening them only when they changed on disk
+_open_quilt_files = {}
+
+def open_quilt_file(filepath):
+	''' Returns a mapped quilt animation file, reusing the mapping of earlier calls '''
+	quilt_file = _open_quilt_files.get(filepath)
+	if quilt_file is None or quilt_file.mtime != os.stat(filepath).st_mtime_ns:
+		quilt_file = _open_quilt_files[filepath] = QuiltFile(filepath)
+	return quilt_file
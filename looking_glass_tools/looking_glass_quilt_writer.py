@@ -0,0 +1,75 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Writes quilt images from a background thread while the next frame renders. Unlike the
+# session recorder no quilt is ever dropped: write() waits for a free buffer when the
+# disk falls behind, an offline render has to end up with every frame. Does not import bpy.
+
+import queue
+import threading
+import time
+import numpy as np
+from . looking_glass_quilt import write_png
+
+class QuiltImageWriter:
+	''' Encodes and writes quilts as PNG with the layout in tEXt chunks, from a writer thread '''
+
+	def __init__(self, max_queued=2, compression=1):
+		self.compression = compression
+		self.frames_written = 0
+		self.bytes_written = 0
+		self.write_time = 0.0
+		self.errors = []
+		self._queue = queue.Queue(maxsize=max_queued)
+		# one buffer more than can be queued, the main thread fills it while the others wait
+		self._spare = queue.Queue()
+		for i in range(max_queued + 1):
+			self._spare.put(None)
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def write(self, filepath, quilt, settings):
+		''' Queues a copy of a height x width x 4 uint8 quilt (rows bottom to top), waits while every buffer is in use '''
+		buffer = self._spare.get()
+		if buffer is None or buffer.shape != quilt.shape:
+			buffer = np.empty(quilt.shape, dtype=np.uint8)
+		np.copyto(buffer, quilt)
+		self._queue.put((filepath, buffer, dict(settings)))
+
+	def _run(self):
+		while True:
+			item = self._queue.get()
+			if item is None:
+				return
+			filepath, quilt, settings = item
+			start_time = time.monotonic()
+			try:
+				write_png(filepath, quilt, settings, self.compression)
+				self.frames_written += 1
+			except Exception as error:
+				# the thread has to live on, write() waits for the buffers it hands back
+				self.errors.append((filepath, error))
+				print("Writing quilt %s failed: %s" % (filepath, error))
+			self.write_time += time.monotonic() - start_time
+			self._spare.put(quilt)
+
+	def close(self):
+		''' Writes the remaining queued quilts, returns the errors of all writes '''
+		self._queue.put(None)
+		self._thread.join()
+		return self.errors
@@ -0,0 +1,196 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Records the quilts shown during a session into a single file and plays them back
+# with their original timing. A recording is a short magic followed by one record per
+# quilt: a fixed size header with the timestamp and the layout, then the raw or zlib
+# compressed uint8 pixels, rows bottom to top. Does not import bpy.
+
+import queue
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+
+recording_magic = b'LKGREC\x00\x01'
+# timestamp, width, height, channels, vx, vy, vtotal, aspect, codec, payload size
+record_header = struct.Struct('<dIIIIIIfIQ')
+codec_raw = 0
+codec_zlib = 1
+
+class QuiltRecorder:
+	''' Appends quilts to a recording from a writer thread
+
+	record() never blocks: quilts are copied into one of a few reused buffers and dropped
+	when the writer falls behind and every buffer is waiting to be written.
+	'''
+
+	def __init__(self, filepath, compress=False, max_queued=4):
+		self.filepath = filepath
+		self.codec = codec_zlib if compress else codec_raw
+		self.frames_recorded = 0
+		self.frames_dropped = 0
+		self.bytes_written = 0
+		# the first write error, e.g. a full disk, recording stops there
+		self.last_error = None
+		self._file = open(filepath, 'wb')
+		self._file.write(recording_magic)
+		self._start = time.monotonic()
+		self._queue = queue.Queue(maxsize=max_queued)
+		self._spare = queue.Queue()
+		self._buffers = 0
+		self._max_buffers = max_queued + 1
+		# memory of all buffers, for the memory governor
+		self.buffer_bytes = 0
+		self._lock = threading.Lock()
+		self._thread = threading.Thread(target=self._run, daemon=True)
+		self._thread.start()
+
+	def accepts(self):
+		''' False while every buffer is waiting to be written, callers can skip reading a quilt back then '''
+		return not self._queue.full()
+
+	def record(self, quilt, settings, timestamp=None):
+		''' Queues a copy of a height x width x channels uint8 quilt, returns False when it was dropped '''
+		if timestamp is None:
+			timestamp = time.monotonic() - self._start
+		if self.last_error is not None:
+			self.frames_dropped += 1
+			return False
+		buffer = self._buffer(quilt.shape)
+		if buffer is None or self._queue.full():
+			if buffer is not None:
+				self._spare.put(buffer)
+			self.frames_dropped += 1
+			return False
+		np.copyto(buffer, quilt)
+		try:
+			self._queue.put_nowait((timestamp, buffer, dict(settings)))
+		except queue.Full:
+			self._spare.put(buffer)
+			self.frames_dropped += 1
+			return False
+		return True
+
+	def _buffer(self, shape):
+		''' A spare buffer of the right shape, a new one as long as the limit allows it, else None '''
+		while True:
+			try:
+				buffer = self._spare.get_nowait()
+			except queue.Empty:
+				break
+			if buffer.shape == tuple(shape):
+				return buffer
+			with self._lock:
+				self._buffers -= 1
+				self.buffer_bytes -= buffer.nbytes
+		with self._lock:
+			if self._buffers >= self._max_buffers:
+				return None
+			self._buffers += 1
+			buffer = np.empty(shape, dtype=np.uint8)
+			self.buffer_bytes += buffer.nbytes
+		return buffer
+
+	def _run(self):
+		while True:
+			item = self._queue.get()
+			if item is None:
+				return
+			timestamp, quilt, settings = item
+			if self.last_error is None:
+				try:
+					self._write(timestamp, quilt, settings)
+				except Exception as error:
+					# keep taking quilts off the queue so neither record() nor close() wait for a dead writer
+					self.last_error = error
+					print("Recording to %s stopped: %s" % (self.filepath, error))
+			else:
+				self.frames_dropped += 1
+			self._spare.put(quilt)
+
+	def _write(self, timestamp, quilt, settings):
+		height, width, channels = quilt.shape
+		if self.codec == codec_zlib:
+			# zlib releases the GIL, level 1 is the fastest
+			payload = zlib.compress(memoryview(quilt).cast('B'), 1)
+		else:
+			payload = memoryview(quilt).cast('B')
+		self._file.write(record_header.pack(timestamp, width, height, channels,
+			settings['vx'], settings['vy'], settings['vtotal'], settings['aspect'], self.codec, len(payload)))
+		self._file.write(payload)
+		self.bytes_written += record_header.size + len(payload)
+		self.frames_recorded += 1
+
+	def close(self):
+		''' Writes the remaining queued quilts and closes the file, returns the write error that stopped the recording or None '''
+		self._queue.put(None)
+		self._thread.join()
+		try:
+			self._file.close()
+		except OSError as error:
+			if self.last_error is None:
+				self.last_error = error
+		return self.last_error
+
+def read_recording(filepath):
+	''' Yields (timestamp, quilt, settings) of every record in a recording '''
+	with open(filepath, 'rb') as f:
+		if f.read(len(recording_magic)) != recording_magic:
+			raise ValueError("Not a quilt recording: " + filepath)
+		while True:
+			header = f.read(record_header.size)
+			if len(header) < record_header.size:
+				return
+			timestamp, width, height, channels, vx, vy, vtotal, aspect, codec, size = record_header.unpack(header)
+			payload = f.read(size)
+			if len(payload) < size:
+				# the recording was cut off while writing this record
+				return
+			if codec == codec_zlib:
+				payload = zlib.decompress(payload)
+			quilt = np.frombuffer(payload, dtype=np.uint8).reshape(height, width, channels)
+			yield timestamp, quilt, {'vx': vx, 'vy': vy, 'vtotal': vtotal, 'aspect': aspect}
+
+def replay_recording(filepath, send, speed=1.0, stop_event=None):
+	''' Calls send(quilt, settings) for every record at the pacing it was recorded with '''
+	try:
+		return _replay_recording(filepath, send, speed, stop_event)
+	except Exception as error:
+		# runs on a thread of its own, nobody else would see the error
+		print("Replaying %s stopped: %s" % (filepath, error))
+		return 0
+
+def _replay_recording(filepath, send, speed, stop_event):
+	start = None
+	first_timestamp = 0.0
+	sent = 0
+	for timestamp, quilt, settings in read_recording(filepath):
+		if start is None:
+			start = time.monotonic()
+			first_timestamp = timestamp
+		delay = start + (timestamp - first_timestamp) / speed - time.monotonic()
+		if stop_event is not None:
+			if stop_event.wait(max(0.0, delay)):
+				break
+		elif delay > 0.0:
+			time.sleep(delay)
+		send(quilt, settings)
+		sent += 1
+	return sent
@@ -0,0 +1,336 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+''' Splits multiview renders of the Looking Glass render setup into (frame, views) work units
+and renders them with separate Blender processes, locally or on other machines.
+
+Usage:
+	python looking_glass_render_farm.py scene.blend --frames 1-250 --output /shared/render/ --workers 8
+	python looking_glass_render_farm.py scene.blend --frames 1-250 --output /shared/render/ --node "ssh node1" --node "ssh node2"
+
+Nodes are command prefixes that run the Blender command on another machine, the .blend file,
+this script and the output directory have to be reachable under the same paths on every node.
+When all views of a frame are done they are merged into a quilt.
+'''
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import shlex
+import subprocess
+import sys
+import threading
+import timeit
+
+try:
+	from . looking_glass_batch_quilt import convert_frame, build_tasks
+	from . looking_glass_quilt import quilt_settings
+	from . looking_glass_sequence import parse_frame_range, scan_multiview_sequence, is_valid_image_file
+except ImportError:
+	# executed as a script by blender -P or python
+	from looking_glass_batch_quilt import convert_frame, build_tasks
+	from looking_glass_quilt import quilt_settings
+	from looking_glass_sequence import parse_frame_range, parse_multiview_filename, scan_multiview_sequence, is_valid_image_file
+
+log = logging.getLogger('looking_glass_render_farm')
+
+# ------------- Worker side, runs inside blender -b ----------------
+
+def rig_views(scene):
+	''' Returns (view index, view name) of the render views created by the render setup '''
+	views = []
+	for view in scene.render.views:
+		if view.name.startswith('view.'):
+			views.append((int(view.name.rsplit('.', 1)[1]), view.name))
+	return sorted(views)
+
+def list_rig(output_file, output=None, frames=()):
+	''' Writes the views and the quilt layout of the render setup of the open .blend file as JSON
+
+	With an output path the file names Blender writes the views of the frames to are listed too,
+	so the job splitter does not have to know about # padding and view suffixes.
+	'''
+	import bpy
+	scene = bpy.context.scene
+	multiview = bpy.data.objects.get("Multiview")
+	if multiview is None or 'LKGCameraCollection' not in bpy.data.collections:
+		raise RuntimeError("The scene does not contain a Looking Glass render setup")
+	rig = {
+		'views': [view for view, name in rig_views(scene)],
+		'vx': multiview.get('vx', 5),
+		'vy': multiview.get('vy', 9),
+		'aspect': multiview.get('aspect', 0.75),
+		'extension': scene.render.file_extension,
+	}
+	if output is not None:
+		render = scene.render
+		render.filepath = output
+		# JSON only has string keys
+		rig['paths'] = {str(frame): {str(view): render.frame_path(frame=frame, view=name) for view, name in rig_views(scene)}
+			for frame in frames}
+	with open(output_file, 'w') as f:
+		json.dump(rig, f)
+
+def render_unit(frame, views, output):
+	''' Renders one frame with only the given views enabled '''
+	import bpy
+	scene = bpy.context.scene
+	render = scene.render
+	wanted = set(views)
+	for view, name in rig_views(scene):
+		render.views[name].use = view in wanted
+	# quilts are merged by the job splitter once all units of a frame are done
+	if hasattr(scene, 'LKG_render_quilt'):
+		scene.LKG_render_quilt = False
+	render.filepath = output
+	scene.frame_set(frame)
+	bpy.ops.render.render(write_still=True)
+
+	missing = [name for view, name in rig_views(scene)
+		if view in wanted and not os.path.isfile(render.frame_path(frame=frame, view=name))]
+	if missing:
+		raise RuntimeError("Views were not written: " + ", ".join(missing))
+
+def worker_main(argv):
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--list", default=None)
+	parser.add_argument("--frame", type=int, default=None)
+	parser.add_argument("--views", default="")
+	parser.add_argument("--output", default=None)
+	parser.add_argument("--frames", default="")
+	args = parser.parse_args(argv)
+	if args.list:
+		list_rig(args.list, args.output, parse_frame_range(args.frames))
+	else:
+		render_unit(args.frame, [int(view) for view in args.views.split(',')], args.output)
+	return 0
+
+# ------------- Job splitter and scheduler ----------------
+
+class WorkUnit:
+	''' A frame and the subset of its views one worker renders '''
+	def __init__(self, frame, views):
+		self.frame = frame
+		self.views = views
+		self.attempts = 0
+
+	def __repr__(self):
+		return "frame %d views %d-%d" % (self.frame, self.views[0], self.views[-1])
+
+def split_work(frames, views, views_per_unit, skip_view=None):
+	''' Breaks a frame range into (frame, view subset) work units, skipping views for which skip_view(frame, view) is True '''
+	units = []
+	for frame in frames:
+		frame_views = [view for view in views if skip_view is None or not skip_view(frame, view)]
+		for i in range(0, len(frame_views), views_per_unit):
+			units.append(WorkUnit(frame, frame_views[i:i + views_per_unit]))
+	return units
+
+class Scheduler:
+	''' Hands work units to free worker slots as they become available and retries failed units '''
+
+	def __init__(self, blender, blendfile, output, slots, retries):
+		self.blender = blender
+		self.blendfile = blendfile
+		self.output = output
+		self.slots = slots
+		self.retries = retries
+		self.units = queue.Queue()
+		self.lock = threading.Lock()
+		self.views_done = {}
+		self.views_per_frame = {}
+		self.failed = []
+		self.on_frame_done = None
+		self.pending = 0
+
+	def command(self, prefix, unit):
+		''' The Blender command line for one work unit, prefixed with the command of the node '''
+		cmd = [self.blender, "-b", self.blendfile, "--python-exit-code", "1", "-P", os.path.abspath(__file__), "--",
+			"--worker", "--frame", str(unit.frame), "--views", ",".join(str(v) for v in unit.views),
+			"--output", self.output]
+		return shlex.split(prefix) + cmd if prefix else cmd
+
+	def run_slot(self, prefix):
+		''' Worker slot thread: keeps pulling units until the queue is drained '''
+		while True:
+			unit = self.units.get()
+			if unit is None:
+				return
+			unit.attempts += 1
+			start_time = timeit.default_timer()
+			result = subprocess.run(self.command(prefix, unit), stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+			with self.lock:
+				if result.returncode == 0:
+					log.info("%s done on %s in %.1fs", unit, prefix or "localhost", timeit.default_timer() - start_time)
+					done = self.views_done.setdefault(unit.frame, set())
+					done.update(unit.views)
+					frame_done = len(done) == self.views_per_frame[unit.frame]
+				else:
+					frame_done = False
+					output = result.stdout.decode(errors='replace').strip().splitlines()[-5:]
+					log.warning("%s failed on %s (attempt %d):\n%s", unit, prefix or "localhost", unit.attempts, "\n".join(output))
+					if unit.attempts <= self.retries:
+						self.units.put(unit)
+						continue
+					self.failed.append(unit)
+				self.pending -= 1
+				if self.pending == 0:
+					# wake up every slot so they can exit
+					for i in range(len(self.slots)):
+						self.units.put(None)
+			if frame_done and self.on_frame_done is not None:
+				self.on_frame_done(unit.frame)
+
+	def run(self, units):
+		self.pending = len(units)
+		for unit in units:
+			self.views_per_frame[unit.frame] = self.views_per_frame.get(unit.frame, 0) + len(unit.views)
+			self.units.put(unit)
+		threads = [threading.Thread(target=self.run_slot, args=(prefix,), daemon=True) for prefix in self.slots]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		return not self.failed
+
+def query_rig(blender, blendfile, output, frames):
+	''' Asks Blender for the views, the quilt layout and the view file names of the render setup in the .blend file '''
+	import tempfile
+	with tempfile.TemporaryDirectory() as directory:
+		rig_file = os.path.join(directory, "rig.json")
+		subprocess.run([blender, "-b", blendfile, "--python-exit-code", "1", "-P", os.path.abspath(__file__), "--", "--worker", "--list", rig_file,
+			"--output", output, "--frames", frames], stdout=subprocess.DEVNULL, check=True)
+		with open(rig_file) as f:
+			return json.load(f)
+
+def parse_args(argv):
+	parser = argparse.ArgumentParser(description="Render Looking Glass multiview setups split into view subsets across worker processes.")
+	parser.add_argument("blendfile", help=".blend file containing the render setup")
+	parser.add_argument("--frames", required=True, help="frame range, e.g. 1-250 or 1-10,20")
+	parser.add_argument("--output", required=True, help="output path prefix, e.g. /shared/render/shot_")
+	parser.add_argument("--blender", default="blender", help="Blender executable")
+	parser.add_argument("--workers", type=int, default=max(1, multiprocessing.cpu_count() // 8), help="local worker processes")
+	parser.add_argument("--node", action="append", default=[], help="command prefix of a remote worker slot, can be repeated")
+	parser.add_argument("--views-per-unit", type=int, default=9, help="views rendered by one worker process")
+	parser.add_argument("--retries", type=int, default=2, help="how often a failed work unit is retried")
+	parser.add_argument("--resume", action="store_true", help="only render views that are missing or corrupt in the output")
+	parser.add_argument("--no-quilt", action="store_true", help="do not merge the views into quilts")
+	return parser.parse_args(argv)
+
+def main(argv=None):
+	if argv is None:
+		argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+	if '--worker' in argv:
+		argv.remove('--worker')
+		return worker_main(argv)
+
+	args = parse_args(argv)
+	logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+	blendfile = os.path.abspath(args.blendfile)
+	output = os.path.abspath(args.output) + (os.sep if args.output.endswith(('/', os.sep)) else '')
+	os.makedirs(os.path.dirname(output), exist_ok=True)
+
+	rig = query_rig(args.blender, blendfile, output, args.frames)
+	frames = parse_frame_range(args.frames)
+	# the file names Blender writes the views to, including # padding and the view suffixes of the rig
+	view_path = lambda frame, view: rig['paths'][str(frame)][str(view)]
+	skip_view = None
+	if args.resume:
+		skip_view = lambda frame, view: is_valid_image_file(view_path(frame, view))
+	units = split_work(frames, rig['views'], max(1, args.views_per_unit), skip_view)
+	slots = [None] * args.workers + args.node
+
+	scheduler = Scheduler(args.blender, blendfile, output, slots, args.retries)
+	merger = None
+	merge_failures = []
+	complete_frames = []
+	if not args.no_quilt:
+		settings = quilt_settings(rig['vx'], rig['vy'], rig['aspect'], len(rig['views']))
+		extension = rig['extension'].lstrip('.')
+		directory = os.path.dirname(view_path(frames[0], rig['views'][0]))
+		prefix = None
+		parsed = parse_multiview_filename(os.path.basename(view_path(frames[0], rig['views'][0])))
+		if parsed is not None:
+			prefix = parsed[0]
+		if args.resume:
+			# frames that have all views on disk get no work units, their quilts are merged right away
+			rendered = set(unit.frame for unit in units)
+			frames_on_disk = scan_multiview_sequence(directory, prefix, extension)
+			for frame in frames:
+				if frame in rendered:
+					continue
+				tasks = build_tasks(frames_on_disk, [frame], directory, prefix or '', extension, settings)
+				if not tasks or not is_valid_image_file(tasks[0][2]):
+					complete_frames.append(frame)
+	if not units and not complete_frames:
+		log.info("All views are on disk already")
+		return 0
+
+	if not args.no_quilt:
+		merger = multiprocessing.get_context('spawn').Pool(max(1, multiprocessing.cpu_count() // 4))
+
+		def merge_failed(frame, error):
+			# runs on the result thread of the pool or on a worker slot thread
+			log.error("Merging the quilt of frame %s failed: %s", frame, error)
+			merge_failures.append(frame)
+
+		def merge_frame(frame):
+			# an exception here would end the worker slot thread and leave its units unrendered
+			try:
+				frames_on_disk = scan_multiview_sequence(directory, prefix, extension)
+				tasks = build_tasks(frames_on_disk, [frame], directory, prefix or '', extension, settings)
+				if not tasks:
+					merge_failed(frame, "the views are not on disk")
+				for task in tasks:
+					merger.apply_async(convert_frame, (task,),
+						callback=lambda result: log.info("Quilt of frame %s written to %s", result[0], result[1]),
+						error_callback=lambda error, frame=frame: merge_failed(frame, error))
+			except Exception as error:
+				merge_failed(frame, error)
+		scheduler.on_frame_done = merge_frame
+
+	start_time = timeit.default_timer()
+	if complete_frames:
+		log.info("Merging the quilts of %d frames that were rendered already", len(complete_frames))
+		for frame in complete_frames:
+			merge_frame(frame)
+	success = True
+	if units:
+		log.info("Rendering %d frames as %d work units on %d worker slots", len(frames), len(units), len(slots))
+		success = scheduler.run(units)
+	if merger is not None:
+		merger.close()
+		merger.join()
+	elapsed = timeit.default_timer() - start_time
+	log.info("Rendered %d frames in %.1fs (%.2f frames/min)", len(frames), elapsed, len(frames) * 60.0 / elapsed)
+	if not success:
+		log.error("%d work units failed: %s", len(scheduler.failed), scheduler.failed)
+	if merge_failures:
+		log.error("%d quilts could not be merged: frames %s", len(merge_failures), sorted(merge_failures))
+	if not success or merge_failures:
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	# import ourselves as a regular module so the process pool can find the merge functions
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+	import looking_glass_render_farm
+	sys.exit(looking_glass_render_farm.main())
@@ -0,0 +1,397 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+''' Keeps a .blend file with a Looking Glass render setup loaded in a background Blender
+and renders quilts on request, so scripts do not pay for starting Blender every time.
+
+Usage:
+	blender -b scene.blend -P looking_glass_render_server.py -- --socket /tmp/lkg_render.sock
+	blender -b scene.blend -P looking_glass_render_server.py -- --port 7611
+
+Client:
+	client = QuiltRenderClient('/tmp/lkg_render.sock')
+	quilt, settings = client.render(frame=12, camera={'location': (0, 0, 1)})
+
+Every message is a 4 byte little endian length followed by a JSON object. Quilts are either
+sent as raw bytes right after the JSON answer or written into a file that both sides map into
+memory (pass `shm`, a plain file name the server places in /dev/shm). Quilts are uint8 RGBA,
+rows bottom to top. The unix socket is only accessible to the user running the server.
+'''
+
+import argparse
+import json
+import logging
+import math
+import os
+import socket
+import struct
+import sys
+import tempfile
+import timeit
+import numpy as np
+
+try:
+	from . looking_glass_quilt import QuiltAssembler, quilt_settings, staging_array
+except ImportError:
+	# executed as a script by blender -P or imported by a client script
+	from looking_glass_quilt import QuiltAssembler, quilt_settings, staging_array
+
+log = logging.getLogger('looking_glass_render_server')
+
+message_length = struct.Struct('<I')
+
+# attributes of the render setup object a request may override
+camera_override_keys = ('location', 'rotation_euler', 'rotation_quaternion', 'scale')
+# shared quilt files are only created under this prefix, clients name them but cannot point anywhere else
+shared_quilt_prefix = 'lkg_render_'
+
+# the quilt is allocated for every tile of the layout, clients must not be able to ask for arbitrary sizes
+max_quilt_tiles = 256
+
+# ------------- Framing, shared by server and client ----------------
+
+def recv_exact(sock, size, into=None):
+	''' Reads exactly size bytes, into a writable buffer when given so large payloads are not copied '''
+	buffer = bytearray(size) if into is None else into
+	view = memoryview(buffer).cast('B')
+	received = 0
+	while received < size:
+		count = sock.recv_into(view[received:size])
+		if count == 0:
+			raise ConnectionError("Connection closed")
+		received += count
+	return buffer
+
+def send_json(sock, message):
+	data = json.dumps(message).encode('utf-8')
+	sock.sendall(message_length.pack(len(data)) + data)
+
+def recv_json(sock):
+	size = message_length.unpack(recv_exact(sock, message_length.size))[0]
+	return json.loads(recv_exact(sock, size).decode('utf-8'))
+
+def open_shared_quilt(filepath, shape, create=False):
+	''' Maps a file holding one uint8 quilt, the server creates or resizes it, the client only maps it '''
+	size = int(np.prod(shape))
+	if create and (not os.path.isfile(filepath) or os.path.getsize(filepath) != size):
+		# readable by the user running the server only
+		fd = os.open(filepath, os.O_RDWR | os.O_CREAT, 0o600)
+		try:
+			os.ftruncate(fd, size)
+		finally:
+			os.close(fd)
+	return np.memmap(filepath, dtype=np.uint8, mode='r+' if create else 'r', shape=tuple(shape))
+
+def shared_quilt_path(name, directory):
+	''' Path of the shared quilt a client named, in /dev/shm when it exists or else in directory '''
+	if not isinstance(name, str) or not name or name in ('.', '..') or '/' in name or '\\' in name:
+		raise ValueError("shm must be a plain file name, not %r" % (name,))
+	if os.path.isdir('/dev/shm'):
+		directory = '/dev/shm'
+	return os.path.join(directory, shared_quilt_prefix + name)
+
+def default_address():
+	''' A socket file in the temporary directory where unix sockets exist, else a local port '''
+	if hasattr(socket, 'AF_UNIX'):
+		return os.path.join(tempfile.gettempdir(), 'lkg_render.sock')
+	return ('127.0.0.1', 7611)
+
+# ------------- Client ----------------
+
+class QuiltRenderClient:
+	''' Connection to a running render server, does not need Blender '''
+
+	def __init__(self, address=None):
+		if address is None:
+			address = default_address()
+		if isinstance(address, str):
+			self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		else:
+			self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.sock.connect(address)
+		self._shared = {}
+
+	def request(self, message):
+		send_json(self.sock, message)
+		answer = recv_json(self.sock)
+		if answer.get('status') != 'ok':
+			raise RuntimeError(answer.get('error', "Render server error"))
+		return answer
+
+	def render(self, frame=None, scene=None, camera=None, layout=None, shm=None, out=None):
+		''' Renders a quilt and returns (quilt, settings)
+
+		camera overrides the location, rotation_euler, rotation_quaternion or scale of the render setup
+		object, e.g. {'location': (0, 0, 1)}. layout may contain vx, vy, aspect, view_width and view_height.
+		With shm, a plain file name, the quilt is a read-only mapping of a file the server creates for it
+		which stays valid until the next render into it.
+		'''
+		message = {'command': 'render', 'frame': frame, 'scene': scene, 'camera': camera or {},
+			'layout': layout or {}, 'shm': shm}
+		answer = self.request(message)
+		shape = tuple(answer['shape'])
+		if shm is not None:
+			# the server decides where the file lives
+			shm = answer['shm']
+			quilt = self._shared.get(shm)
+			if quilt is None or quilt.shape != shape:
+				quilt = self._shared[shm] = open_shared_quilt(shm, shape)
+		else:
+			if out is None or out.shape != shape:
+				out = np.empty(shape, dtype=np.uint8)
+			quilt = recv_exact(self.sock, out.nbytes, out)
+		return quilt, answer['settings']
+
+	def ping(self):
+		return self.request({'command': 'ping'})
+
+	def shutdown(self):
+		self.request({'command': 'shutdown'})
+		self.close()
+
+	def close(self):
+		self.sock.close()
+
+# ------------- Server side, runs inside blender -b ----------------
+
+class QuiltRenderServer:
+	''' Renders the views of the render setup into a private directory and assembles them into quilts '''
+
+	def __init__(self):
+		import bpy
+		self.bpy = bpy
+		self.directory = tempfile.mkdtemp(prefix='lkg_render_server_')
+		self._shared = {}
+		self._assembler = None
+
+	def rig_views(self, scene):
+		views = []
+		for view in scene.render.views:
+			if view.name.startswith('view.'):
+				views.append((int(view.name.rsplit('.', 1)[1]), view.name))
+		return sorted(views)
+
+	@staticmethod
+	def override(restore, owner, key, value):
+		''' Sets an attribute and remembers its old value in restore '''
+		old_value = getattr(owner, key)
+		# vectors and colors are views into the object, keep a copy of their values
+		restore.append((owner, key, tuple(old_value) if hasattr(old_value, '__len__') and not isinstance(old_value, str) else old_value))
+		setattr(owner, key, value)
+
+	def prepare_scene(self, scene, restore):
+		''' Settings that keep the renderer warm between requests and make reading views back cheap, undone after the request '''
+		render = scene.render
+		image_settings = render.image_settings
+		# Cycles keeps the scene, BVH and textures between renders when nothing changed
+		self.override(restore, render, 'use_persistent_data', True)
+		self.override(restore, image_settings, 'file_format', 'PNG')
+		self.override(restore, image_settings, 'color_mode', 'RGBA')
+		self.override(restore, image_settings, 'color_depth', '8')
+		self.override(restore, image_settings, 'compression', 0)
+		self.override(restore, render, 'filepath', os.path.join(self.directory, scene.name + '_'))
+		if hasattr(scene, 'LKG_render_quilt'):
+			self.override(restore, scene, 'LKG_render_quilt', False)
+
+	def apply_overrides(self, scene, camera, layout, restore):
+		''' Applies the overrides of a request, their old values are added to restore '''
+		bpy = self.bpy
+		unknown = [key for key in camera if key != 'object' and key not in camera_override_keys]
+		if unknown:
+			raise ValueError("Cannot override %s, only %s" % (", ".join(unknown), ", ".join(camera_override_keys)))
+		name = camera.get('object', 'Multiview')
+		if not isinstance(name, str) or not name.startswith('Multiview'):
+			raise ValueError("Only the Multiview object of the render setup can be overridden")
+		rig = bpy.data.objects.get(name)
+		for key in camera_override_keys:
+			if key not in camera:
+				continue
+			if rig is None:
+				raise ValueError("The scene does not contain a Looking Glass render setup")
+			self.override(restore, rig, key, camera[key])
+		render = scene.render
+		for key, attribute in (('view_width', 'resolution_x'), ('view_height', 'resolution_y')):
+			if key in layout:
+				size = layout[key]
+				if not isinstance(size, int) or not 4 <= size <= 16384:
+					raise ValueError("%s must be a number of pixels, not %r" % (key, size))
+				self.override(restore, render, attribute, size)
+
+	def layout(self, scene, layout, num_views):
+		multiview = self.bpy.data.objects.get("Multiview")
+		defaults = {}
+		if multiview is not None and 'vx' in multiview:
+			defaults = {'vx': multiview['vx'], 'vy': multiview['vy'], 'aspect': multiview['aspect']}
+		vx = layout.get('vx', defaults.get('vx', 5))
+		vy = layout.get('vy', defaults.get('vy', 9))
+		aspect = layout.get('aspect', defaults.get('aspect', 0.75))
+		for key, tiles in (('vx', vx), ('vy', vy)):
+			if isinstance(tiles, bool) or not isinstance(tiles, int) or not 1 <= tiles <= max_quilt_tiles:
+				raise ValueError("%s must be a number of views, not %r" % (key, tiles))
+		if vx * vy > max_quilt_tiles:
+			raise ValueError("Quilts have at most %d views, not %d x %d" % (max_quilt_tiles, vx, vy))
+		if isinstance(aspect, bool) or not isinstance(aspect, (int, float)) or not math.isfinite(aspect) or not 0.1 <= aspect <= 10:
+			raise ValueError("aspect must be a ratio between 0.1 and 10, not %r" % (aspect,))
+		return quilt_settings(vx, vy, aspect, min(vx * vy, num_views))
+
+	def load_view(self, filepath):
+		''' Reads a rendered view into a reused float staging array '''
+		img = self.bpy.data.images.load(filepath, check_existing=False)
+		try:
+			width, height = img.size
+			pixels = staging_array("render_server_view", (height, width, 4), np.float32)
+			img.pixels.foreach_get(pixels.reshape(-1))
+		finally:
+			self.bpy.data.images.remove(img)
+		return pixels
+
+	def render(self, message):
+		bpy = self.bpy
+		scene = bpy.data.scenes[message['scene']] if message.get('scene') else bpy.context.scene
+		rig_views = self.rig_views(scene)
+		if not scene.render.use_multiview or not rig_views:
+			raise ValueError("The scene does not contain a Looking Glass render setup")
+		layout = message.get('layout') or {}
+		restore = []
+		try:
+			self.prepare_scene(scene, restore)
+			self.apply_overrides(scene, message.get('camera') or {}, layout, restore)
+			settings = self.layout(scene, layout, len(rig_views))
+			wanted = set(view for view, name in rig_views[:settings['vtotal']])
+			for view, name in rig_views:
+				self.override(restore, scene.render.views[name], 'use', view in wanted)
+			frame = message.get('frame')
+			if frame is not None:
+				scene.frame_set(frame)
+			frame = scene.frame_current
+			start_time = timeit.default_timer()
+			bpy.ops.render.render(write_still=True, scene=scene.name)
+			render_time = timeit.default_timer() - start_time
+
+			render = scene.render
+			view_width = int(render.resolution_x * render.resolution_percentage / 100)
+			view_height = int(render.resolution_y * render.resolution_percentage / 100)
+			assembler = self._assembler
+			if (assembler is None or assembler.view_width != view_width or assembler.view_height != view_height
+				or assembler.columns != settings['vx'] or assembler.rows != settings['vy']):
+				assembler = self._assembler = QuiltAssembler(settings['vx'], settings['vy'], view_width, view_height, 4, settings['vtotal'])
+			assembler.reset()
+			assembler.num_views = settings['vtotal']
+			for view, name in rig_views[:settings['vtotal']]:
+				filepath = render.frame_path(frame=frame, view=name)
+				assembler.add_view(view, self.load_view(filepath))
+				os.remove(filepath)
+		finally:
+			for owner, key, value in reversed(restore):
+				setattr(owner, key, value)
+		log.info("Rendered frame %d of %s in %.3fs, assembling took %.3fs", frame, scene.name, render_time,
+			timeit.default_timer() - start_time - render_time)
+		return assembler.quilt, settings
+
+	def handle(self, conn, message):
+		''' Answers one request, returns False when the server should stop '''
+		command = message.get('command')
+		if command == 'ping':
+			send_json(conn, {'status': 'ok', 'blendfile': self.bpy.data.filepath})
+		elif command == 'shutdown':
+			send_json(conn, {'status': 'ok'})
+			return False
+		elif command == 'render':
+			shm = message.get('shm')
+			if shm:
+				# checked before rendering, a rejected name should not cost a render
+				shm = shared_quilt_path(shm, self.directory)
+			quilt, settings = self.render(message)
+			answer = {'status': 'ok', 'shape': quilt.shape, 'settings': settings}
+			if shm:
+				answer['shm'] = shm
+				shared = self._shared.get(shm)
+				if shared is None or shared.shape != quilt.shape:
+					shared = self._shared[shm] = open_shared_quilt(shm, quilt.shape, create=True)
+				np.copyto(shared, quilt)
+				send_json(conn, answer)
+			else:
+				send_json(conn, answer)
+				conn.sendall(memoryview(np.ascontiguousarray(quilt)).cast('B'))
+		else:
+			send_json(conn, {'status': 'error', 'error': "Unknown command %r" % command})
+		return True
+
+	def serve(self, address):
+		if isinstance(address, str):
+			if os.path.exists(address):
+				os.remove(address)
+			listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		else:
+			listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+			listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		if isinstance(address, str):
+			# no moment in which other users could connect, the socket renders and writes files as this user
+			old_umask = os.umask(0o177)
+			try:
+				listener.bind(address)
+			finally:
+				os.umask(old_umask)
+			os.chmod(address, 0o600)
+		else:
+			listener.bind(address)
+		listener.listen(4)
+		log.info("Serving quilts of %s on %s", self.bpy.data.filepath, address)
+		# bpy is not thread safe, requests are answered one after another on the main thread
+		running = True
+		try:
+			while running:
+				conn, peer = listener.accept()
+				with conn:
+					while running:
+						try:
+							message = recv_json(conn)
+						except (ConnectionError, ValueError):
+							break
+						try:
+							running = self.handle(conn, message)
+						except OSError:
+							# the client went away in the middle of an answer
+							break
+						except Exception as error:
+							log.exception("Request failed")
+							send_json(conn, {'status': 'error', 'error': str(error)})
+		finally:
+			listener.close()
+			if isinstance(address, str) and os.path.exists(address):
+				os.remove(address)
+
+def main(argv=None):
+	if argv is None:
+		argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+	parser = argparse.ArgumentParser(description="Render Looking Glass quilts on request from a background Blender.")
+	parser.add_argument("--socket", default=None, help="path of the unix socket to listen on")
+	parser.add_argument("--port", type=int, default=None, help="local TCP port to listen on instead of a unix socket")
+	args = parser.parse_args(argv)
+	logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+	if args.port is not None:
+		address = ('127.0.0.1', args.port)
+	else:
+		address = args.socket or default_address()
+	QuiltRenderServer().serve(address)
+	return 0
+
+if __name__ == "__main__":
+	sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+	sys.exit(main())
@@ -22,6 +22,9 @@ import bmesh
 import subprocess
 import logging
 import ctypes
+import os
+import timeit
+import numpy as np
 from bgl import *
 from math import *
 from mathutils import *
@@ -29,6 +32,196 @@ from bpy.types import AddonPreferences, PropertyGroup
 from bpy.props import FloatProperty, PointerProperty
 from bpy.app.handlers import persistent
 from . import looking_glass_settings
+from . looking_glass_quilt import QuiltAssembler, quilt_settings, quilt_filepath, uint8_to_float, float_to_uint8
+from . looking_glass_color import scene_color_transform
+from . looking_glass_sequence import is_valid_image_file
+
+# the fov of the Blender camera is relative to the broader side
+# at an aspect ratio of 16:10 a fov of 14° translates to ~22.23 degrees
+rig_fov = 22.23
+
+log = logging.getLogger('bpy.ops.lookingglass.render_setup')
+log.setLevel('DEBUG')
+
+def set_parent_trans(child, parent):
+	''' Create a child-parent hierarchy similar to the operator '''
+	child.parent = parent
+	child.matrix_parent_inverse = parent.matrix_world.inverted()
+
+def calculate_camera_distance_z(multiview, fov):
+	return multiview.scale[0] / tan(0.5 * radians(fov))
+
+def make_multiview(scene, layout, fov):
+	''' Create a parent object for the multiview cameras that also indicates the view space of the LKG '''
+	log.info("Making Multiview")
+
+	# cube of dimensions 1-1-1, front and back stored separately
+	verts_front = [(-1.0,1.0,1.0),(1.0,1.0,1.0),(1.0,-1.0,1.0),(-1.0,-1.0,1.0)]
+	verts_back = [(-1.0,1.0,-1.0),(1.0,1.0,-1.0),(1.0,-1.0,-1.0),(-1.0,-1.0,-1.0)]
+
+	# Create mesh
+	me = bpy.data.meshes.new('Multiview')
+
+	# Create object
+	multiview = bpy.data.objects.new("Multiview", me)
+	multiview.show_name = True
+	scene.collection.objects.link(multiview)
+
+	# Get a BMesh representation
+	bm = bmesh.new()   # create an empty BMesh
+
+	bm_verts_front = []
+	bm_verts_back = []
+
+	for v in verts_front:
+		bm_verts_front.append(bm.verts.new(v))
+	for v in verts_back:
+		bm_verts_back.append(bm.verts.new(v))
+
+	for i, v in enumerate(bm_verts_front):
+		j = (i+1)%len(bm_verts_front)
+		bm.edges.new( (bm_verts_front[i], bm_verts_front[j]) )
+
+	for i, v in enumerate(bm_verts_back):
+		j = (i+1)%len(bm_verts_back)
+		bm.edges.new( (bm_verts_back[i], bm_verts_back[j]) )
+		# hacky, saves one extra loop
+		bm.edges.new( (bm_verts_front[i], bm_verts_back[i]) )
+
+	dist = calculate_camera_distance_z(multiview, fov)
+	# hardcoded - refactor!
+	# the result includes a margin around the Multiview container object
+	dist_front = dist - 1.5
+	dist_back = dist + 0.0
+
+	scale_factor_front = tan(fov) * dist_front
+	scale_factor_back = tan(fov) * dist_back
+
+	bmesh.ops.scale(bm, vec=(scale_factor_front, scale_factor_front, 1.0), space=multiview.matrix_local, verts=bm_verts_front)
+	bmesh.ops.scale(bm, vec=(scale_factor_back, scale_factor_back, 1.0), space=multiview.matrix_local, verts=bm_verts_back)
+
+	# the aspect ratio should match the one of the LKG device
+	aspect = layout['aspect']
+	bmesh.ops.scale(bm, vec=(1.0, 1/aspect, 1.0), space=multiview.matrix_local, verts=bm_verts_front)
+	bmesh.ops.scale(bm, vec=(1.0, 1/aspect, 1.0), space=multiview.matrix_local, verts=bm_verts_back)
+
+	# Finish up, write the bmesh back to the mesh
+	bm.to_mesh(me)
+	bm.free()
+
+	# remember the quilt layout of the setup so it is known in background renders as well
+	multiview['vx'] = layout['vx']
+	multiview['vy'] = layout['vy']
+	multiview['aspect'] = aspect
+	return multiview
+
+def add_clip_driver(camera_data, data_path, multiview, expression):
+	''' Keeps a clipping distance of the camera in the bounds of the Multiview object when it gets scaled '''
+	driver = camera_data.driver_add(data_path).driver
+	var = driver.variables.new()
+	var.name = 'z_scale'
+	var.targets[0].id = multiview
+	var.targets[0].data_path = 'scale.z'
+	driver.expression = expression
+
+def make_camera(scene, collection, multiview, i, num_views, view_cone, fov):
+	''' Create Camera and the render view that renders through it '''
+	suffix = '.' + str(i).zfill(2)
+	cam = bpy.data.objects.new('cam' + suffix, bpy.data.cameras.new('cam' + suffix))
+	collection.objects.link(cam)
+	cam.data.lens_unit = 'FOV'
+	cam.data.angle = radians(fov)
+
+	#* parent it to current multi view
+	set_parent_trans(cam, multiview)
+
+	# cam distance
+	camLocZ = calculate_camera_distance_z(multiview, fov)
+	cam.location[2] = camLocZ
+
+	# cam x pos
+	angleStr = radians(-view_cone * 0.5 + view_cone * (i / max(1, num_views - 1)))
+	camLocX = cam.location[2] * tan(angleStr) / multiview.scale[0]
+	cam.location[0] = camLocX
+
+	# shift x
+	cam.data.shift_x = (-0.5) * cam.location.x
+
+	# clipping relative to the MultiView object bounds
+	# clip delta is to get rid of most of the Multiview object in the LKG
+	clip_delta = 0.01
+	cam.data.clip_start = camLocZ - 1.0 + clip_delta
+	cam.data.clip_end = camLocZ + 1.0 - clip_delta
+	add_clip_driver(cam.data, 'clip_start', multiview,
+		'z_scale / tan(0.5 * radians(' + str(fov) + ')) - z_scale + ' + str(clip_delta) + '*z_scale')
+	add_clip_driver(cam.data, 'clip_end', multiview,
+		'z_scale / tan(0.5 * radians(' + str(fov) + ')) + z_scale - ' + str(clip_delta) + '*z_scale')
+
+	#* set up view
+	view = scene.render.views.new('view' + suffix)
+	view.camera_suffix = suffix
+
+	# the cameras will be invisible in the viewport but for debugging it is nice to see the limits directly when turning one on
+	cam.data.show_limits = True
+
+	# cam should be invisible in the viewport because otherwise a line will appear in the LKG
+	# for 2.8 we need to use hide_set(True) because hide_viewport will globally disable it in viewports, temporarily breaking the child-parent-relationship
+	for view_layer in scene.view_layers:
+		cam.hide_set(True, view_layer=view_layer)
+
+	return cam
+
+def setup_multiview(scene):
+	log.info("Setting up Multiview")
+	render = scene.render
+	render.use_multiview = True
+	if "left" in render.views:
+		render.views["left"].use = False
+	if "right" in render.views:
+		render.views["right"].use = False
+	render.views_format = 'MULTIVIEW'
+
+def set_render_settings(scene, layout):
+	''' Set render size depending on LKG configuration. This overwrites previous settings! '''
+	render = scene.render
+
+	if layout['vx'] == 5 and layout['vy'] == 9:
+		render.resolution_x = 819
+		render.resolution_y = 455
+	elif layout['vx'] == 8 and layout['vy'] == 6:
+		render.resolution_x = 420
+		render.resolution_y = 560
+	elif layout['vx'] == 4 and layout['vy'] == 8:
+		render.resolution_x = 512
+		render.resolution_y = 256
+
+	resolution_aspect = render.resolution_x/render.resolution_y
+	render.pixel_aspect_x = 1.0
+	render.pixel_aspect_y = resolution_aspect / layout['aspect']
+
+def build_rig(layout, scene=None, view_cone=None):
+	''' Creates the Multiview object, a camera and a render view for every view of the layout and the render settings
+
+	Only uses the data API, so no operator runs and no undo step is pushed. The view cone defaults to the one
+	of the window manager. Returns the Multiview object.
+	'''
+	if scene is None:
+		scene = bpy.context.scene
+	if view_cone is None:
+		view_cone = bpy.context.window_manager.viewCone
+	num_views = layout.get('vtotal') or layout['vx'] * layout['vy']
+	log.info("Creating %d Cameras" % num_views)
+	setup_multiview(scene)
+	multiview = make_multiview(scene, layout, rig_fov)
+	# create an own collection for the camera objects
+	collection = bpy.data.collections.new("LKGCameraCollection")
+	scene.collection.children.link(collection)
+	cameras = [make_camera(scene, collection, multiview, i, num_views, view_cone, rig_fov) for i in range(num_views)]
+	#* need to set the scene camera otherwise it won't render by code?
+	# for a meaningful view set the middle camera active
+	scene.camera = cameras[int(floor(num_views/2))]
+	set_render_settings(scene, layout)
+	return multiview
 
 class lkgRenderSetup(bpy.types.Operator):
 	bl_idname = "lookingglass.render_setup"
@@ -36,265 +229,171 @@ class lkgRenderSetup(bpy.types.Operator):
 	bl_description = "Creates render setup for offline rendering utilizing multiview."
 	bl_options = {'REGISTER', 'UNDO'}
 
-	currentMultiview = None
-	fov = None
+	def execute(self, context):
+		wm = context.window_manager
+		build_rig(quilt_settings(wm.tilesHorizontal, wm.tilesVertical, wm.aspect), context.scene, wm.viewCone)
+		return {'FINISHED'}
+
+def get_rig_layout(scene):
+	''' Returns the quilt settings of the render setup, falling back to the window manager properties '''
+	wm = bpy.context.window_manager
+	multiview = bpy.data.objects.get("Multiview")
+	if multiview is not None and 'vx' in multiview:
+		return quilt_settings(multiview['vx'], multiview['vy'], multiview['aspect'])
+	return quilt_settings(wm.tilesHorizontal, wm.tilesVertical, wm.aspect)
+
+def get_rig_views(scene):
+	''' Returns (view index, view name) of all views created by the render setup '''
+	rig_views = []
+	for view in scene.render.views:
+		if view.name.startswith('view.'):
+			rig_views.append((int(view.name.rsplit('.', 1)[1]), view.name))
+	return sorted(rig_views)
+
+def load_view_image(filepath):
+	''' Reads an image from disk into a height x width x 4 float array, returns it with img.is_float
+
+	Float images like EXR hold scene linear values, byte images the display values divided by 255.
+	'''
+	img = bpy.data.images.load(filepath, check_existing=False)
+	try:
+		W, H = img.size
+		is_float = img.is_float
+		px = np.empty(W * H * 4, dtype=np.float32)
+		img.pixels.foreach_get(px)
+	finally:
+		bpy.data.images.remove(img)
+	return px.reshape(H, W, 4), is_float
+
+def load_view_uint8(filepath, scene):
+	''' Reads an image from disk into a height x width x 4 uint8 array, float images go through the color management of the scene '''
+	pixels, is_float = load_view_image(filepath)
+	if is_float:
+		return scene_color_transform(scene).apply(pixels)
+	return float_to_uint8(pixels, scratch=pixels)
+
+def write_quilt_image(scene, quilt, filepath):
+	''' Saves a uint8 quilt through a temporary image datablock in the render output format '''
+	H, W = quilt.shape[:2]
+	img = bpy.data.images.new("LKG_quilt_write", W, H, alpha=True)
+	try:
+		img.pixels.foreach_set(uint8_to_float(quilt).ravel())
+		img.filepath_raw = filepath
+		img.file_format = scene.render.image_settings.file_format
+		img.save()
+	finally:
+		bpy.data.images.remove(img)
+
+@persistent
+def write_quilt_handler(scene, *args):
+	''' Assembles the views of the frame Blender has just written into a single quilt image '''
+	if not scene.LKG_render_quilt or not scene.render.use_multiview:
+		return
+	render = scene.render
+	if render.is_movie_format:
+		print("Writing quilts is not supported for movie output formats")
+		return
+	rig_views = get_rig_views(scene)
+	if not rig_views:
+		return
+
+	start_time = timeit.default_timer()
+	settings = get_rig_layout(scene)
+	frame = scene.frame_current
+	view_width = int(render.resolution_x * render.resolution_percentage / 100)
+	view_height = int(render.resolution_y * render.resolution_percentage / 100)
+	assembler = QuiltAssembler(settings['vx'], settings['vy'], view_width, view_height, 4, len(rig_views))
+	# EXR and other float outputs are converted to display values like the render window shows them
+	color = scene_color_transform(scene)
+
+	# Blender does not expose the pixels of the render result, so the views are read back right after
+	# they have been written while they are still in the page cache of the operating system
+	view_paths = [render.frame_path(frame=frame, view=name) for view, name in rig_views]
+	missing = [filepath for filepath in view_paths if not os.path.isfile(filepath)]
+	if missing:
+		# an incomplete quilt would show black tiles, the views are kept to render the missing ones
+		print("Missing %d views of frame %d, e.g. %s, not writing its quilt" % (len(missing), frame, missing[0]))
+		return
+	for (view, name), filepath in zip(rig_views, view_paths):
+		pixels, is_float = load_view_image(filepath)
+		assembler.add_view(view, pixels, color if is_float else None)
+
+	quilt_path = quilt_filepath(render.frame_path(frame=frame), settings)
+	write_quilt_image(scene, assembler.quilt, quilt_path)
+
+	if not scene.LKG_keep_views:
+		for filepath in view_paths:
+			os.remove(filepath)
+	print("Writing quilt %s took: %.6f" % (quilt_path, timeit.default_timer() - start_time))
+
+def find_missing_views(scene, frames):
+	''' Returns {frame: [view names]} of the views that are missing or corrupt on disk '''
+	render = scene.render
+	rig_views = get_rig_views(scene)
+	missing = {}
+	for frame in frames:
+		for view, name in rig_views:
+			if not is_valid_image_file(render.frame_path(frame=frame, view=name)):
+				missing.setdefault(frame, []).append(name)
+	return missing
+
+class lkgRenderMissingViews(bpy.types.Operator):
+	bl_idname = "lookingglass.render_missing_views"
+	bl_label = "Resume Multiview Render"
+	bl_description = "Renders only the views of the frame range that are missing or corrupt in the output path."
 
 	log = logging.getLogger('bpy.ops.%s' % bl_idname)
 	log.setLevel('DEBUG')
 
-	@staticmethod
-	def setParentTrans(childOb, parentOb):
-		''' Create a child-parent hierarchy similar to the operator '''
-		childOb.parent = parentOb
-		childOb.matrix_parent_inverse = parentOb.matrix_world.inverted()
-		return True
-
-	def makeMultiview(self, context, hp_displayAspect):
-		''' Create a parent object for the multiview cameras that also indicates the view space of the LKG '''
-		self.log.info("Making Multiview")
-
-		# cube of dimensions 1-1-1, front and back stored separately
-		verts_front = [(-1.0,1.0,1.0),(1.0,1.0,1.0),(1.0,-1.0,1.0),(-1.0,-1.0,1.0)]
-		verts_back = [(-1.0,1.0,-1.0),(1.0,1.0,-1.0),(1.0,-1.0,-1.0),(-1.0,-1.0,-1.0)]
-
-		scn = context.scene
-		global currentMultiview
-		global fov
-		global hp
-
-		# Create mesh
-		me = bpy.data.meshes.new('Multiview')
-
-		# Create object
-		currentMultiview = bpy.data.objects.new("Multiview", me)
-		currentMultiview.show_name = True
-		scn.collection.objects.link(currentMultiview)
-
-		# Get a BMesh representation
-		bm = bmesh.new()   # create an empty BMesh
-
-		bm_verts_front = []
-		bm_verts_back = []
-		bm_verts = []
-
-		for v in verts_front:
-			bm_vert = bm.verts.new(v)
-			bm_verts_front.append(bm_vert)
-			bm_verts.append(bm_vert)
-		for v in verts_back:
-			bm_vert = bm.verts.new(v)
-			bm_verts_back.append(bm_vert)
-			bm_verts.append(bm_vert)
-
-		for i, v in enumerate(bm_verts_front):
-			j = (i+1)%len(bm_verts_front)
-			bm.edges.new( (bm_verts_front[i], bm_verts_front[j]) )
-
-		for i, v in enumerate(bm_verts_back):
-			j = (i+1)%len(bm_verts_back)
-			bm.edges.new( (bm_verts_back[i], bm_verts_back[j]) )
-			# hacky, saves one extra loop
-			bm.edges.new( (bm_verts_front[i], bm_verts_back[i]) )
-
-		dist=self.calculate_camera_distance_z(fov)
-		# hardcoded - refactor!
-		# the result includes a margin around the Multiview container object
-		dist_front = dist - 1.5
-		dist_back = dist + 0.0
-
-		scale_factor_front = tan(fov) * dist_front
-		scale_factor_back = tan(fov) * dist_back
-
-		bmesh.ops.scale(bm, vec=(scale_factor_front, scale_factor_front, 1.0), space=currentMultiview.matrix_local, verts=bm_verts_front)
-		bmesh.ops.scale(bm, vec=(scale_factor_back, scale_factor_back, 1.0), space=currentMultiview.matrix_local, verts=bm_verts_back)
-
-		# the aspect ratio should match the one of the LKG device
-		#wm = bpy.context.window_manager
-		#aspectRatio = wm.screenH / wm.screenW
-
-		bmesh.ops.scale(bm, vec=(1.0, 1/hp_displayAspect, 1.0), space=currentMultiview.matrix_local, verts=bm_verts_front)
-		bmesh.ops.scale(bm, vec=(1.0, 1/hp_displayAspect, 1.0), space=currentMultiview.matrix_local, verts=bm_verts_back)
-
-		# Finish up, write the bmesh back to the mesh
-		bm.to_mesh(me)
-
-	def get_vertical_fov_from_camera(self, cam):
-		''' returns the vertical field of view of the camera '''
-		render = bpy.context.scene.render
-		projection_matrix = cam.calc_matrix_camera(render.resolution_x, render.resolution_y, render.pixel_aspect_x, render.pixel_aspect_y)
-		fov_vertical = 2.0*atan( 1.0/projection_matrix[1][1] )
-		return fov_vertical
-
-	@staticmethod
-	def calculate_camera_distance_z(fov):
-		global currentMultiview
-		camLocZ = currentMultiview.scale[0] / tan(0.5 * radians(fov))
-		return camLocZ
-
-	def makeCamera(self, i):
-		''' Create Camera '''
-		self.log.info("Creating Camera")
-		global fov
-		wm = bpy.context.window_manager
-		numViews = wm.tilesHorizontal * wm.tilesVertical
-		viewCone = wm.viewCone
-
-		bpy.ops.object.camera_add(
-			enter_editmode=False,
-			align='WORLD',
-			location=(0, 0, 0),
-			rotation=(0,0,0)
-		)
-		cam = bpy.context.active_object
-		cam.name = 'cam.' + str(i).zfill(2)
-		cam.data.lens_unit = 'FOV'
-		fov_rad = radians(fov)
-		cam.data.angle = fov_rad
-
-		#* parent it to current multi view
-		global currentMultiview
-		currentMultiview.select_set(True)
-		bpy.context.view_layer.objects.active = currentMultiview
-		self.setParentTrans(cam, currentMultiview)
-		# const = cam.constraints.new('CHILD_OF')
-		# const.target=currentMultiview
-		# const.inverse_matrix = currentMultiview.matrix_world.inverted()
-
-
-
-		# cam distance
-		#camLocZ = currentMultiview.scale[0] / tan(0.5 * fov_rad)
-		camLocZ = self.calculate_camera_distance_z(fov)
-		cam.location[2] = camLocZ
-
-		# cam x pos
-		angleStr = radians(-viewCone * 0.5 + viewCone * (i / (numViews - 1)))
-		camLocX = cam.location[2] * tan(angleStr) / currentMultiview.scale[0]
-		self.log.info("Camera X location: %f" % camLocX)
-		self.log.info("Camera Z location: %f" % cam.location[2])
-		cam.location[0] = camLocX
-
-		# shift x
-		cam.data.shift_x = (-0.5) * cam.location.x
-
-		# clipping relative to the MultiView object bounds
-		# clip delta is to get rid of most of the Multiview object in the LKG
-		clip_delta = 0.01
-		cam.data.clip_start = camLocZ - 1.0 + clip_delta
-		cam.data.clip_end = camLocZ + 1.0 - clip_delta
-
-		# drivers to keep camera clipping distances in bounds of Multiview object when it gets scaled TODO: De-duplicate
-		driver = cam.data.driver_add('clip_start').driver
-		var = driver.variables.new()
-		var.name = 'z_scale'
-		var.targets[0].id = currentMultiview
-		var.targets[0].data_path = 'scale.z'
-		driver.expression = 'z_scale / tan(0.5 * radians(' + str(fov) + ')) - z_scale + ' + str(clip_delta) + '*z_scale'
-
-		driver = cam.data.driver_add('clip_end').driver
-		var = driver.variables.new()
-		var.name = 'z_scale'
-		var.targets[0].id = currentMultiview
-		var.targets[0].data_path = 'scale.z'
-		driver.expression = 'z_scale / tan(0.5 * radians(' + str(fov) + ')) + z_scale - ' + str(clip_delta) + '*z_scale'
-
-		#* set up view
-		bpy.ops.scene.render_view_add()
-		newView = bpy.context.scene.render.views.active
-		newView.name = 'view.' + str(i).zfill(2)
-		newView.camera_suffix = '.' + str(i).zfill(2)
-
-		# the cameras will be invisible in the viewport but for debugging it is nice to see the limits directly when turning one on
-		cam.data.show_limits = True
-
-		# cam should be invisible in the viewport because otherwise a line will appear in the LKG
-		# for 2.8 we need to use hide_set(True) because hide_viewport will globally disable it in viewports, temporarily breaking the child-parent-relationship
-		cam.hide_set(True)
-
-		return cam
-
-	def makeAllCameras(self, camCollection):
-		self.log.info("Make all cameras")
-		wm = bpy.context.window_manager
-		numViews = wm.tilesHorizontal * wm.tilesVertical
-		self.log.info("Creating %d Cameras" % numViews)
-		allCameras = []
-		for i in range(0, numViews):
-			cam = self.makeCamera(i)
-			allCameras.append(cam)
-			camCollection.objects.link(cam)
-		return allCameras
-
-	def setupMultiView(self):
-		self.log.info("Setting up Multiview")
-		render = bpy.context.scene.render
-		render.use_multiview = True
-		if "left" in render.views:
-			render.views["left"].use = False
-		if "right" in render.views:
-			render.views["right"].use = False
-		render.views_format = 'MULTIVIEW'
-
-	def setRenderSettings(self, context, hp_displayAspect):
-		''' Set render size depending on LKG configuration. This overwrites previous settings! '''
-		global hp
-		wm = context.window_manager
-		render = context.scene.render
-
-		if wm.tilesHorizontal == 5 and wm.tilesVertical == 9:
-			render.resolution_x = 819
-			render.resolution_y = 455
-			render.pixel_aspect_x = 1.0
-			render.pixel_aspect_y = 1.125
-		elif wm.tilesHorizontal == 8 and wm.tilesVertical == 6:
-			render.resolution_x = 420
-			render.resolution_y = 560
-			render.pixel_aspect_x = 1.0
-			render.pixel_aspect_y = 1.25
-		elif wm.tilesHorizontal == 4 and wm.tilesVertical == 8:
-			render.resolution_x = 512
-			render.resolution_y = 256
-			render.pixel_aspect_x = 1.0
-			render.pixel_aspect_y = 1.25
-
-		resolution_aspect = render.resolution_x/render.resolution_y
-
-		if hp_displayAspect < 1.0:
-			render.pixel_aspect_x = 1.0
-			render.pixel_aspect_y = resolution_aspect / hp_displayAspect
-		else:
-			render.pixel_aspect_x = 1.0
-			render.pixel_aspect_y = resolution_aspect / hp_displayAspect
-
-
 	def execute(self, context):
+		scene = context.scene
+		render = scene.render
 		wm = context.window_manager
-		hp_displayAspect = wm.aspect
-		# the fov of the Blender camera is relative to the broader side
-		# at an aspect ratio of 16:10 a fov of 14° translates to ~22.23 degrees
-		global fov
-		fov = 22.23
-		# TODO: find a better way, this here is tricky
-		bpy.ops.ed.undo_push()
-		self.setupMultiView()
-		self.makeMultiview(context, hp_displayAspect)
-		# create an own collection for the camera objects
-		camCollection = bpy.data.collections.new("LKGCameraCollection")
-		context.scene.collection.children.link(camCollection)
-		allCameras = self.makeAllCameras(camCollection)
-		#* need to set the scene camera otherwise it won't render by code?
-		# for a meaningful view set the middle camera active
-		numCams = len(allCameras)
-		context.scene.camera = allCameras[int(floor(numCams/2))]
-		self.setRenderSettings(context, hp_displayAspect)
+
+		if not render.use_multiview or not get_rig_views(scene):
+			self.report({'ERROR'}, "The scene does not contain a Looking Glass render setup.")
+			return {'CANCELLED'}
+		if render.is_movie_format:
+			self.report({'ERROR'}, "Resuming is not supported for movie output formats.")
+			return {'CANCELLED'}
+
+		start_time = timeit.default_timer()
+		frames = range(scene.frame_start, scene.frame_end + 1, scene.frame_step)
+		missing = find_missing_views(scene, frames)
+		num_missing = sum(len(names) for names in missing.values())
+		self.log.info("Checking %d frames took: %.6f" % (len(frames), timeit.default_timer() - start_time))
+		if not missing:
+			self.report({'INFO'}, "All views are on disk already.")
+			return {'FINISHED'}
+		self.log.info("Rendering %d missing views of %d frames" % (num_missing, len(missing)))
+
+		view_use = {view.name: view.use for view in render.views}
+		frame_current = scene.frame_current
+		wm.progress_begin(0, len(missing))
+		try:
+			for i, (frame, names) in enumerate(sorted(missing.items())):
+				for view, name in get_rig_views(scene):
+					render.views[name].use = name in names
+				scene.frame_set(frame)
+				bpy.ops.render.render(write_still=True)
+				wm.progress_update(i + 1)
+		finally:
+			for name, use in view_use.items():
+				render.views[name].use = use
+			scene.frame_set(frame_current)
+			wm.progress_end()
+
+		self.report({'INFO'}, "Rendered %d missing views of %d frames." % (num_missing, len(missing)))
 		return {'FINISHED'}
 
 def register():
 	bpy.utils.register_class(lkgRenderSetup)
+	bpy.utils.register_class(lkgRenderMissingViews)
 
 
 def unregister():
 	bpy.utils.unregister_class(lkgRenderSetup)
+	bpy.utils.unregister_class(lkgRenderMissingViews)
 
 if __name__ == "__main__":
 	register()
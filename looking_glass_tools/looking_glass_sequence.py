@@ -0,0 +1,295 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Helpers to find the files of multiview renders on disk. Does not import bpy.
+
+import os
+import re
+import threading
+
+try:
+	from . looking_glass_quilt import quilt_suffix_pattern
+except ImportError:
+	# executed as a script by blender -P or python
+	from looking_glass_quilt import quilt_suffix_pattern
+
+# Blender writes multiview renders as <prefix><frame>.<view suffix>.<extension>,
+# e.g. render_0001.00.png, where the view suffix is set up by the render setup
+multiview_filename_pattern = re.compile(r'^(?P<prefix>.*?)(?P<frame>\d*)\.(?P<view>\d+)\.(?P<ext>[^.]+)$')
+
+def parse_multiview_filename(filename):
+	''' Returns (prefix, frame, view, extension) of a multiview file name or None if it does not match
+
+	Quilt images like 0001_qs5x9a0.75.png look like views to the pattern and are not part of a multiview sequence.
+	'''
+	if quilt_suffix_pattern.search(filename):
+		return None
+	match = multiview_filename_pattern.match(filename)
+	if match is None:
+		return None
+	frame = match.group('frame')
+	return match.group('prefix'), int(frame) if frame else None, int(match.group('view')), match.group('ext')
+
+def parse_frame_range(frames):
+	''' Parses frame ranges like "1-250" or "1-10,15,20-30" into a sorted list of frames '''
+	result = set()
+	for part in frames.split(','):
+		part = part.strip()
+		if not part:
+			continue
+		if '-' in part:
+			first, last = part.split('-', 1)
+			result.update(range(int(first), int(last) + 1))
+		else:
+			result.add(int(part))
+	return sorted(result)
+
+class SequenceFile:
+	''' One view of one frame on disk '''
+	__slots__ = ('path', 'frame', 'view', 'mtime', 'size')
+
+	def __init__(self, path, frame, view, mtime, size):
+		self.path = path
+		self.frame = frame
+		self.view = view
+		self.mtime = mtime
+		self.size = size
+
+class MultiviewSequence:
+	''' (frame, view) -> file map of one multiview sequence, frame is None for renders without frame number '''
+
+	def __init__(self, prefix, extension):
+		self.prefix = prefix
+		self.extension = extension
+		self.files = {}
+		self.views_by_frame = {}
+
+	def add(self, entry):
+		self.files[(entry.frame, entry.view)] = entry
+		self.views_by_frame.setdefault(entry.frame, {})[entry.view] = entry.path
+
+	def remove(self, frame, view):
+		self.files.pop((frame, view), None)
+		views = self.views_by_frame.get(frame)
+		if views is not None:
+			views.pop(view, None)
+			if not views:
+				del self.views_by_frame[frame]
+
+	def path(self, frame, view):
+		''' Returns the file of a view or None if it is not on disk '''
+		entry = self.files.get((frame, view))
+		return entry.path if entry is not None else None
+
+	def views(self, frame):
+		''' Returns {view: filepath} of a frame '''
+		return self.views_by_frame.get(frame, {})
+
+	def frames(self):
+		return sorted(self.views_by_frame, key=lambda frame: -1 if frame is None else frame)
+
+	def __len__(self):
+		return len(self.files)
+
+class MultiviewSequenceIndex:
+	''' Index of all multiview sequences in a directory, built with a single scan and updated incrementally
+
+	The index is shared by threads, e.g. the slots of the render farm, hold lock while reading its sequences.
+	'''
+
+	def __init__(self, directory):
+		self.directory = directory
+		self.lock = threading.RLock()
+		self.sequences = {}
+		self._files = {}
+		self._directory_mtime = None
+		self.refresh()
+
+	def _add(self, filename, parsed, stat):
+		prefix, frame, view, extension = parsed
+		self._remove(filename)
+		entry = SequenceFile(os.path.join(self.directory, filename), frame, view, stat.st_mtime_ns, stat.st_size)
+		sequence = self.sequences.get((prefix, extension))
+		if sequence is None:
+			sequence = self.sequences[(prefix, extension)] = MultiviewSequence(prefix, extension)
+		sequence.add(entry)
+		self._files[filename] = (prefix, extension, entry)
+
+	def _remove(self, filename):
+		known = self._files.pop(filename, None)
+		if known is not None:
+			prefix, extension, entry = known
+			sequence = self.sequences[(prefix, extension)]
+			sequence.remove(entry.frame, entry.view)
+			if len(sequence) == 0:
+				del self.sequences[(prefix, extension)]
+
+	def refresh(self, force=False):
+		''' Rescans the directory if files were added or removed since the last scan, returns True when it did
+
+		Only files that are new or whose size or modification time changed are updated.
+		Files overwritten in place do not change the directory, use force or update_file for those.
+		'''
+		with self.lock:
+			return self._refresh(force)
+
+	def _refresh(self, force):
+		try:
+			directory_mtime = os.stat(self.directory).st_mtime_ns
+		except OSError:
+			self.sequences = {}
+			self._files = {}
+			self._directory_mtime = None
+			return True
+		if not force and directory_mtime == self._directory_mtime:
+			return False
+		self._directory_mtime = directory_mtime
+
+		seen = set()
+		with os.scandir(self.directory) as entries:
+			for dir_entry in entries:
+				parsed = parse_multiview_filename(dir_entry.name)
+				if parsed is None:
+					continue
+				seen.add(dir_entry.name)
+				try:
+					stat = dir_entry.stat()
+				except OSError:
+					continue
+				known = self._files.get(dir_entry.name)
+				if known is not None and known[2].mtime == stat.st_mtime_ns and known[2].size == stat.st_size:
+					continue
+				self._add(dir_entry.name, parsed, stat)
+		for filename in set(self._files) - seen:
+			self._remove(filename)
+		return True
+
+	def update_file(self, filepath):
+		''' Updates a single file, e.g. after it has just been written '''
+		filename = os.path.basename(filepath)
+		parsed = parse_multiview_filename(filename)
+		if parsed is None:
+			return
+		with self.lock:
+			try:
+				self._add(filename, parsed, os.stat(filepath))
+			except OSError:
+				self._remove(filename)
+
+	def sequence(self, prefix=None, extension=None):
+		''' Returns the matching sequence with the most files or None '''
+		with self.lock:
+			candidates = [sequence for (seq_prefix, seq_extension), sequence in self.sequences.items()
+				if (prefix is None or seq_prefix == prefix) and (extension is None or seq_extension.lower() == extension.lower())]
+		if not candidates:
+			return None
+		# pick the sequence with the most files in case several renders share the directory
+		return max(candidates, key=len)
+
+# one index per directory, shared by viewers, converters and players
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_sequence_index(directory):
+	''' Returns the up to date index of a directory '''
+	directory = os.path.abspath(directory)
+	with _indexes_lock:
+		index = _indexes.get(directory)
+		if index is None:
+			index = _indexes[directory] = MultiviewSequenceIndex(directory)
+			return index
+	index.refresh()
+	return index
+
+def find_sequence(filepath):
+	''' Returns (sequence, frame, view) for the file of one view or None if it is not part of a multiview sequence '''
+	directory, filename = os.path.split(os.path.abspath(filepath))
+	parsed = parse_multiview_filename(filename)
+	if parsed is None:
+		return None
+	prefix, frame, view, extension = parsed
+	sequence = get_sequence_index(directory).sequence(prefix, extension)
+	if sequence is None:
+		return None
+	return sequence, frame, view
+
+def scan_multiview_sequence(directory, prefix=None, extension=None):
+	''' Returns {frame: {view: filepath}} of the largest matching multiview sequence in a directory '''
+	index = get_sequence_index(directory)
+	# the copy is taken under the lock, another thread may refresh the index meanwhile
+	with index.lock:
+		sequence = index.sequence(prefix, extension)
+		if sequence is None:
+			return {}
+		return {frame: dict(sequence.views(frame)) for frame in sequence.frames()}
+
+# first bytes of the image formats Blender writes
+image_signatures = {
+	'png': (b'\x89PNG\r\n\x1a\n',),
+	'jpg': (b'\xff\xd8\xff',),
+	'jpeg': (b'\xff\xd8\xff',),
+	'exr': (b'\x76\x2f\x31\x01',),
+	'bmp': (b'BM',),
+	'tif': (b'II*\x00', b'MM\x00*'),
+	'tiff': (b'II*\x00', b'MM\x00*'),
+	'tga': (b'',),
+	'hdr': (b'#?',),
+	'webp': (b'RIFF',),
+}
+
+# last bytes of formats that have an end marker, catches files cut off by a crash
+image_trailers = {
+	'png': b'IEND\xaeB`\x82',
+	'jpg': b'\xff\xd9',
+	'jpeg': b'\xff\xd9',
+}
+
+def is_valid_image_file(filepath):
+	''' Cheap check whether an image file was written completely, only looks at size, header and trailer '''
+	try:
+		size = os.path.getsize(filepath)
+		if size == 0:
+			return False
+		extension = filepath.rsplit('.', 1)[-1].lower()
+		signatures = image_signatures.get(extension, (b'',))
+		trailer = image_trailers.get(extension, b'')
+		with open(filepath, 'rb') as f:
+			header = f.read(max(len(signature) for signature in signatures))
+			if not any(header.startswith(signature) for signature in signatures):
+				return False
+			if trailer:
+				if size < len(trailer):
+					return False
+				f.seek(-len(trailer), os.SEEK_END)
+				if f.read(len(trailer)) != trailer:
+					return False
+	except OSError:
+		return False
+	return True
+
+def sniff_image_format(filepath):
+	''' Returns the format of an image file from its first bytes, e.g. 'png', or None '''
+	try:
+		with open(filepath, 'rb') as f:
+			header = f.read(8)
+	except OSError:
+		return None
+	for extension in ('png', 'jpg', 'bmp', 'exr', 'tif', 'hdr', 'webp'):
+		if any(header.startswith(signature) for signature in image_signatures[extension]):
+			return extension
+	return None
@@ -18,12 +18,41 @@
 
 import ctypes
 import sys
+import os
+import json
+import threading
+from collections import deque
 import bpy
 import time
-import io
 import numpy as np
 import timeit
 from . holoplay_service_api_commands import *
+from . holoplay_service_framing import encode_message, encode_quilt_message, encode_file_message, send_frame
+from . holoplay_service_sender import SenderProcess
+from bpy.app.handlers import persistent
+from . looking_glass_quilt import staging_array, float_to_uint8, quilt_pyramid
+from . looking_glass_color import scene_color_transform
+
+# filled by init() from the calibration cache and the answer of HoloPlay Service
+sock = None
+numDevices = 0
+calibration = None
+screenW = 1536.0
+screenH = 2048.0
+aspect = 0.75
+
+# progressive transmission: every send bumps the generation, a full resolution quilt waiting
+# for the scene to settle is dropped when a newer send supersedes it
+send_generation = 0
+pending_full_quilt = None
+last_scene_change = 0.0
+
+# messages are sent from the main thread and the streaming thread, one request at a time
+send_lock = threading.Lock()
+# QuiltRecorder of the running session recording, subscribed to the quilt bus of the live view
+recorder = None
+# SenderProcess that encodes and sends quilts outside of Blender, None when sending in process
+sender = None
 
 def ensure_site_packages(packages):
     """ `packages`: list of tuples (<import name>, <pip name>) """
@@ -41,31 +70,158 @@ def ensure_site_packages(packages):
     if modules_to_install:
         import subprocess
 
-        if bpy.app.version < (2,91,0):
-            python_binary = bpy.app.binary_path_python
-        else:
-            python_binary = sys.executable
+        subprocess.run([python_binary(), '-m', 'ensurepip'], check=True)
+        subprocess.run([python_binary(), '-m', 'pip', 'install', *modules_to_install, "--user"], check=True)
 
-        subprocess.run([python_binary, '-m', 'ensurepip'], check=True)
-        subprocess.run([python_binary, '-m', 'pip', 'install', *modules_to_install, "--user"], check=True)
+def python_binary():
+    """ The Python interpreter that ships with Blender """
+    if bpy.app.version < (2,91,0):
+        return bpy.app.binary_path_python
+    return sys.executable
 
 def send_message(sock, inputObj):
-    import pynng
-    import cbor
-    
-    out = cbor.dumps(inputObj)
-    print("---------------")
-    print("Command (" + str(len(out)) + " bytes, "+str(len(inputObj['bin']))+" binary): ")
-    print(inputObj['cmd'])
-    print("---------------")
-    sock.send(out)
-    # Driver will respond with a CBOR-formatted error message / information packet
-    response = sock.recv()
-    print("Response (" + str(len(response)) + " bytes): ")
-    response_load = cbor.loads(response)
-    print(response_load)
-    print("---------------")
-    return response_load
+    # the command header is encoded once per command, the binary data is not copied through cbor.dumps
+    with send_lock:
+        return send_frame(sock, encode_message(inputObj['cmd'], inputObj['bin']))
+
+def send_quilt_pixels(sock, pixels, settings, cache_name=None):
+    """ Sends a height x width x 4 uint8 quilt (rows bottom to top) as BMP written straight into the message
+
+    With cache_name the quilt is stored in HoloPlay Service to be shown later with load_quilt instead.
+    """
+    if cache_name is None:
+        cmd = show_quilt(None, settings)['cmd']
+        if sender is not None and sender.is_running():
+            # the sender process answers asynchronously, its acks only carry the latency
+            if sender.submit(pixels, settings):
+                return None
+            # every slot is busy or the quilt is larger than a slot, an explicit send must not get lost
+            if sock is None:
+                raise RuntimeError("The sender process could not take the quilt and HoloPlay Service is not connected")
+    else:
+        cmd = cache_quilt(None, cache_name, settings)['cmd']
+    # the message buffer is reused, so encoding and sending must not interleave with the streaming thread
+    with send_lock:
+        frame = encode_quilt_message(cmd, pixels)
+        return send_frame(sock, frame)
+
+def send_quilt_file(sock, filepath, settings):
+    """ Sends a PNG, JPEG or BMP quilt image as it is on disk, HoloPlay Service decodes it itself """
+    with send_lock:
+        frame = encode_file_message(show_quilt(None, settings)['cmd'], filepath)
+        return send_frame(sock, frame)
+
+def start_sender():
+    """ Starts the sender process, quilts are then sent through its shared ring buffer """
+    global sender
+    if sender is None or not sender.is_running():
+        stop_sender()
+        sender = SenderProcess(python_binary())
+    return sender
+
+def stop_sender():
+    global sender
+    if sender is not None:
+        sender.stop()
+        sender = None
+
+class QuiltStreamer:
+    """ Sends quilts from a background thread while the main thread renders the next frame
+
+    Only the newest quilt is kept when sending falls behind, older ones are dropped.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # three buffers: one being sent, one waiting and one being filled by the main thread
+        self._buffers = [None, None, None]
+        self._sending = None
+        self._pending = None
+        self._send_times = deque(maxlen=30)
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.last_error = None
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def is_behind(self):
+        """ True when a quilt is still waiting for the sender, rendering another one would only be dropped """
+        return self._pending is not None
+
+    def submit(self, quilt, settings, prefetch=None):
+        """ Queues a copy of a height x width x 4 uint8 quilt, prefetch is called by the sender thread once it is idle """
+        with self.condition:
+            waiting = self._pending[0] if self._pending is not None else None
+            index = next(i for i in range(3) if i != self._sending and i != waiting)
+        buffer = self._buffers[index]
+        if buffer is None or buffer.shape != quilt.shape:
+            buffer = self._buffers[index] = np.empty(quilt.shape, dtype=np.uint8)
+        np.copyto(buffer, quilt)
+        self._queue((index, settings, prefetch, None))
+
+    def submit_message(self, message, prefetch=None):
+        """ Queues a small message instead of a quilt, e.g. load_quilt for quilts cached in HoloPlay Service """
+        self._queue((None, None, prefetch, message))
+
+    def _queue(self, pending):
+        with self.condition:
+            if self._pending is not None:
+                self.frames_dropped += 1
+            self._pending = pending
+            self.condition.notify()
+
+    def drop(self):
+        """ Counts a frame that was skipped because the sender fell behind """
+        self.frames_dropped += 1
+
+    def buffer_bytes(self):
+        return sum(buffer.nbytes for buffer in self._buffers if buffer is not None)
+
+    @property
+    def fps(self):
+        """ Quilts per second the device received over the last frames """
+        times = self._send_times
+        if len(times) < 2 or times[-1] == times[0]:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self._running and self._pending is None:
+                    self.condition.wait()
+                if not self._running:
+                    return
+                index, settings, prefetch, message = self._pending
+                self._pending = None
+                self._sending = index
+            try:
+                if sock is not None:
+                    if message is not None:
+                        send_message(sock, message)
+                    else:
+                        send_quilt_pixels(sock, self._buffers[index], settings)
+                    self._send_times.append(time.monotonic())
+                    self.frames_sent += 1
+            except Exception as error:
+                self.last_error = error
+                print("Streaming quilt failed: " + str(error))
+            with self.condition:
+                self._sending = None
+            if prefetch is not None and self._pending is None:
+                prefetch()
+
+    def stop(self):
+        with self.condition:
+            self._running = False
+            self.condition.notify()
+        self._thread.join(timeout=5.0)
+
+    def reset_stats(self):
+        self._send_times.clear()
+        self.frames_sent = 0
+        self.frames_dropped = 0
 
 def send_quilt(sock, quilt, duration=10):
     print("===================================================")
@@ -73,8 +229,6 @@ def send_quilt(sock, quilt, duration=10):
 
     aspect = bpy.context.window_manager.aspect
 
-    from PIL import Image, ImageOps
-        
     start_time = timeit.default_timer()
     print("Show a single quilt for " + str(duration) + " seconds, then wipe.")
     print("===================================================")
@@ -84,99 +238,187 @@ def send_quilt(sock, quilt, duration=10):
     img0 = quilt
     W,H = img0.size
     
-    # pre-allocate numpy array for better performance
-    px0 = np.zeros(H*W*4, dtype=np.float32)
+    # foreach_get only reads the whole image, the float copy is four times the size of the quilt and
+    # is freed right after the conversion instead of being kept as a staging array
+    px0 = np.empty(H*W*4, dtype=np.float32)
     # foreach_get is probably the fastest method to aquire the pixel values from a Blender image datablock
     img0.pixels.foreach_get(px0)
     print("Reading image from Blender image datablock: %.6f" % (timeit.default_timer() - start_time))
     
-    # we need to convert the floats to integers from 0-255 for most image formats like PNG or BMP which can be send to HoloPlay Service
-    # np.multiply(px0, 255, out=px0, casting="unsafe")
-    pixels=px0.astype(np.uint8, order="C")
-    
-    pimg_time = timeit.default_timer()
-    # for some reason the following only works when we create a PIL Image from a bytes-stream
-    # so we need to convert the numpy array to bytes and read that
-    pimg = Image.frombytes("RGBA", (W,H),  pixels.tobytes())
-
-    # the result is flipped, probably due to numpy, flip it back
-    pimg_flipped = ImageOps.flip(pimg)
-    print("Converting pixels to bytes-stream and flipping took: %.6f" % (timeit.default_timer() - pimg_time))
-    
-    # the idea is that we convert the PIL image to a simple file format HoloPlay Service / stb_image can read
-    # and store it in a BytesIO object instead of disk
-    output = io.BytesIO()
-    pimg_flipped.convert('RGBA').save(output, 'BMP')
+    # we need to convert the 0-1 floats to integers from 0-255 for most image formats like PNG or BMP which can be send to HoloPlay Service
+    out = staging_array("send_uint8", (H*W*4,), np.uint8)
+    if img0.is_float:
+        # float images hold scene linear values, they get the view transform of the scene like in the image editor
+        pixels = scene_color_transform(bpy.context.scene).apply(px0.reshape(H, W, 4), out=out.reshape(H, W, 4))
+    else:
+        pixels = float_to_uint8(px0, out=out, scratch=px0)
+    del px0
     
-    # the contents of the BytesIO object becomes our blob we send to HoloPlay Service
-    blob = output.getvalue()
     settings = {'vx': 5,'vy': 9,'vtotal': 45,'aspect': aspect}
     # settings = {'vx': 5,'vy': 9,'vtotal': 45,'aspect': 0.75}
-    send_message(sock, show_quilt(blob, settings))
+    send_quilt_pixels(sock, pixels.reshape(H, W, 4), settings)
     print("Reading quilt from Blender image datablock and sending it to HoloPlay Service took: %.6f" % (timeit.default_timer() - start_time))
     # print("Waiting for 10 seconds...")
     # time.sleep(duration)
     # send_message(sock, wipe())
 
 # def send_quilt_from_np(sock, quilt, W=4096, H=4096, duration=10):
-def send_quilt_from_np(sock, quilt, W=4096, H=4096, duration=10):
+def send_quilt_from_np(sock, quilt, W=4096, H=4096, duration=10, settings=None):
     print("===================================================")
     print("Sending quilt to HoloPlay Service")
 
     aspect = bpy.context.window_manager.aspect
 
-    from PIL import Image, ImageOps
-        
     start_time = timeit.default_timer()
     # print("Show a single quilt for " + str(duration) + " seconds, then wipe.")
     # print("===================================================")
 
     # we get the data from the live view as numpy array 
     px0 = quilt
-    #W,H = px0.size
+    # quilts from quilt files and caches know their size, flat arrays from the live view use W and H
+    if px0.ndim == 3:
+        H, W = px0.shape[:2]
     
-    # we need to convert the 0-1 floats to integers from 0-255
-    # np.multiply(px0, 255, out=px0, casting="unsafe")
-    pixels=px0.astype(np.uint8, order="C")
+    # the live view delivers 0-255 integers already, only floats need to be quantized
+    if px0.dtype == np.uint8:
+        pixels = px0
+    else:
+        pixels = float_to_uint8(px0)
     
-    pimg_time = timeit.default_timer()
-    # for some reason the following only works when we create a PIL Image from a bytes-stream
-    # so we need to convert the numpy array to bytes and read that
-    # pimg = Image.frombytes("RGBA", (W,H),  pixels.tobytes())
-    pimg = Image.frombytes("RGBA", (W,H),  pixels.tobytes())
-
-
-    # the result is flipped, probably due to numpy, flip it back
-    pimg_flipped = ImageOps.flip(pimg)
-    print("Converting pixels to bytes-stream and flipping took: %.6f" % (timeit.default_timer() - pimg_time))
-    
-    # the idea is that we convert the PIL image to a simple file format HoloPlay Service / stb_image can read
-    # and store it in a BytesIO object instead of disk
-    output = io.BytesIO()
-    pimg_flipped.convert('RGBA').save(output, 'BMP')
-    
-    # the contents of the BytesIO object becomes our blob we send to HoloPlay Service
-    blob = output.getvalue()
     # settings = {'vx': 5,'vy': 9,'vtotal': 45,'aspect': 1.6}
-    settings = {'vx': 5,'vy': 9,'vtotal': 45,'aspect': aspect}
-    send_message(sock, show_quilt(blob, settings))
+    if settings is None:
+        settings = {'vx': 5,'vy': 9,'vtotal': 45,'aspect': aspect}
+    send_quilt_pixels(sock, pixels.reshape(H, W, -1), settings)
     print("Reading quilt from numpy array and sending it to HoloPlay Service took in total: %.6f" % (timeit.default_timer() - start_time))
     # print("Waiting for 10 seconds...")
     # time.sleep(duration)
     # send_message(sock, wipe())
 
-def init():
-    global hp
-    global sock
+def send_quilt_progressive(sock, quilt, settings, preview_width=1024, settle_time=0.5):
+    """ Sends a downsampled preview of a height x width x 4 uint8 quilt right away and the full
+    resolution quilt once the scene did not change for settle_time seconds """
+    global send_generation, pending_full_quilt
+
+    send_generation += 1
+    start_time = timeit.default_timer()
+    levels = quilt_pyramid(quilt, preview_width)
+    if len(levels) == 1:
+        pending_full_quilt = None
+        send_quilt_from_np(sock, quilt, settings=settings)
+        return
+    print("Building the preview quilt took: %.6f" % (timeit.default_timer() - start_time))
+    send_quilt_from_np(sock, levels[-1], settings=settings)
+
+    # the quilt passed in is usually a staging array of the live view, keep a copy until it is sent
+    full_quilt = staging_array("progressive_full_quilt", quilt.shape, np.uint8)
+    np.copyto(full_quilt, quilt)
+    pending_full_quilt = (send_generation, full_quilt, settings, settle_time)
+    if not bpy.app.timers.is_registered(send_pending_full_quilt):
+        bpy.app.timers.register(send_pending_full_quilt, first_interval=settle_time)
+
+def send_pending_full_quilt():
+    """ Timer sending the full resolution quilt of the last progressive send once the scene settled """
+    global pending_full_quilt
+
+    if pending_full_quilt is None:
+        return None
+    generation, quilt, settings, settle_time = pending_full_quilt
+    if generation != send_generation:
+        # superseded by a newer send
+        pending_full_quilt = None
+        return None
+    remaining = last_scene_change + settle_time - time.monotonic()
+    if remaining > 0.0:
+        return remaining
+    pending_full_quilt = None
+    send_quilt_from_np(sock, quilt, settings=settings)
+    return None
+
+def cancel_progressive_send():
+    """ Drops a full resolution quilt that is still waiting to be sent """
+    global send_generation, pending_full_quilt
+    send_generation += 1
+    pending_full_quilt = None
+
+@persistent
+def scene_changed_handler(scene, *args):
+    """ depsgraph_update_post handler, the full resolution quilt waits until edits stop for a moment """
+    global last_scene_change
+    last_scene_change = time.monotonic()
+
+def device_serial(device, index=0):
+    """ Returns the serial of a device from an 'info' response, used as key of the calibration cache """
+    calibration = device.get('calibration', {})
+    return str(calibration.get('serial') or device.get('hwid') or 'device' + str(index))
+
+def calibration_cache_filepath():
+    """ The calibration cache lives in the config folder of the Blender user """
+    directory = bpy.utils.user_resource('CONFIG', path='looking_glass', create=True)
+    return os.path.join(directory, 'calibration_cache.json')
+
+def load_calibration_cache():
+    """ Returns the devices stored in the calibration cache, in the order they were last reported """
+    try:
+        with open(calibration_cache_filepath(), 'r') as f:
+            cache = json.load(f)
+        return [cache['devices'][serial] for serial in cache['order'] if serial in cache['devices']]
+    except (OSError, ValueError, KeyError, TypeError):
+        return []
+
+def save_calibration_cache(devices):
+    """ Merges the devices of an 'info' response into the calibration cache """
+    filepath = calibration_cache_filepath()
+    try:
+        with open(filepath, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = None
+    if not isinstance(cache, dict) or not isinstance(cache.get('devices'), dict):
+        # a damaged or foreign cache is replaced instead of failing the handoff of the device info
+        cache = {'devices': {}}
+    order = []
+    for index, device in enumerate(devices):
+        serial = device_serial(device, index)
+        cached = cache['devices'].get(serial)
+        if isinstance(cached, dict) and cached.get('calibration') != device.get('calibration'):
+            print("Calibration of device " + serial + " changed, updating the cache")
+        cache['devices'][serial] = device
+        order.append(serial)
+    cache['order'] = order
+    cache['updated'] = time.time()
+    # write to a temporary file first so an interrupted write does not destroy the cache
+    tmp_filepath = filepath + '.tmp'
+    with open(tmp_filepath, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_filepath, filepath)
+
+def apply_devices(devices, connected):
+    """ Sets the display properties from the first device, `connected` is False for cached devices """
     global numDevices
     global screenW
     global screenH
     global aspect
-
-    print("Init Settings")
-    start_time = timeit.default_timer()
+    global calibration
 
     wm = bpy.context.window_manager
+    if connected:
+        numDevices = len(devices)
+        wm.numDevicesConnected = len(devices)
+    if devices == []:
+        return
+    screenW = devices[0]['calibration']['screenW']['value']
+    screenH = devices[0]['calibration']['screenH']['value']
+    aspect = screenW / screenH
+    wm.screenW = screenW
+    wm.screenH = screenH
+    wm.aspect = aspect
+    calibration = devices[0]['calibration']
+
+def connect_to_service():
+    """ Runs in a background thread: connects to HoloPlay Service and asks for the connected devices """
+    global sock
+
+    start_time = timeit.default_timer()
 
     ws_url = "ws://localhost:11222/driver"
     driver_url = "ipc:///tmp/holoplay-driver.ipc"
@@ -194,31 +436,53 @@ def init():
 
     # This script should work identically whether addr = driver_url or addr = ws_url
     addr = driver_url
-    # if sock == None:
-    sock = pynng.Req0(recv_timeout=2000)
+    new_sock = pynng.Req0(recv_timeout=2000)
     try:
-        sock.dial(addr, block = True)
+        new_sock.dial(addr, block = True)
     except:
         print("Could not open socket. Is driver running?")
-        sys.exit(1)
+        new_sock.close()
+        return
+
+    try:
+        response = send_message(new_sock, {'cmd':{'info':{}},'bin':bytes()})
+    except Exception as e:
+        print("HoloPlay Service did not answer: " + str(e))
+        new_sock.close()
+        return
+    sock = new_sock
+    print("Connecting to HoloPlay Service took: %.6f" % (timeit.default_timer() - start_time))
 
-    response = send_message(sock, {'cmd':{'info':{}},'bin':''})
     if response != None:
-        # create a dictionary with an index for this device
-        devices = response['devices']
-        if devices == []:
-            print("No Looking Glass devices found")
-        else:
-            print("Printing Devices")
-            screenW = devices[0]['calibration']['screenW']['value']
-            screenH = devices[0]['calibration']['screenH']['value']
-            aspect = screenW / screenH
-            wm.screenW = screenW
-            wm.screenH = screenH
-            wm.aspect = aspect
-            print(devices)
-            wm.numDevicesConnected = 1
-
-    print("Number of devices found: " + str(wm.numDevicesConnected))
-
-    print("Init Settings")
\ No newline at end of file
+        devices = response.get('devices') or []
+        # bpy may only be touched from the main thread
+        bpy.app.timers.register(lambda: on_devices_received(devices))
+
+def on_devices_received(devices):
+    """ Applies the answer of HoloPlay Service and revalidates the calibration cache """
+    if devices == []:
+        print("No Looking Glass devices found")
+    else:
+        print("Printing Devices")
+        print(devices)
+        try:
+            save_calibration_cache(devices)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # the device info is applied regardless, the cache is only a fallback for the next start
+            print("Could not write the calibration cache: " + str(e))
+    apply_devices(devices, True)
+    print("Number of devices found: " + str(numDevices))
+    # returning None unregisters the timer
+    return None
+
+def init():
+    print("Init Settings")
+    start_time = timeit.default_timer()
+
+    # use the cached calibration right away, HoloPlay Service might take a while to answer or not run at all
+    devices = load_calibration_cache()
+    if devices:
+        apply_devices(devices, False)
+        print("Loaded calibration of " + str(len(devices)) + " cached devices: %.6f" % (timeit.default_timer() - start_time))
+
+    threading.Thread(target=connect_to_service, name="LKG connect", daemon=True).start()
@@ -0,0 +1,126 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# Synthesizes the views between a few rendered anchor views by forward warping
+# them along the horizontal parallax axis. Does not import bpy.
+#
+# All views share the same camera rotation and only differ by the x-offset of
+# the modelview matrix and the x-offset of the projection matrix (see
+# OffScreenDraw.setup_modelview_matrices and setup_projection_matrices).
+# Moving from view a to view b therefore shifts a pixel at distance d by
+#
+#     width / 2 * (P[0][0] * (mv_b - mv_a) / d - (proj_b - proj_a))
+#
+# pixels, where mv is modelview[0][3] and proj is projection[0][2].
+
+import numpy as np
+
+def anchor_views(total_views, num_anchors):
+	''' Returns evenly spaced view indices including the first and the last view '''
+	num_anchors = max(2, min(num_anchors, total_views))
+	return sorted(set(int(round(i * (total_views - 1) / (num_anchors - 1))) for i in range(num_anchors)))
+
+def linearize_depth(depth, projection_matrix):
+	''' Converts 0-1 depth buffer values into distances from the camera '''
+	p22 = projection_matrix[2][2]
+	p23 = projection_matrix[2][3]
+	z_ndc = depth * 2.0 - 1.0
+	return p23 / (z_ndc + p22)
+
+class ViewSynthesizer:
+	''' Warps anchor views (uint8 color + 0-1 depth, rows bottom to top) into the views between them '''
+
+	def __init__(self, width, height):
+		self.width = width
+		self.height = height
+		self.anchors = {}
+		self._x = np.tile(np.arange(width, dtype=np.float32), height)
+		self._row_start = np.repeat(np.arange(height, dtype=np.int32) * width, width)
+		# one extra pixel at the end swallows everything warped out of the view
+		self._buffer = None
+		self._result = None
+		self._filled = np.empty(width * height + 1, dtype=bool)
+		self._columns = np.arange(width, dtype=np.int32)
+
+	def set_anchor(self, view, color, depth, modelview_matrix, projection_matrix):
+		''' Stores an anchor view, sorting its pixels far to near once so nearer pixels win when warping '''
+		distance = linearize_depth(depth.reshape(-1).astype(np.float32), projection_matrix).astype(np.float32)
+		order = np.argsort(-distance, kind='stable')
+		self.anchors[view] = {
+			'color': color.reshape(-1, color.shape[-1])[order],
+			'inv_distance': (1.0 / np.maximum(distance, 1e-6))[order],
+			'x': self._x[order],
+			'row_start': self._row_start[order],
+			'mv_x': modelview_matrix[0][3],
+			'proj_x': projection_matrix[0][2],
+			'p00': projection_matrix[0][0],
+			'raw_color': color,
+		}
+
+	def _warp(self, anchor, modelview_matrix, projection_matrix, out, filled):
+		''' Forward warps one anchor into out, marking the pixels it wrote in filled '''
+		scale = 0.5 * self.width
+		parallax = scale * anchor['p00'] * (modelview_matrix[0][3] - anchor['mv_x'])
+		lens_shift = scale * (projection_matrix[0][2] - anchor['proj_x'])
+		target_x = anchor['inv_distance'] * np.float32(parallax)
+		target_x += anchor['x']
+		target_x -= np.float32(lens_shift - 0.5)
+		target = target_x.astype(np.int32)
+		outside = (target_x < 0) | (target >= self.width)
+		target += anchor['row_start']
+		target[outside] = self.width * self.height
+		# duplicate targets keep the last write, the pixels are sorted far to near
+		out[target] = anchor['color']
+		filled[target] = True
+
+	def synthesize(self, view, modelview_matrix, projection_matrix, out):
+		''' Writes the view into out (height x width x channels), warping from the closest anchors on both sides '''
+		if view in self.anchors:
+			out[...] = self.anchors[view]['raw_color']
+			return out
+
+		anchor_indices = sorted(self.anchors)
+		left = max([a for a in anchor_indices if a < view], default=anchor_indices[0])
+		right = min([a for a in anchor_indices if a > view], default=anchor_indices[-1])
+		# warp the closer anchor last so it wins where both have an answer
+		if view - left <= right - view:
+			order = (right, left)
+		else:
+			order = (left, right)
+
+		channels = out.shape[-1]
+		if self._buffer is None or self._buffer.shape[1] != channels:
+			self._buffer = np.empty((self.width * self.height + 1, channels), dtype=np.uint8)
+		flat = self._buffer
+		flat.fill(0)
+		filled = self._filled
+		filled.fill(False)
+		for anchor in order:
+			self._warp(self.anchors[anchor], modelview_matrix, projection_matrix, flat, filled)
+
+		# fill the remaining holes with the closest filled pixel to the left in the same row
+		filled_2d = filled[:-1].reshape(self.height, self.width)
+		source = np.where(filled_2d, self._columns, 0)
+		np.maximum.accumulate(source, axis=1, out=source)
+		source += self._row_start.reshape(self.height, self.width)
+		# out is usually a tile of a quilt and thus not contiguous, gather into a scratch array first
+		if self._result is None or self._result.shape[1] != channels:
+			self._result = np.empty((self.width * self.height, channels), dtype=np.uint8)
+		np.take(flat, source.reshape(-1), axis=0, out=self._result)
+		out[...] = self._result.reshape(self.height, self.width, channels)
+		return out